@@ -1,14 +1,36 @@
 
 from MarketObjects import PriceData, parse_float, parse_date
-from MarketObjects import parse_date_time
+from MarketObjects import parse_date_time, parse_time, DateTimeParser
+from datetime import datetime, timedelta
+import numpy
+import pandas
+import hashlib
+import heapq
+import shutil
 import os
 import logging
+import threading
+import multiprocessing
+import Queue
+
+
+## identifies a source file by path, modification time and size
+def file_signature(filename):
+    source = os.path.abspath(filename)
+    st = os.stat(source)
+    return '|'.join([source,repr(st.st_mtime),str(st.st_size)])
 
 
 class DataFeed(object):
 
     SENTINEL = object()
 
+    ## column layout used by load_array()
+    ## COLUMNS = dict(PriceData field = file column)
+    ## TIME_COLUMN = None when the file only carries a date
+    COLUMNS = {}
+    TIME_COLUMN = None
+
     def __init__(self,filename,use_header=None):
         self.filename = filename
         self.file_buffer = open(filename,'r')
@@ -23,6 +45,9 @@ class DataFeed(object):
         self.header = [x.strip().lower() for x in self.header]
         self.count =0 
 
+        ## date/time layout is sniffed from the first rows of the file
+        self.date_parser = DateTimeParser()
+
         self.log = logging.getLogger(__name__)
         self.log.info('Data Source = %s',filename)
 
@@ -31,6 +56,12 @@ class DataFeed(object):
     def __iter__(self):
         return self
 
+    ## key for results computed off this feed (see FitnessCache)
+    ## changes when the file or the feed class changes
+    def fingerprint(self):
+        key = '|'.join([self.__class__.__name__,file_signature(self.filename)])
+        return hashlib.sha1(key).hexdigest()
+
     def reset(self):
         self.EOF = False
         self.file_buffer.close()
@@ -64,18 +95,84 @@ class DataFeed(object):
     def convert(self,line):
         raise NotImplementedError
 
+    def symbol_column(self,frame):
+        return frame['symbol'].astype(str).str.strip()
+
+    def load_array(self):
+        ## parse the whole file in one shot into a BarArray
+        ## timestamps and odd float formats are parsed once per unique string
+        ## with the same parsers next() uses, so the result is identical
+        ## to walking the file row by row.
+        ## falls back to the row by row build if the bulk parse fails
+
+        try:
+            bar_array = self._load_frame()
+        except Exception as e:
+            self.log.warning('bulk load failed for %s (%s), parsing row by row' % (self.filename,e))
+            feed = self.__class__(self.filename)
+            bar_array = BarArray.from_feed(feed)
+            feed.close()
+
+        self.log.info('loaded %d rows: %s' % (len(bar_array),self.filename))
+        return bar_array
+
+    def _load_frame(self):
+        text = [ x for x in ['date',self.TIME_COLUMN] if x ]
+        if self.use_header:
+            frame = pandas.read_csv(self.filename,header=None,names=self.header,
+                                    dtype=dict([(x,str) for x in text]),skipinitialspace=True)
+        else:
+            frame = pandas.read_csv(self.filename,skipinitialspace=True)
+            frame.columns = [ str(x).strip().lower() for x in frame.columns ]
+            frame[text] = frame[text].astype(str)
+
+        parser = DateTimeParser()
+        stamps = _factorized(frame['date'].str.strip(),lambda x: to_micros(parser.parse_date(x)))
+        if self.TIME_COLUMN:
+            stamps += _factorized(frame[self.TIME_COLUMN].str.strip(),_time_micros)
+
+        codes, symbols = pandas.factorize(self.symbol_column(frame))
+
+        columns = {}
+        for field, name in self.COLUMNS.iteritems():
+            col = frame[name]
+            if col.dtype.kind not in 'fi':
+                col = _factorized(col.astype(str).str.strip(),_float_or_nan)
+            columns[field] = numpy.asarray(col,dtype=numpy.float64)
+
+        return BarArray(numpy.asarray(stamps,dtype=numpy.int64),numpy.asarray(codes,dtype=numpy.int32),list(symbols),columns)
+
+
+## run func once per unique value of a column and spread the results back out
+def _factorized(column,func):
+    codes, uniques = pandas.factorize(column)
+    values = numpy.array([ func(x) for x in uniques ])
+    return values[codes]
+
+def _time_micros(time_str):
+    t = parse_time(time_str)
+    return ((t.hour * 60 + t.minutes) * 60 + t.seconds) * 1000000 + t.millis
+
+def _float_or_nan(float_string):
+    v = parse_float(float_string)
+    if v is None: return float('nan')
+    return v
+
 
 
 ## Date,Open,High,Low,Close,Volume,Adj Close (yahoo daily feed) , Symbol tacked on
 #2010-01-04,213.43,214.5,212.38,214.01,123432400,29.08,AAPL
 class DataFeedDaily(DataFeed):
+
+    COLUMNS = dict(open='open',high='high',low='low',close='close',trade_volume='volume')
+
     def __init__(self,filename):
         DataFeed.__init__(self,filename)
 
     def convert(self,line):
         m = PriceData()
         m.symbol = line['symbol']
-        m.timestamp = parse_date(line['date'])
+        m.timestamp = self.date_parser.parse_date(line['date'])
         m.open = parse_float(line['open'])
         m.high = parse_float(line['high'])
         m.low = parse_float(line['low'])
@@ -88,17 +185,24 @@ class DataFeedDaily(DataFeed):
 ## 20100104,1330,213.43,214.5,212.38,214.01,123432400,29.08,1,0,0.13
 ## it is ASSUMED that each file hold one symbol only - we will use  the filename given as the symbol name
 class DataFeed_QuantQuote1m(DataFeed):
+
+    COLUMNS = dict(open='open',high='high',low='low',close='close',trade_volume='volume')
+    TIME_COLUMN = 'time'
+
     def __init__(self,filename):
         ## Quant Quote files have no header:
         header = ['date','time','open','high','low','close','volume','splits','earnings','dividends']
         DataFeed.__init__(self,filename,use_header=header)
-        self.filename = os.path.basename(filename)
-        self.symbol = self.filename.split('.')[0]  ## take the non-CSV part as the symbol name
+        ## take the non-CSV part of the filename as the symbol name
+        self.symbol = os.path.basename(filename).split('.')[0]
+
+    def symbol_column(self,frame):
+        return pandas.Series([self.symbol] * len(frame))
 
     def convert(self,line):
         m = PriceData()
         m.symbol = self.symbol 
-        m.timestamp = parse_date_time(line['date'], line['time'])
+        m.timestamp = self.date_parser.parse_date_time(line['date'], line['time'])
         m.open = parse_float(line['open'])
         m.high = parse_float(line['high'])
         m.low = parse_float(line['low'])
@@ -110,13 +214,17 @@ class DataFeed_QuantQuote1m(DataFeed):
 ##     date,      time,       bid,       ask,    bidvol,    askvol   symbol
 ##  20100315,  08:30:00,  115.2500,  115.2700,     15400,      4600  SPY
 class DataFeedIntraday(DataFeed):
+
+    COLUMNS = dict(bid='bid',ask='ask',bid_volume='bidvol',ask_volume='askvol')
+    TIME_COLUMN = 'time'
+
     def __init__(self,filename):
         DataFeed.__init__(self,filename)
 
     def convert(self,line):
         m = PriceData()
         m.symbol = line['symbol']
-        m.timestamp = parse_date_time(line['date'], line['time'])
+        m.timestamp = self.date_parser.parse_date_time(line['date'], line['time'])
         m.bid = parse_float(line['bid'])
         m.ask = parse_float(line['ask'])
         m.bid_volume = parse_float(line['bidvol'])
@@ -126,13 +234,17 @@ class DataFeedIntraday(DataFeed):
 ##     date,      time,       open, high, low, close, volume, symbol 
 ##  20100315,  08:30:00,  115.2500,  115.2700,     15400,      4600  SPY
 class DataFeedBars(DataFeed):
+
+    COLUMNS = dict(open='open',high='high',low='low',close='close',trade_volume='volume')
+    TIME_COLUMN = 'time'
+
     def __init__(self,filename):
         DataFeed.__init__(self,filename)
 
     def convert(self,line):
         m = PriceData()
         m.symbol = line['symbol']
-        m.timestamp = parse_date_time(line['date'], line['time'])
+        m.timestamp = self.date_parser.parse_date_time(line['date'], line['time'])
         m.open = parse_float(line['open'])
         m.high = parse_float(line['high'])
         m.low = parse_float(line['low'])
@@ -140,10 +252,284 @@ class DataFeedBars(DataFeed):
         m.trade_volume = parse_float(line['volume'])
         return m
 
+## BarArray holds a complete data file in typed columns:
+## timestamps as int64 microseconds since EPOCH, prices/volumes as float64
+## (NaN standing in for missing values) and the symbol dictionary-encoded
+## as int32 codes into self.symbols.
+## only the price columns a data file actually populates are kept.
+
+EPOCH = datetime(1970,1,1)
+
+def to_micros(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class BarArray(object):
+
+    FIELDS = ('open','high','low','close','trade_volume','bid','ask','bid_volume','ask_volume')
+
+    ## rows converted to python values at a time during replay
+    CHUNK = 4096
+
+    def __init__(self,timestamp,symbol,symbols,columns):
+        self.timestamp = timestamp
+        self.symbol = symbol
+        self.symbols = symbols
+        ## dict(field = float64 array)
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @classmethod
+    def from_feed(cls,data_feed):
+        ## generic build - walks a DataFeed row by row until its SENTINEL
+        stamps = []
+        codes = []
+        symbols = []
+        lookup = {}
+        values = dict([(f,[]) for f in cls.FIELDS])
+        nan = float('nan')
+
+        while True:
+            m = data_feed.next()
+            if m is DataFeed.SENTINEL:
+                break
+            stamps.append(to_micros(m.timestamp))
+            try:
+                codes.append(lookup[m.symbol])
+            except KeyError:
+                lookup[m.symbol] = len(symbols)
+                codes.append(len(symbols))
+                symbols.append(m.symbol)
+            for f in cls.FIELDS:
+                v = getattr(m,f)
+                values[f].append(nan if v is None else v)
+
+        columns = {}
+        for f in cls.FIELDS:
+            col = numpy.array(values[f],dtype=numpy.float64)
+            if len(col) and not numpy.isnan(col).all():
+                columns[f] = col
+
+        return cls(numpy.array(stamps,dtype=numpy.int64),numpy.array(codes,dtype=numpy.int32),symbols,columns)
+
+    def save(self,path):
+        ## one .npy file per column, plus the symbol dictionary
+        os.makedirs(path)
+        numpy.save(os.path.join(path,'timestamp.npy'),self.timestamp)
+        numpy.save(os.path.join(path,'symbol.npy'),self.symbol)
+        for f, col in self.columns.iteritems():
+            numpy.save(os.path.join(path,'%s.npy' % f),col)
+        with open(os.path.join(path,'symbols.txt'),'w') as f:
+            for sym in self.symbols:
+                f.write('%s\n' % ('' if sym is None else sym))
+
+    @classmethod
+    def load(cls,path,mmap_mode='r'):
+        timestamp = numpy.load(os.path.join(path,'timestamp.npy'),mmap_mode=mmap_mode)
+        symbol = numpy.load(os.path.join(path,'symbol.npy'),mmap_mode=mmap_mode)
+        columns = {}
+        for f in cls.FIELDS:
+            fname = os.path.join(path,'%s.npy' % f)
+            if os.path.exists(fname):
+                columns[f] = numpy.load(fname,mmap_mode=mmap_mode)
+        with open(os.path.join(path,'symbols.txt'),'r') as f:
+            symbols = [ x[:-1] or None for x in f ]
+        return cls(timestamp,symbol,symbols,columns)
+
+    @classmethod
+    def concat(cls,arrays):
+        ## one array of the rows of arrays, one after the other.
+        ## symbol codes are mapped onto one dictionary, a field
+        ## missing from some of the arrays is NaN in their rows
+        symbols = []
+        lookup = {}
+        codes = []
+        for bar_array in arrays:
+            remap = []
+            for sym in bar_array.symbols:
+                if sym not in lookup:
+                    lookup[sym] = len(symbols)
+                    symbols.append(sym)
+                remap.append(lookup[sym])
+            codes.append(numpy.asarray(remap,dtype=numpy.int32)[bar_array.symbol])
+
+        fields = set()
+        for bar_array in arrays:
+            fields.update(bar_array.columns.keys())
+        columns = {}
+        for f in fields:
+            columns[f] = numpy.concatenate([ a.columns[f] if f in a.columns else numpy.full(len(a),numpy.nan)
+                                             for a in arrays ])
+
+        return cls(numpy.concatenate([ a.timestamp for a in arrays ]),numpy.concatenate(codes),symbols,columns)
+
+    def take(self,index):
+        ## the rows at index (a copy)
+        columns = dict([ (f,col[index]) for f, col in self.columns.iteritems() ])
+        return BarArray(self.timestamp[index],self.symbol[index],self.symbols,columns)
+
+    def slice(self,start,stop):
+        ## rows [start,stop) as views into this array's columns - no copy
+        columns = dict([ (f,col[start:stop]) for f, col in self.columns.iteritems() ])
+        return BarArray(self.timestamp[start:stop],self.symbol[start:stop],self.symbols,columns)
+
+    def between(self,begin=None,end=None):
+        ## (start, stop) rows of the timestamps in [begin,end),
+        ## the array must be in timestamp order
+        start, stop = 0, len(self)
+        if begin is not None:
+            start = int(numpy.searchsorted(self.timestamp,to_micros(begin),'left'))
+        if end is not None:
+            stop = int(numpy.searchsorted(self.timestamp,to_micros(end),'left'))
+        return start, max(start,stop)
+
+    def feed(self,filename=None,chunk=None):
+        ## a fresh DataFeed style iterator over this array -
+        ## any number of feeds (simulations) can share one BarArray
+        return DataFeedArray(self,filename,chunk)
+
+    def rows(self,start,stop):
+        ## build PriceData objects for rows [start,stop)
+        ## columns are pulled out in bulk with tolist() -
+        ## no per row numpy scalar access
+        stamps = self.timestamp[start:stop].tolist()
+        codes = self.symbol[start:stop].tolist()
+        fields = [ (f,col[start:stop].tolist()) for f, col in self.columns.iteritems() ]
+        symbols = self.symbols
+        out = []
+        for i, ts in enumerate(stamps):
+            m = PriceData()
+            m.timestamp = from_micros(ts)
+            m.symbol = symbols[codes[i]]
+            for f, col in fields:
+                v = col[i]
+                if v == v: setattr(m,f,v)    ## NaN = missing value
+            out.append(m)
+        return out
+
+
+## replays a BarArray with the same protocol as DataFeed:
+## PriceData objects, one DataFeed.SENTINEL at the end, then StopIteration
+## several DataFeedArray can share one BarArray
+class DataFeedArray(object):
+
+    def __init__(self,bar_array,filename=None,chunk=None):
+        self.array = bar_array
+        self.filename = filename
+        ## rows built per refill of the buffer
+        self.chunk = chunk or BarArray.CHUNK
+        self.count = 0
+        self.EOF = False
+        self.buffer = []
+
+        self.log = logging.getLogger(__name__)
+
+    def __iter__(self):
+        return self
+
+    ## content hash of the bars (the array may not come from a file)
+    def fingerprint(self):
+        sha = hashlib.sha1(self.array.timestamp.tostring())
+        sha.update(self.array.symbol.tostring())
+        sha.update('|'.join(map(str,self.array.symbols)))
+        for f in BarArray.FIELDS:
+            if f in self.array.columns:
+                sha.update(self.array.columns[f].tostring())
+        return sha.hexdigest()
+
+    def reset(self):
+        self.EOF = False
+        self.count = 0
+        self.buffer = []
+
+    def next(self):
+        if not self.EOF:
+            if not self.buffer:
+                start = self.count
+                stop = min(len(self.array),start + self.chunk)
+                if start >= stop:
+                    self.EOF = True
+                    return DataFeed.SENTINEL
+                self.buffer = self.array.rows(start,stop)
+                self.buffer.reverse()
+            self.count += 1
+            return self.buffer.pop()
+        else:
+            raise StopIteration()
+
+    def close(self):
+        pass
+
+
+## converts a source file once into a columnar binary cache
+## and hands back the memory mapped BarArray on every later request.
+## cache entries are keyed on the source path + mtime (+ size and DataFeed class)
+## so an edited source file is simply converted again.
+class BarCache(object):
+
+    VERSION = 1
+
+    def __init__(self,cache_dir=None):
+        ## cache_dir = None puts the cache next to each source file
+        self.cache_dir = cache_dir
+        self.log = logging.getLogger(__name__)
+
+    def path(self,filename,data_class):
+        source = os.path.abspath(filename)
+        key = '|'.join([file_signature(source),data_class.__name__,str(BarCache.VERSION)])
+        key = hashlib.sha1(key).hexdigest()[:16]
+        root = self.cache_dir
+        if not root:
+            root = os.path.join(os.path.dirname(source),'.bar_cache')
+        return os.path.join(root,'%s.%s' % (os.path.basename(source),key))
+
+    def load(self,filename,data_class):
+        path = self.path(filename,data_class)
+        if not os.path.exists(path):
+            self.log.info('building bar cache: %s -> %s' % (filename,path))
+            data_feed = data_class(filename)
+            bar_array = data_feed.load_array()
+            data_feed.close()
+            ## build aside and rename, so a half written entry is never picked up
+            tmp = '%s.tmp%d' % (path,os.getpid())
+            parent = os.path.dirname(path)
+            if not os.path.exists(parent):
+                try:
+                    os.makedirs(parent)
+                except OSError:
+                    pass
+            bar_array.save(tmp)
+            try:
+                os.rename(tmp,path)
+            except OSError:
+                ## another process got there first
+                shutil.rmtree(tmp,ignore_errors=True)
+        else:
+            self.log.info('using bar cache: %s' % path)
+
+        return BarArray.load(path)
+
+
 ## take a list of data files and provides data 
 ## as a continuous data stream - data is fed in the order of the list
 ## data_type indicates which type of DataFeed object is created 
 ## for each file in the list
+## cache=True replays each file from a memory mapped columnar cache (see BarCache)
+## instead of parsing the text file on every pass
+## preload=True bulk loads each file once (DataFeed.load_array) and
+## replays it from memory on every later pass
+##
+## mode='merge' opens all the files at once and streams a single
+## time ordered sequence (k-way heap merge, ties broken by symbol then list order)
+## holding one buffered row per file - i.e. a universe of per symbol files
+## without a pre-merged file. each file must be time ordered itself.
+## a single SENTINEL (EOD) is sent once every file is drained.
 
 class DataFeedList(object):
 
@@ -152,7 +538,12 @@ class DataFeedList(object):
                                 B=DataFeedBars,
                                 Q1m=DataFeed_QuantQuote1m)
 
-    def __init__(self,filename_list,data_type):
+    MODES = ('concat','merge')
+
+    def __init__(self,filename_list,data_type,cache=False,cache_dir=None,preload=False,mode='concat'):
+        if mode not in DataFeedList.MODES:
+            raise ValueError("DataFeedList mode must be one of %s, got '%s'" % (DataFeedList.MODES,mode))
+        self.mode = mode
         self.data_class = DataFeedList.DATA_CLASS_LIBRARY[data_type]
         self.master_list = filename_list[::-1]
         self.filename_list = self.master_list[:] 
@@ -160,22 +551,120 @@ class DataFeedList(object):
 
         self.file_number = 0
 
+        self.cache = None
+        if cache:
+            self.cache = BarCache(cache_dir)
+        self.preload = preload
+        ## BarArrays already loaded/mapped in - dict(filename = BarArray)
+        self.arrays = {}
+
+        ## merge mode state: heap of (timestamp, symbol, file index, PriceData)
+        self.heap = None
+        self.feeds = []
+        self.EOD = False
+
         self.log = logging.getLogger(__name__)
 
+    def fingerprint(self):
+        key = [self.data_class.__name__,self.mode]
+        key.extend([ file_signature(f) for f in self.master_list ])
+        return hashlib.sha1('\n'.join(key)).hexdigest()
+
     def reset(self):
         self.filename_list = self.master_list[:]
+        self.data_feed = None
+        self.file_number = 0
+        for feed in self.feeds:
+            feed.close()
+        self.feeds = []
+        self.heap = None
         
     def __iter__(self):
         return self
 
+    def load_array(self,filename):
+        try:
+            return self.arrays[filename]
+        except KeyError:
+            if self.cache:
+                bar_array = self.cache.load(filename,self.data_class)
+            else:
+                data_feed = self.data_class(filename)
+                bar_array = data_feed.load_array()
+                data_feed.close()
+            self.arrays[filename] = bar_array
+            return bar_array
+
+    def bar_array(self):
+        ## every file of the list loaded into one BarArray, rows in
+        ## the order next() plays them (a SENTINEL aside)
+        arrays = [ self.load_array(f) for f in self.master_list[::-1] ]
+        bar_array = BarArray.concat(arrays)
+        if self.mode == 'merge':
+            ## time, then symbol, then list order, as the heap merge - symbols
+            ## ranked as the heap compares them (None first), not as strings
+            symbols = bar_array.symbols
+            rank = numpy.empty(len(symbols),dtype=numpy.int64)
+            rank[sorted(range(len(symbols)),key=symbols.__getitem__)] = numpy.arange(len(symbols))
+            files = numpy.repeat(numpy.arange(len(arrays)),[ len(a) for a in arrays ])
+            order = numpy.lexsort((files,rank[bar_array.symbol],bar_array.timestamp))
+            bar_array = bar_array.take(order)
+        return bar_array
+
+    def _open(self,filename,chunk=None):
+        if self.cache or self.preload:
+            return self.load_array(filename).feed(filename,chunk)
+        return self.data_class(filename)
+
+    def _push(self,index):
+        ## buffer the next row of feed[index] on the heap
+        market_data = self.feeds[index].next()
+        if market_data is DataFeed.SENTINEL:
+            self.feeds[index].close()
+        else:
+            heapq.heappush(self.heap,(market_data.timestamp,market_data.symbol,index,market_data))
+
+    def _start_merge(self):
+        self.heap = []
+        self.feeds = []
+        while self.filename_list:
+            next_file = self.filename_list.pop()
+            self.file_number += 1
+            try:
+                ## one row buffered per file
+                self.feeds.append(self._open(next_file,chunk=1))
+            except Exception as e:
+                self.log.critical('cannot create DataFeed for file: %s' % next_file)
+                self.log.critical(e)
+        self.log.debug("merging %d data files" % len(self.feeds))
+        for index in xrange(len(self.feeds)):
+            self._push(index)
+
+    def _next_merged(self):
+        if self.heap is None:
+            self._start_merge()
+            ## SENTINEL still owed at the end of the merge
+            self.EOD = True
+        if self.heap:
+            timestamp, symbol, index, market_data = heapq.heappop(self.heap)
+            self._push(index)
+            return market_data
+        if self.EOD:
+            self.EOD = False
+            return DataFeed.SENTINEL
+        raise StopIteration
+
     def next(self):
+        if self.mode == 'merge':
+            return self._next_merged()
+
         if not self.data_feed or self.data_feed.EOF:
             while self.filename_list: 
                 next_file = self.filename_list.pop()
                 self.file_number += 1
                 self.log.debug("data file = %s, file_number = %d" % (next_file, self.file_number))
                 try:
-                    self.data_feed = self.data_class(next_file)
+                    self.data_feed = self._open(next_file)
                     return self.data_feed.next()
                 except Exception as e:
                     self.data_feed = None
@@ -188,12 +677,152 @@ class DataFeedList(object):
 
 
 
+## DataFeedPrefetch wraps any DataFeed/DataFeedList (anything with next() and reset())
+## and parses ahead into a bounded buffer of row batches, so the parse work
+## overlaps with the simulation consuming the rows.
+##   batch_size = rows per batch handed over
+##   depth = max batches buffered ahead
+##   process=False parses on a worker thread (overlap limited to the work
+##       that releases the GIL: file reads, numpy/pandas loads)
+##   process=True parses in a forked worker process and ships the batches back pickled
+## stats() reports buffer depth and stall counters:
+##   consumer_stalls = the simulation waited on an empty buffer (parse/IO bound)
+##   producer_stalls = the parser waited on a full buffer (simulation/compute bound)
 
+class DataFeedPrefetch(object):
 
+    ## SENTINEL stand-in that survives pickling between processes
+    SENTINEL_MARK = '__DataFeed.SENTINEL__'
 
+    def __init__(self,data_feed,batch_size=256,depth=8,process=False):
+        self.data_feed = data_feed
+        self.batch_size = batch_size
+        self.depth = depth
+        self.process = process
 
+        self.worker = None
+        self.queue = None
+        self.stop = None
+        self.batch = []
+        self.done = False
 
+        self.consumer_stalls = 0
+        self.producer_stalls = multiprocessing.Value('i',0)
+        self.batches = 0
+        self.rows = 0
+        self.depth_sum = 0
 
+        self.log = logging.getLogger(__name__)
 
+    def __iter__(self):
+        return self
 
+    def _start(self):
+        if self.process:
+            self.queue = multiprocessing.Queue(self.depth)
+            self.stop = multiprocessing.Event()
+            self.worker = multiprocessing.Process(target=_prefetch,args=(self.data_feed,self.queue,self.stop,self.batch_size,self.producer_stalls))
+        else:
+            self.queue = Queue.Queue(self.depth)
+            self.stop = threading.Event()
+            self.worker = threading.Thread(target=_prefetch,args=(self.data_feed,self.queue,self.stop,self.batch_size,self.producer_stalls))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def _shutdown(self):
+        if self.worker:
+            self.stop.set()
+            ## unblock a producer waiting on a full buffer
+            while self.worker.is_alive():
+                try:
+                    self.queue.get(timeout=0.01)
+                except Queue.Empty:
+                    pass
+            self.worker.join()
+        self.worker = None
+        self.queue = None
+
+    def fingerprint(self):
+        return self.data_feed.fingerprint()
+
+    def reset(self):
+        self._shutdown()
+        self.data_feed.reset()
+        self.batch = []
+        self.done = False
+
+        ## counters are per pass over the data
+        self.consumer_stalls = 0
+        self.producer_stalls.value = 0
+        self.batches = 0
+        self.rows = 0
+        self.depth_sum = 0
 
+    def close(self):
+        self._shutdown()
+
+    def next(self):
+        while not self.batch:
+            if self.done:
+                raise StopIteration()
+            if not self.worker:
+                self._start()
+
+            depth = self.queue.qsize()
+            if depth == 0:
+                self.consumer_stalls += 1
+            self.depth_sum += depth
+
+            batch = self.queue.get()
+            if isinstance(batch,Exception):
+                self._shutdown()
+                raise batch
+            if batch is None:
+                ## end of data
+                self.done = True
+                self._shutdown()
+                self.log.info('prefetch: %s' % self.stats())
+            else:
+                self.batches += 1
+                self.rows += len(batch)
+                batch.reverse()
+                self.batch = batch
+
+        market_data = self.batch.pop()
+        if market_data == DataFeedPrefetch.SENTINEL_MARK:
+            return DataFeed.SENTINEL
+        return market_data
+
+    def stats(self):
+        avg_depth = 0
+        if self.batches: avg_depth = self.depth_sum / float(self.batches)
+        return dict(batches=self.batches,rows=self.rows,batch_size=self.batch_size,depth=self.depth,
+                    avg_depth=avg_depth,consumer_stalls=self.consumer_stalls,
+                    producer_stalls=self.producer_stalls.value)
+
+
+## producer loop run on the worker thread/process
+## batches are put on the queue, None marks the end of the data
+def _prefetch(data_feed,queue,stop,batch_size,producer_stalls):
+    try:
+        batch = []
+        while not stop.is_set():
+            try:
+                market_data = data_feed.next()
+                if market_data is DataFeed.SENTINEL:
+                    market_data = DataFeedPrefetch.SENTINEL_MARK
+                batch.append(market_data)
+            except StopIteration:
+                market_data = None
+
+            if len(batch) >= batch_size or (market_data is None and batch):
+                if queue.full():
+                    with producer_stalls.get_lock():
+                        producer_stalls.value += 1
+                queue.put(batch)
+                batch = []
+            if market_data is None:
+                queue.put(None)
+                break
+    except Exception as e:
+        queue.put(e)
@@ -37,19 +37,42 @@ class DQueue(object):
 		with self.lock:
 			return len(self.items) == 0
 
+## publish a message for sharing by reference:
+## records that support it are published as one frozen (read only) copy,
+## so the producer keeps changing its own record as before and
+## consumers that need to change one work on a copy()
+## returns None for items that cannot be frozen (they get deep copies)
+def freeze(item):
+	if getattr(item,'frozen',False):
+		return item
+	try:
+		return item.copy().freeze()
+	except (AttributeError, TypeError):
+		return None
+
 ## replicating output queue
 ## new() creates a new DQueue upon
 ## which all puts to the output are copied
+## share=True publishes one frozen copy of the item to every queue
+## share=False hands each queue its own deep copy
 class OutQueue(object):
-	def __init__(self):
+	def __init__(self,share=True):
 		self.mux = []
+		self.share = share
 
 	def put(self,item):
-		for queue in self.mux:
-			queue.put(copy.deepcopy(item))
-
-	def new(self):
-		queue = DQueue()
+		shared = freeze(item) if self.share else None
+		if shared is not None:
+			for queue in self.mux:
+				queue.put(shared)
+		else:
+			for queue in self.mux:
+				queue.put(copy.deepcopy(item))
+
+	## queue = existing queue to attach (i.e. a consumer's merged queue)
+	def new(self,queue=None):
+		if queue is None:
+			queue = DQueue()
 		self.mux.append(queue)
 		return queue
 
@@ -67,7 +90,8 @@ class OutQueue(object):
 class OrderHandler(object):
 	def __init__(self):
 		self.items = collections.deque()
-		self.qbank = {}
+		## flush children in the order they were added
+		self.qbank = collections.OrderedDict()
 		self.qindex = 0
 		self.lock = Lock()
 
@@ -78,6 +102,10 @@ class OrderHandler(object):
 			self.qindex += 1
 		self.qbank[key] = queue
 
+	## subscribe to a producer's OutQueue
+	def connect(self,out_queue,owner=None):
+		self.add_queue(out_queue.new(),owner)
+
 	def _flush_children(self):
 		for queue in self.qbank.values():
 			while queue:
@@ -122,12 +150,15 @@ class OrderHandler(object):
 ## child queues that are attached to it
 ## this is queue build for centralized 
 ## fill DISTRIBUTION to mulitple child queues
+## share=True: one frozen copy of the fill goes
+## to the child queue and the drop-copy
 class FillHandler(object):
-	def __init__(self):
+	def __init__(self,share=True):
 		## items acts a composite drop-copy of all fills
 		self.items = collections.deque()
 		self.qbank = {}
 		self.lock = Lock()
+		self.share = share
 
 	def add_queue(self,queue,owner):
 		self.qbank[owner] = queue
@@ -136,8 +167,18 @@ class FillHandler(object):
 	def put(self,item,owner):
 		with self.lock:
 			queue = self.qbank[owner]
-			queue.put(item)
-			self.items.append(copy.deepcopy(item))
+			shared = freeze(item) if self.share else None
+			if shared is not None:
+				queue.put(shared)
+				self.items.append(shared)
+			else:
+				queue.put(item)
+				self.items.append(copy.deepcopy(item))
+
+	## to the owner only, not the drop-copy (i.e. a cancel ack)
+	def ack(self,item,owner):
+		with self.lock:
+			self.qbank[owner].put(item)
 
 	def get(self):
 		with self.lock:
@@ -192,3 +233,70 @@ class DataLatch(object):
 		self.blocking_queue.put(data)
 
 
+
+##
+## single threaded (simulation) versions of the queues above:
+## no locks, for use when everything runs from one thread via on_data_sim()
+##
+
+## DQueue without the lock
+class SimQueue(collections.deque):
+
+	put = collections.deque.append
+	get = collections.deque.popleft
+
+	def peek(self):
+		return self[0]
+
+	def empty(self):
+		return len(self) == 0
+
+## OrderHandler without the lock:
+## producers put straight into one pre-merged queue
+## (arrival order) instead of child queues flushed on every call
+class SimOrderHandler(SimQueue):
+
+	def connect(self,out_queue,owner=None):
+		out_queue.new(self)
+
+## FillHandler without the lock
+class SimFillHandler(SimQueue):
+
+	def __init__(self,share=True):
+		super(SimFillHandler,self).__init__()
+		self.qbank = {}
+		self.share = share
+
+	def add_queue(self,queue,owner):
+		self.qbank[owner] = queue
+
+	def put(self,item,owner):
+		queue = self.qbank[owner]
+		shared = freeze(item) if self.share else None
+		if shared is not None:
+			queue.put(shared)
+			self.append(shared)
+		else:
+			queue.put(item)
+			self.append(copy.deepcopy(item))
+
+	def ack(self,item,owner):
+		self.qbank[owner].put(item)
+
+## DataLatch without the blocking queue:
+## on a single thread there is nothing to wait for,
+## it only keeps the trap/notify count
+class SimDataLatch(object):
+	def __init__(self,size):
+		self.size = size
+		self.counter = 0
+		self.data = None
+
+	def notify(self):
+		self.counter += 1
+		if self.counter >= self.size:
+			self.data = None
+			self.counter = 0
+
+	def trap(self,data):
+		self.data = data
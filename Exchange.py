@@ -1,22 +1,186 @@
 
-from MarketObjects import Order, Fill
-from DataQueues import OrderHandler, FillHandler
+from MarketObjects import Order, Fill, OrderCancel, OrderReplace
+from DataQueues import OrderHandler, FillHandler, SimOrderHandler, SimFillHandler
 from threading import Thread, Lock
 import collections
+import bisect
+import heapq
 import logging
 
-class Exchange(Thread):
+
+## resting order_ids by price level,
+## level prices kept sorted so a tick can bisect to the crossed levels
+class PriceLadder(object):
 
     def __init__(self):
+        self.prices = []
+        self.levels = {}
+
+    def add(self,price,order_id):
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = []
+            bisect.insort(self.prices,price)
+        level.append(order_id)
+
+    def remove(self,price,order_id):
+        level = self.levels.get(price)
+        if level and order_id in level:
+            level.remove(order_id)
+            if not level:
+                del self.levels[price]
+                del self.prices[bisect.bisect_left(self.prices,price)]
+
+    ## order_ids resting at price levels <= price
+    def at_or_below(self,price):
+        ids = []
+        for p in self.prices[:bisect.bisect_right(self.prices,price)]:
+            ids.extend(self.levels[p])
+        return ids
+
+    ## order_ids resting at price levels >= price
+    def at_or_above(self,price):
+        ids = []
+        for p in self.prices[bisect.bisect_left(self.prices,price):]:
+            ids.extend(self.levels[p])
+        return ids
+
+    def __len__(self):
+        return len(self.prices)
+
+
+## resting orders for one symbol:
+## an order_id -> order index, with
+##  - a time priority heap of (timestamp, seq, order_id) for MKT/MOO/MOC
+##  - bid/ask price ladders for LMT, STP and STPLMT
+## heap removal is lazy: entries whose (timestamp, seq) no longer matches
+## the order's priority are skipped, and compacted away when they pile up
+class OrderBook(object):
+
+    def __init__(self,symbol):
+        self.symbol = symbol
+        self.heap = []
+        self.orders = {}
+        self.priority = {}
+        self.seq = 0
+        self.limits = { Order.BUY: PriceLadder(), Order.SELL: PriceLadder() }
+        self.stops = { Order.BUY: PriceLadder(), Order.SELL: PriceLadder() }
+        ## stop limits whose stop was hit, now resting as limits
+        self.triggered = set()
+
+    def add(self,order):
+        oid = order.order_id
+        self.orders[oid] = order
+        self.priority[oid] = (order.timestamp,self.seq)
+        self.seq += 1
+        if order.order_type == Order.LIMIT:
+            self.limits[order.side].add(order.limit_price,oid)
+        elif order.order_type in (Order.STOP, Order.STOP_LIMIT):
+            self.stops[order.side].add(order.stop_price,oid)
+        else:
+            heapq.heappush(self.heap,self.priority[oid] + (oid,))
+
+    def get(self,order_id):
+        return self.orders.get(order_id)
+
+    ## swap in a new version of a resting order (keeps its priority,
+    ## prices must be unchanged - see remove() / add() for a reprice)
+    def replace(self,order):
+        self.orders[order.order_id] = order
+
+    def remove(self,order_id):
+        order = self.orders.pop(order_id,None)
+        if order is None:
+            return None
+        del self.priority[order_id]
+        if order_id in self.triggered:
+            self.triggered.discard(order_id)
+            self.limits[order.side].remove(order.limit_price,order_id)
+        elif order.order_type == Order.LIMIT:
+            self.limits[order.side].remove(order.limit_price,order_id)
+        elif order.order_type in (Order.STOP, Order.STOP_LIMIT):
+            self.stops[order.side].remove(order.stop_price,order_id)
+        elif len(self.heap) > 2 * len(self.orders) + 16:
+            self.compact()
+        return order
+
+    ## stop limit hit its stop: move it to the limit ladder
+    def trigger(self,order):
+        oid = order.order_id
+        self.stops[order.side].remove(order.stop_price,oid)
+        self.limits[order.side].add(order.limit_price,oid)
+        self.triggered.add(oid)
+
+    def live(self,entry):
+        return self.priority.get(entry[2]) == entry[:2]
+
+    def compact(self):
+        self.heap = [ x for x in self.heap if self.live(x) ]
+        heapq.heapify(self.heap)
+
+    ## pop the heap entries of orders live at timestamp, in time priority
+    ## hand them back with requeue() once processed
+    def due(self,timestamp):
+        entries = []
+        while self.heap and self.heap[0][0] <= timestamp:
+            entry = heapq.heappop(self.heap)
+            if self.live(entry):
+                entries.append(entry)
+        return entries
+
+    def requeue(self,entries):
+        for entry in entries:
+            if self.live(entry):
+                heapq.heappush(self.heap,entry)
+
+    ## order_ids on the ladders whose price levels the tick crossed:
+    ## buy_px = best price a buyer could get, sell_px = best for a seller
+    ## high/low = traded range (stops trigger on it)
+    def crossed(self,buy_px,sell_px,high,low):
+        ids = []
+        if buy_px is not None:
+            ids.extend(self.limits[Order.BUY].at_or_above(buy_px))
+        if sell_px is not None:
+            ids.extend(self.limits[Order.SELL].at_or_below(sell_px))
+        if high is not None:
+            ids.extend(self.stops[Order.BUY].at_or_below(high))
+        if low is not None:
+            ids.extend(self.stops[Order.SELL].at_or_above(low))
+        return ids
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self):
+        ## resting orders in time priority
+        return (self.orders[x] for x in sorted(self.orders,key=self.priority.get))
+
+
+def _first(*values):
+    for v in values:
+        if v is not None:
+            return v
+    return None
+
+
+class Exchange(Thread):
+
+    ## threaded=False: lock free queues for single threaded simulation
+    def __init__(self,threaded=True):
 
         super(Exchange,self).__init__()
 
-        self.IN_orders = OrderHandler() 
-        self.OUT_fills = FillHandler() 
+        if threaded:
+            self.IN_orders = OrderHandler() 
+            self.OUT_fills = FillHandler() 
+        else:
+            self.IN_orders = SimOrderHandler()
+            self.OUT_fills = SimFillHandler()
         self.latch = None 
         self.lock = Lock()
         self.running = True
-        self.order_book = collections.defaultdict(list)
+        ## dict[symbol] = OrderBook
+        self.order_book = {}
 
         self.current_timestamp = None
 
@@ -24,6 +188,26 @@ class Exchange(Thread):
         ## per symbol.
         self.current_data = {}
 
+        ## last tick processed per symbol, kept whether or not the symbol
+        ## has a book (MOC orders fill at its close)
+        self.last_data = {}
+
+        ## volume left to fill against on the current tick, per side
+        ## None = no volume info, no limit
+        self.volume = {}
+        ## shared_volume=False (default): each order is checked against
+        ## the tick's whole volume on its own, as the exchange always did.
+        ## True: the orders a tick fills draw on one volume budget per side,
+        ## in time priority, so together they never fill more than the tick traded
+        self.shared_volume = False
+
+        self.fill_funcs = { Order.MARKET: self.market_order,
+                            Order.LIMIT: self.limit_order,
+                            Order.STOP: self.stop_order,
+                            Order.STOP_LIMIT: self.stop_limit_order,
+                            Order.MOO: self.moo_order,
+                            Order.MOC: self.moc_order }
+
         self.log = logging.getLogger(__name__)
 
     ##NOTE that add() takes something that looks like the strategy
@@ -31,117 +215,255 @@ class Exchange(Thread):
     ##this allow distributed placement of actual strategies
     def add(self,strategy):
 
-        self.IN_orders.add_queue(strategy.OUT_orders.new(),strategy.name)
+        self.IN_orders.connect(strategy.OUT_orders,strategy.name)
         self.OUT_fills.add_queue(strategy.IN_fills,strategy.name)
 
-    def market_order(self,price_data, order):
-        fill = None
-        ts = price_data.timestamp
+    ## orders arrive frozen and shared with the other consumers
+    ## copy-on-write: swap a private copy into the book before changing one
+    def writable(self, order):
+        if not order.frozen:
+            return order
+        order = order.copy()
+        self.order_book[order.symbol].replace(order)
+        return order
+
+    ## fill as much of the order as the tick's volume allows
+    def execute(self, order, price, price_data, timestamp=None):
+        qty = order.qty_left
+        avail = self.volume.get(order.side)
+        if avail is not None:
+            qty = min(qty,avail)
+            if self.shared_volume:
+                self.volume[order.side] = avail - qty
+        if qty <= 0:
+            return None
+
+        ## adjust order amt exchange needs to fill
+        order = self.writable(order)
+        order.qty_left -= qty
+
+        if timestamp is None: timestamp = price_data.timestamp
+        return Fill(order.symbol,price,qty,order.side,timestamp,order.order_id,qty_left=order.qty_left)
+
+    ## fills at the quote, or the trade price (close) when there is no quote
+    def market_order(self, price_data, order):
+        if order.side == Order.BUY:
+            price = price_data.ask if price_data.ask else price_data.close
+        else:
+            price = price_data.bid if price_data.bid else price_data.close
+        return self.execute(order,price,price_data)
+
+    ## fills at the limit, or better if the tick opens (or quotes) through it
+    def limit_order(self, price_data, order):
         if order.side == Order.BUY:
-            fill_amt = order.qty
             if price_data.ask:
-                fill_price = price_data.ask
-                if price_data.ask_volume:
-                    if price_data.ask_volume < order.qty:
-                        fill_amt = price_data.ask_volume
-                        ## adjust order amt exchange needs to fill
-                        order.qty -= fill_amt
+                if price_data.ask > order.limit_price: return None
+                price = price_data.ask
             else:
-                fill_price = price_data.close
-                if price_data.trade_volume < order.qty:
-                    fill_amt = price_data.trade_volume
-                    ## adjust order amt exchange needs to fill
-                    order.qty -= fill_amt
-
-            fill = Fill(order.symbol,fill_price,fill_amt,order.side,ts,order.order_id)
-
-        if order.side == Order.SELL:
-            fill_amt = order.qty
+                if _first(price_data.low,price_data.close) > order.limit_price: return None
+                price = min(order.limit_price,_first(price_data.open,order.limit_price))
+        else:
             if price_data.bid:
-                fill_price = price_data.bid
-                if price_data.bid_volume:
-                    if price_data.bid_volume < order.qty:
-                        fill_amt = price_data.bid_volume
-                        ## adjust order amt exchange needs to fill
-                        order.qty -= fill_amt
+                if price_data.bid < order.limit_price: return None
+                price = price_data.bid
             else:
-                fill_price = price_data.close
-                if price_data.trade_volume < order.qty:
-                    fill_amt = price_data.trade_volume
-                    ## adjust order amt exchange needs to fill
-                    order.qty -= fill_amt
-
-            fill = Fill(order.symbol,fill_price,fill_amt,order.side,ts,order.order_id)
+                if _first(price_data.high,price_data.close) < order.limit_price: return None
+                price = max(order.limit_price,_first(price_data.open,order.limit_price))
+        return self.execute(order,price,price_data)
 
-        return fill
-
-
-    #TODO - finish order types
-
-    def stop_order(price_data, order):
-        pass
-
-    def limit_order(price_data, order):
-        pass
+    ## price a triggered stop trades at: the stop, or worse on a gap through it
+    def stop_price(self, price_data, order):
+        if order.side == Order.BUY:
+            if price_data.ask:
+                return price_data.ask if price_data.ask >= order.stop_price else None
+            if _first(price_data.high,price_data.close) < order.stop_price:
+                return None
+            return max(order.stop_price,_first(price_data.open,order.stop_price))
+        else:
+            if price_data.bid:
+                return price_data.bid if price_data.bid <= order.stop_price else None
+            if _first(price_data.low,price_data.close) > order.stop_price:
+                return None
+            return min(order.stop_price,_first(price_data.open,order.stop_price))
+
+    def stop_order(self, price_data, order):
+        price = self.stop_price(price_data,order)
+        if price is None:
+            return None
+        return self.execute(order,price,price_data)
+
+    ## once the stop trades the order becomes a limit:
+    ## fills at the stop trade price when that is within the limit,
+    ## otherwise rests on the limit ladder from the next tick
+    def stop_limit_order(self, price_data, order):
+        book = self.order_book[order.symbol]
+        if order.order_id in book.triggered:
+            return self.limit_order(price_data,order)
+
+        price = self.stop_price(price_data,order)
+        if price is None:
+            return None
+        book.trigger(order)
+        if order.side == Order.BUY and price > order.limit_price:
+            return None
+        if order.side == Order.SELL and price < order.limit_price:
+            return None
+        return self.execute(order,price,price_data)
+
+    ## market on open: the open of the first tick of a later day
+    def moo_order(self, price_data, order):
+        if price_data.timestamp.date() <= order.timestamp.date():
+            return None
+        return self.execute(order,_first(price_data.open,price_data.close),price_data)
+
+    ## market on close: the close of the last tick of the order's day,
+    ## known once the next day's first tick arrives
+    def moc_order(self, price_data, order):
+        last_data = self.last_data.get(order.symbol)
+        if last_data is None or price_data.timestamp.date() <= order.timestamp.date():
+            return None
+        ## the symbol didn't trade on the order's day: the close of the next day that it did
+        if last_data.timestamp.date() < order.timestamp.date():
+            return None
+        return self.execute(order,last_data.close,last_data,timestamp=last_data.timestamp)
 
     def fill_order(self, order, price_data):
         fill = None
-        if order.timestamp <= price_data.timestamp:
-            if order.order_type == Order.MARKET:
-                fill = self.market_order(price_data, order)
-            elif order.order_type == Order.STOP:
-                fill = self.stop_order(price_data, order)
-            elif order.order_type == Order.STOP_LIMIT:
-                fill = self.stop_order(price_data, order)
-            elif order.order_type == Order.LIMIT:
-                fill = self.limit_order(price_data, order)
+        ## market orders fill on the tick they arrive on,
+        ## price conditional orders from the next tick on
+        if order.order_type == Order.MARKET:
+            live = order.timestamp <= price_data.timestamp
+        else:
+            live = order.timestamp < price_data.timestamp
+        if live:
+            fill_func = self.fill_funcs.get(order.order_type)
+            if fill_func:
+                fill = fill_func(price_data, order)
+            else:
+                self.log.error("unknown order type: %s" % order)
 
             if fill: self.adjust_book(fill)
 
         return fill
 
     def adjust_book(self,fill):
-        orders = self.order_book[fill.symbol]
-        for order in orders:
-            if order.order_id == fill.order_id:
-                if fill.qty >= order.qty:
-                    orders.remove(order)
-                    break
+        if fill.qty_left <= 0:
+            self.order_book[fill.symbol].remove(fill.order_id)
 
 
     def process_orders(self, market_data):
-        fills = collections.defaultdict(list)
-        for symbol, orders in self.order_book.iteritems():
-            if market_data.symbol == symbol:
-                self.log.info("checking: %s" % symbol)
-                for order in orders:
-                    fill = self.fill_order(order, market_data)
-                    if fill:
-                        self.OUT_fills.put(fill,order.owner)
-                        #self.OUT_fills.put(copy.deepcopy(fill))
-                        fills[symbol].append(fill)
-                        self.log.info("fill: %s" % fill)
-
-        for symbol in fills.keys():
-            self.log.info("fills(%s) = %d" % (symbol,len(fills[symbol])))
-
-            ## no more orders for that symbol outstanding
-            ## remove the key from the map
-            if len(self.order_book[symbol]) == 0:
-                del self.order_book[symbol]
+        ## only the book of the symbol that ticked
+        symbol = market_data.symbol
+        book = self.order_book.get(symbol)
+        if book is None:
+            self.last_data[symbol] = market_data
+            return
+
+        self.log.info("checking: %s" % symbol)
+
+        ## the tick's volume per side, for execute() (see shared_volume)
+        m = market_data
+        self.volume = { Order.BUY: (m.ask_volume if m.ask else m.trade_volume) or None,
+                        Order.SELL: (m.bid_volume if m.bid else m.trade_volume) or None }
+
+        ## candidates: due MKT/MOO/MOC orders and the ladder levels
+        ## the tick crossed, worked in time priority
+        entries = book.due(m.timestamp)
+        candidates = [ x[2] for x in entries ]
+        candidates.extend(book.crossed(_first(m.ask or None,m.low,m.close),
+                                       _first(m.bid or None,m.high,m.close),
+                                       _first(m.ask or None,m.high,m.close),
+                                       _first(m.bid or None,m.low,m.close)))
+        if len(candidates) > 1:
+            candidates.sort(key=book.priority.get)
+
+        fills = []
+        for order_id in candidates:
+            order = book.get(order_id)
+            if order is None: continue
+            fill = self.fill_order(order, market_data)
+            if fill:
+                self.OUT_fills.put(fill,order.owner)
+                fills.append(fill)
+                self.log.info("fill: %s" % fill)
+        book.requeue(entries)
+        self.last_data[symbol] = market_data
+
+        if fills:
+            self.log.info("fills(%s) = %d" % (symbol,len(fills)))
+
+        ## no more orders for that symbol outstanding
+        ## remove the key from the map
+        if len(book) == 0:
+            del self.order_book[symbol]
 
 
     def add_order(self, new_order):
-        orders = self.order_book[new_order.symbol]
-
-        ## sort by timestamp
-        orders.append(new_order)
-        #orders.append(copy.deepcopy(new_order))
+        if isinstance(new_order,OrderCancel):
+            self.cancel_order(new_order)
+            return
+        if isinstance(new_order,OrderReplace):
+            self.replace_order(new_order)
+            return
+
+        ## books keep time priority, same timestamp orders keep arrival order
+        book = self.order_book.get(new_order.symbol)
+        if book is None:
+            book = self.order_book[new_order.symbol] = OrderBook(new_order.symbol)
+        book.add(new_order)
         self.log.info("add_order: %s" % new_order)
-        if len(orders) > 1:
-            j = [ (x.timestamp,x) for x in orders ]
-            j.sort()
-            self.order_book[new_order.symbol] = [ x[1] for x in j ]
+
+
+    ## the cancel goes back to the owner as its ack, whether the order
+    ## was still resting or had filled already
+    def cancel_order(self, cancel):
+        book = self.order_book.get(cancel.symbol)
+        order = book.remove(cancel.order_id) if book else None
+        self.OUT_fills.ack(cancel,cancel.owner)
+        if order is None:
+            self.log.warning("cancel: no resting order %s" % cancel.order_id)
+            return
+        self.log.info("cancel_order: %s" % order)
+        if len(book) == 0:
+            del self.order_book[cancel.symbol]
+
+
+    ## a qty reduction keeps the order's time priority,
+    ## a price change or qty increase requeues it as of the replace
+    def replace_order(self, replace):
+        book = self.order_book.get(replace.symbol)
+        order = book.get(replace.order_id) if book else None
+        if order is None:
+            self.log.warning("replace: no resting order %s" % replace.order_id)
+            return
+
+        order = order.copy()
+        requeue = False
+        if replace.qty is not None:
+            filled = order.qty - order.qty_left
+            requeue = replace.qty > order.qty
+            order.qty = replace.qty
+            order.qty_left = replace.qty - filled
+        for k in ('limit_price','stop_price'):
+            v = getattr(replace,k)
+            if v is not None and v != getattr(order,k):
+                setattr(order,k,v)
+                requeue = True
+
+        if order.qty_left <= 0:
+            book.remove(order.order_id)
+        elif requeue:
+            triggered = order.order_id in book.triggered
+            book.remove(order.order_id)
+            order.timestamp = replace.timestamp
+            book.add(order)
+            if triggered: book.trigger(order)
+        else:
+            book.replace(order)
+        self.log.info("replace_order: %s" % order)
+
+        if len(book) == 0:
+            del self.order_book[replace.symbol]
 
 
     def shutdown(self):
@@ -207,7 +529,8 @@ class Exchange(Thread):
             self.IN_orders.clear()
             self.OUT_fills.clear()
             self.current_data = {}
-            self.order_book = collections.defaultdict(list)
+            self.last_data = {}
+            self.order_book = {}
 
 
 
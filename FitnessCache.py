@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import hashlib
+import cPickle
+import datetime
+import logging
+
+'''
+FitnessCache persists simulation results across Optimizer runs.
+a result (the stats dict Simulator.run() returns) is keyed by:
+    strategy class, decoded strategy_params, strategy_setup,
+    the data feed fingerprint() and the Simulator flags that change the run
+so reruns, widened parameter ranges and bitcodes that decode to the
+same values are looked up instead of re-simulated.
+
+    optimizer.fitness_cache = FitnessCache('retrace_fitness.db')
+
+results are only as good as the strategy code that made them:
+clear() the cache (or use a new file) after changing a strategy.
+'''
+
+log = logging.getLogger('Optimizer')
+
+
+## stable text for params/setup dicts
+def _canonical(value):
+    return json.dumps(value,sort_keys=True,default=repr)
+
+
+class FitnessCache(object):
+
+    def __init__(self,filename='fitness_cache.db'):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS fitness (
+                            key TEXT PRIMARY KEY,
+                            strategy TEXT,
+                            params TEXT,
+                            stats BLOB,
+                            created TEXT)''')
+        self.db.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self,strategy_class,strategy_params,strategy_setup,fingerprint,**flags):
+        parts = [ '%s.%s' % (strategy_class.__module__,strategy_class.__name__),
+                  _canonical(strategy_params),
+                  _canonical(strategy_setup),
+                  fingerprint,
+                  _canonical(flags) ]
+        return hashlib.sha1('\n'.join(parts)).hexdigest()
+
+    ## returns the cached stats dict or None, and counts the hit/miss
+    def get(self,key):
+        row = self.db.execute('SELECT stats FROM fitness WHERE key = ?',(key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cPickle.loads(str(row[0]))
+
+    def put(self,key,stats,strategy_class=None,strategy_params=None):
+        strategy = strategy_class.__name__ if strategy_class else None
+        blob = sqlite3.Binary(cPickle.dumps(stats,cPickle.HIGHEST_PROTOCOL))
+        self.db.execute('INSERT OR REPLACE INTO fitness VALUES (?,?,?,?,?)',
+                        (key,strategy,_canonical(strategy_params),blob,datetime.datetime.now().isoformat()))
+        self.db.commit()
+
+    def clear(self):
+        self.db.execute('DELETE FROM fitness')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM fitness').fetchone()[0]
@@ -0,0 +1,311 @@
+import itertools
+import collections
+import logging
+import numpy
+import pandas
+import VectorIndicators
+from DataFeed import DataFeed
+from Simulator import fitness_function
+from Optimizer import Segment
+
+'''
+GridSearch scores every point of a small parameter grid in one go,
+as numpy matrices over the price history (one row per parameter set):
+entry signals -> positions -> trade pnls and equity curves -> stats.
+
+it is for simple signal strategies on one symbol: a market order on a
+signal while flat, filled at that bar's close, held for a fixed number of
+bars, then closed at the close - what RetraceStrategy does.
+GridSearch itself has no entry rule: run a subclass that defines signals()
+(and durations() if needed), e.g. RetraceGrid below.
+
+the stats columns are the ones Portfolio.stats() returns for the same run
+(reset_on_EOD flattens the position left open at the last close), so
+rows compare directly with Simulator results. curve stats (mtm_pnl,
+max_equ, max_dd) and cnt come out exactly, the trade stats (summed in
+another order, then truncated to 4 places) to within 1e-4 - see
+grid_search_test.test_simulator, which runs every grid point both ways.
+the feed is taken as one continuous history: the per file resets
+a reset_on_EOD run does on a multi-file DataFeedList aren't replayed.
+
+Example:
+    >> g = RetraceGrid(DataFeedList(['SPY.csv'],data_type='D'))
+    >> g.add_parameters([dict(name='momentum',min_val=10,max_val=100,steps=8,converter=int),
+    >>                   dict(name='average',min_val=20,max_val=200,steps=8,converter=int),
+    >>                   dict(name='duration',min_val=10,max_val=50,steps=8,converter=int)])
+    >> results = g.run()     ## DataFrame of params, stats and score, best first
+'''
+
+log = logging.getLogger('GridSearch')
+
+## Portfolio.stats() keys, in the order results lists them
+STATS_COLUMNS = ['tag','cnt','w_avg','w_std','pr','l_avg','l_std','w_pct','pnl','shrp',
+                 'mtm_pnl','max_equ','max_dd','avg_dd']
+
+## the trade stats Portfolio truncates to 4 places
+TRUNCATED = ['w_avg','w_std','pr','l_avg','l_std','w_pct','shrp']
+
+
+## Portfolio._trunc_results on a column
+def _trunc(v):
+    with numpy.errstate(invalid='ignore'):
+        return numpy.trunc(v * 10000)/10000.0
+
+
+## per row mean and ddof=1 std of the values of x where mask is set,
+## (0, 0) for rows with none: the win_loss_stats() conventions
+def _mean_std(x,mask):
+    n = mask.sum(axis=1)
+    with numpy.errstate(invalid='ignore',divide='ignore'):
+        mean = numpy.where(mask,x,0.0).sum(axis=1)/n
+        sqr = numpy.where(mask,(mean[:,None] - x)**2,0.0).sum(axis=1)
+        std = numpy.sqrt(sqr/(n - 1))
+    std[n == 1] = numpy.nan
+    return numpy.where(n > 0,mean,0), numpy.where(n > 0,std,0), n
+
+
+## abstract: run() needs a subclass that overrides signals()
+class GridSearch(object):
+
+    def __init__(self,data_feed=None,symbol=None):
+
+        self.data_feed = data_feed
+        ## the symbol to trade, needed when the feed has more than one
+        self.symbol = symbol
+
+        ## name = list of values, searched in every combination
+        self.grid = collections.OrderedDict()
+
+        ## flatten what is still open at the last close, as Simulator does
+        self.reset_on_EOD = True
+        ## for the score column, as in Optimizer
+        self.min_trade_count = 30
+        ## shares per trade
+        self.qty = 100
+        ## tag column, the Simulator's portfolio name
+        self.tag = 'portfolio'
+
+        ## matrix cells per block of parameter sets
+        self.cells = 2**20
+
+        self.close = None
+        ## dict[(name, length)] = indicator row over the prices, for run()
+        self.indicators = {}
+
+
+    def add_parameter(self,parameter):
+        ## parameter = dict(name, min_val, max_val, steps, converter)
+        ## the values an Optimizer Segment of it can take
+        segment = Segment(**parameter)
+        self.grid[segment.name] = sorted(set(segment.bits.values()))
+
+    def add_parameters(self,parameter_list):
+        for parameter in parameter_list:
+            self.add_parameter(parameter)
+
+    ## every strategy_params dict of the grid
+    def combinations(self):
+        names = self.grid.keys()
+        return [ dict(zip(names,values)) for values in itertools.product(*self.grid.values()) ]
+
+
+    ## float array of the closes of the symbol
+    def prices(self):
+        if self.close is not None:
+            return self.close
+
+        series = VectorIndicators.feed_series(self.data_feed)
+        if series is not None:
+            symbol = self.symbol or self._only(series.keys())
+            prices = series[symbol]
+            if self.reset_on_EOD and len(prices.ends) > 1:
+                log.warning('GridSearch: %d data files taken as one history' % len(prices.ends))
+            self.close = prices.columns['close']
+        else:
+            ## feeds that can't hand over their data up front are played once
+            self.data_feed.reset()
+            close = {}
+            for market_data in self.data_feed:
+                if market_data != DataFeed.SENTINEL:
+                    close.setdefault(market_data.symbol,[]).append(market_data.close)
+            symbol = self.symbol or self._only(close.keys())
+            self.close = numpy.array(close[symbol],dtype=numpy.float64)
+
+        return self.close
+
+    def _only(self,symbols):
+        if len(symbols) != 1:
+            raise ValueError('GridSearch: pick a symbol out of %s' % sorted(symbols))
+        return symbols[0]
+
+
+    ## the values of func(close, length) over the prices, NaN until the first one,
+    ## worked out once a run for all the blocks
+    def indicator(self,name,length,func):
+        row = self.indicators.get((name,length))
+        if row is None:
+            close = self.prices()
+            row = self.indicators[name,length] = numpy.full(len(close),numpy.nan)
+            if length <= len(close):
+                row[length-1:] = func(close,length)
+        return row
+
+
+    ## subclasses must override: int8 matrix (parameter sets, bars) of 1 (buy) / -1 (sell)
+    ## where a flat strategy sends its entry order at that bar's close
+    def signals(self,close,params):
+        raise NotImplementedError
+
+    ## override: bars each parameter set holds a position for
+    def durations(self,params):
+        return numpy.array([ p['duration'] for p in params ],dtype=numpy.int64)
+
+
+    ## (trade pnl matrix, NaN where nothing closed; equity curve matrix;
+    ##  trades opened by each row)
+    def simulate(self,close,side,hold):
+        rows, bars = side.shape
+        qty = self.qty
+        index = numpy.arange(rows)
+
+        ## next signal at or after each bar, bars for none
+        nxt = numpy.where(side != 0,numpy.arange(bars),bars)
+        nxt = numpy.minimum.accumulate(nxt[:,::-1],axis=1)[:,::-1]
+        nxt = numpy.hstack([nxt,numpy.full((rows,1),bars,dtype=nxt.dtype)])
+
+        ## +/- side from the entry to the exit bar, and the entry bar + 1,
+        ## as markers summed up along the rows afterwards
+        held = numpy.zeros((rows,bars + 1),dtype=numpy.int64)
+        entry = numpy.zeros((rows,bars + 1),dtype=numpy.int64)
+        pnl = numpy.full((rows,bars),numpy.nan)
+        opened = numpy.zeros(rows,dtype=numpy.int64)
+
+        ## one trade of every row still trading per pass
+        enter = nxt[:,0]
+        while True:
+            live = enter < bars
+            if not live.any():
+                break
+            r, e = index[live], enter[live]
+            x = e + hold[live]
+            if self.reset_on_EOD:
+                x = numpy.minimum(x,bars - 1)
+            s = side[r,e]
+            opened[r] += 1
+            held[r,e] += s
+            entry[r,e] += e + 1
+            end = numpy.minimum(x,bars)
+            held[r,end] -= s
+            entry[r,end] -= e + 1
+
+            closed = x < bars
+            rc, xc = r[closed], x[closed]
+            pnl[rc,xc] = (qty * s[closed]) * (close[xc] - close[e[closed]])
+
+            enter[live] = nxt[r,numpy.minimum(x + 1,bars)]
+
+        held = held[:,:bars].cumsum(axis=1)
+        entry = entry[:,:bars].cumsum(axis=1) - 1
+        with numpy.errstate(invalid='ignore'):
+            realized = numpy.where(numpy.isnan(pnl),0.0,pnl).cumsum(axis=1)
+        mtm = numpy.where(held != 0,(qty * held) * (close - close[entry]),0.0)
+
+        return pnl, realized + mtm, opened
+
+
+    ## Portfolio.stats() of each row, as a dict of columns
+    def stats(self,pnl,curve,opened):
+        rows = len(pnl)
+        valid = ~numpy.isnan(pnl)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            wins = pnl > 0
+            losses = pnl <= 0
+
+            avg, stdv, cnt = _mean_std(pnl,valid)
+            avg_win, stdv_win, n_wins = _mean_std(pnl,wins)
+            avg_loss, stdv_loss, n_losses = _mean_std(pnl,losses)
+            sharpe = numpy.where(cnt > 0,avg/stdv,0)
+            profit_ratio = numpy.where(avg_loss != 0,-1*avg_win/avg_loss,0)
+            tot = numpy.where(cnt > 0,numpy.where(valid,pnl,0.0).sum(axis=1),numpy.nan)
+            wpct = numpy.where(cnt > 0,n_wins/cnt.astype(numpy.float64),0)
+
+        out = dict(tag=[self.tag] * rows,cnt=cnt,w_avg=avg_win,w_std=stdv_win,pr=profit_ratio,
+                   l_avg=avg_loss,l_std=stdv_loss,w_pct=wpct,pnl=tot,shrp=sharpe)
+        for k in TRUNCATED:
+            out[k] = _trunc(out[k])
+
+        ## nothing traded at all
+        blank = opened == 0
+        for k in STATS_COLUMNS[1:10]:
+            out[k] = numpy.where(blank,0,out[k])
+
+        if not curve.shape[1]:
+            for k in STATS_COLUMNS[10:]:
+                out[k] = numpy.zeros(rows)
+            return out
+
+        top = numpy.maximum.accumulate(curve,axis=1)
+        ddwn = top - curve
+        down = ddwn > 0
+        n = down.sum(axis=1)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            out['max_dd'] = numpy.where(n > 0,numpy.where(down,ddwn,0.0).max(axis=1),numpy.nan)
+            out['avg_dd'] = numpy.where(down,ddwn,0.0).sum(axis=1)/n
+        out['mtm_pnl'] = curve[:,-1]
+        out['max_equ'] = curve.max(axis=1)
+        return out
+
+
+    def run(self):
+        if type(self).signals.im_func is GridSearch.signals.im_func:
+            raise NotImplementedError('%s: no signals(), subclass GridSearch (e.g. RetraceGrid)' % type(self).__name__)
+
+        close = self.prices()
+        combos = self.combinations()
+        self.indicators = {}
+        block = max(1,self.cells/max(len(close),1))
+
+        tables = []
+        for i in xrange(0,len(combos),block):
+            params = combos[i:i+block]
+            side = self.signals(close,params)
+            pnl, curve, opened = self.simulate(close,side,self.durations(params))
+            columns = self.stats(pnl,curve,opened)
+            table = pandas.DataFrame(params,columns=self.grid.keys())
+            for k in STATS_COLUMNS:
+                table[k] = columns[k]
+            tables.append(table)
+
+        results = pandas.concat(tables,ignore_index=True)
+        stats = zip(*[ results[k].tolist() for k in STATS_COLUMNS ])
+        results['score'] = [ fitness_function(dict(zip(STATS_COLUMNS,row)),self.min_trade_count) for row in stats ]
+        return results.sort_values('score',ascending=False,kind='mergesort').reset_index(drop=True)
+
+
+## the MO point momentum, as VectorIndicators works it out
+def _momentum(close,length):
+    return close[length-1:] - close[:len(close)-length+1]
+
+
+## RetraceStrategy's rules: flat, go long when momentum turns positive above the
+## previous average, short when it turns negative below it, hold for duration bars.
+## params: momentum, average, duration
+class RetraceGrid(GridSearch):
+
+    def signals(self,close,params):
+        bars = len(close)
+        momentum = numpy.array([ p['momentum'] for p in params ])
+        average = numpy.array([ p['average'] for p in params ])
+
+        p_value = numpy.vstack([ self.indicator('MO',m,_momentum) for m in momentum.tolist() ])
+        y_value = numpy.hstack([ numpy.full((len(params),1),numpy.nan),p_value[:,:-1] ])
+        m_avg = numpy.vstack([ self.indicator('SMA',a,VectorIndicators._sma) for a in average.tolist() ])
+        m_avg = numpy.hstack([ numpy.full((len(params),1),numpy.nan),m_avg[:,:-1] ])
+
+        ## both indicators hold two values from bar max(momentum, average) on
+        ready = numpy.arange(bars) >= numpy.maximum(momentum,average)[:,None]
+        side = numpy.zeros((len(params),bars),dtype=numpy.int8)
+        with numpy.errstate(invalid='ignore'):
+            side[ready & (p_value > 0) & (y_value <= 0) & (close > m_avg)] = 1
+            side[ready & (p_value < 0) & (y_value >= 0) & (close < m_avg)] = -1
+        return side
@@ -0,0 +1,211 @@
+import copy
+import weakref
+import logging
+import Indicators
+
+'''
+IndicatorRegistry shares indicators between IndicatorMaps.
+
+every map that asks for the same (symbol, class_name, kwargs) gets an
+IndicatorView of one shared Indicators object, so MO(length=20) on SPY is
+computed once per bar however many strategies (or Simulator batch lanes)
+use it.
+
+the first view to push a bar's value updates the shared indicator, the
+others only check they pushed the same value. views are read-only:
+a view that pushes something different, resets, changes a setting or is
+read while it's behind the shared indicator gets its own private copy
+(rebuilt from a snapshot and the pushes since), and carries on alone.
+
+    registry = IndicatorRegistry()
+    IndicatorMap.registry = registry        ## maps made from now on share
+    ...
+    IndicatorMap.registry = None
+    print registry.stats()
+
+Simulator(share_indicators=True) does this with a new registry each run.
+'''
+
+log = logging.getLogger('IndicatorRegistry')
+
+
+## one shared indicator and the pushes it has seen, so a view that
+## falls behind or breaks away can be rebuilt at its own position
+class SharedIndicator(object):
+
+    def __init__(self,registry,class_name,kwargs):
+        self.registry = registry
+        self.class_name = class_name
+        self.kwargs = kwargs
+        self.indicator = self.build()
+        self.views = weakref.WeakSet()
+
+        self.count = 0
+        ## pushes since base, snapshot = state at base (None = fresh)
+        self.base = 0
+        self.log = []
+        self.snapshot = None
+        self.next_snapshot = None
+
+    def build(self):
+        return getattr(Indicators,self.class_name)(**self.kwargs)
+
+    def push(self,value):
+        self.indicator.push(value)
+        self.log.append(value)
+        self.count += 1
+        self.registry.computed += 1
+
+        every = self.registry.snapshot_every
+        if self.count - self.base == every:
+            self.next_snapshot = copy.deepcopy(self.indicator)
+        elif self.count - self.base == 2 * every:
+            ## views still before the next snapshot need the old one: cut them loose now
+            for view in list(self.views):
+                if view.pos < self.base + every:
+                    view.detach()
+            self.snapshot = self.next_snapshot
+            self.log = self.log[every:]
+            self.base += every
+            ## count - base is back to 'every'
+            self.next_snapshot = copy.deepcopy(self.indicator)
+
+    ## value pushed at position pos
+    def pushed(self,pos):
+        return self.log[pos - self.base]
+
+    ## a private indicator in the state the shared one was in at pos
+    def state_at(self,pos):
+        if self.snapshot is None:
+            indicator = self.build()
+        else:
+            indicator = copy.deepcopy(self.snapshot)
+        for value in self.log[:pos - self.base]:
+            indicator.push(value)
+        return indicator
+
+
+## what IndicatorMap hands out: reads and pushes go to the shared
+## indicator while the view is in step with it
+class IndicatorView(object):
+
+    FIELDS = ('entry','pos','own')
+
+    def __init__(self,entry):
+        object.__setattr__(self,'entry',entry)
+        object.__setattr__(self,'pos',0)
+        object.__setattr__(self,'own',None)
+
+    def detach(self):
+        if self.own is None:
+            entry = self.entry
+            object.__setattr__(self,'own',entry.state_at(self.pos))
+            entry.views.discard(self)
+            entry.registry.detached += 1
+        return self.own
+
+    def current(self):
+        if self.own is not None:
+            return self.own
+        if self.pos == self.entry.count:
+            return self.entry.indicator
+        ## behind the shared indicator: its values aren't ours yet
+        return self.detach()
+
+    def push(self,value):
+        if self.own is not None:
+            return self.own.push(value)
+
+        entry = self.entry
+        pos = self.pos
+        entry.registry.pushes += 1
+        if pos == entry.count:
+            entry.push(value)
+        elif value != entry.pushed(pos):
+            return self.detach().push(value)
+        object.__setattr__(self,'pos',pos + 1)
+
+    def feed(self,series2):
+        tmp = list(series2)
+        tmp.reverse()
+        for i in tmp: self.push(i)
+
+    def __getitem__(self,index):
+        return self.current()[index]
+
+    def __nonzero__(self):
+        return True
+
+    def size(self):
+        return self.current().size()
+
+    def reset(self):
+        if self.own is None:
+            self.entry.views.discard(self)
+            self.entry.registry.detached += 1
+            object.__setattr__(self,'own',self.entry.build())
+        else:
+            self.own.reset()
+
+    def sethistory(self,limit):
+        self.detach().sethistory(limit)
+
+    def __getattr__(self,name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.current(),name)
+
+    ## copy on write: settings only ever change the view's own copy
+    def __setattr__(self,name,value):
+        if name in IndicatorView.FIELDS:
+            raise AttributeError('%s is read-only' % name)
+        setattr(self.detach(),name,value)
+
+
+class IndicatorRegistry(object):
+
+    ## a new view joins a shared indicator only if it has seen no more than
+    ## this many pushes (the other lanes/strategies of the same bar),
+    ## otherwise a new shared indicator starts for the key
+    JOIN_LAG = 8
+
+    def __init__(self,snapshot_every=1024):
+        self.snapshot_every = snapshot_every
+        self.clear()
+
+    def clear(self):
+        ## dict[(symbol, class_name, kwargs)] = newest SharedIndicator
+        self.entries = {}
+        self.requested = 0
+        self.instances = 0
+        self.detached = 0
+        self.pushes = 0
+        self.computed = 0
+
+    def key(self,symbol,class_name,kwargs):
+        key = (symbol,class_name,tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            key = (symbol,class_name,repr(sorted(kwargs.items())))
+        return key
+
+    def view(self,symbol,class_name,kwargs):
+        key = self.key(symbol,class_name,kwargs)
+        self.requested += 1
+        entry = self.entries.get(key)
+        if entry is None or entry.count > IndicatorRegistry.JOIN_LAG:
+            entry = SharedIndicator(self,class_name,kwargs)
+            self.entries[key] = entry
+            self.instances += 1
+        view = IndicatorView(entry)
+        entry.views.add(view)
+        return view
+
+    def stats(self):
+        return dict(requested=self.requested,
+                    instances=self.instances,
+                    deduplicated=self.requested - self.instances,
+                    detached=self.detached,
+                    pushes=self.pushes,
+                    computed=self.computed)
@@ -1,19 +1,26 @@
 
 import sys
 import math
+import numbers
+import heapq
+from array import array
 from collections import deque
+from itertools import islice
+from operator import truediv
 
 class MetricError(Exception):pass
 
+NAN = float('nan')
+
 def unpack(vectorlist,index):
     t = [x[index] for x in vectorlist]
     return t
 
+## correctly rounded mean of the newest 'length' values (RollingSum's value)
 def _average(s,length):
-    tmp = list(s)
-    t = len(tmp)
+    t = len(s)
     assert(t >= length), "series length = %d, length param = %d" % (t,length)
-    mean = sum(tmp[:length]) / (length * 1.0)
+    mean = math.fsum(islice(s,length)) / (length * 1.0)
     return mean
 
 def _expma(price, avg, coeff):
@@ -66,6 +73,173 @@ def stdv(lst,avg):
     if std is not None: std = math.sqrt(std)
     return std
 
+## incremental windows over the last 'length' values pushed,
+## so an indicator's per push cost doesn't grow with its length
+
+## exact running sum of the window (of its squares for power=2).
+## a finite float is an integer times a power of two, so the sum is kept
+## as a long at the finest binary scale seen so far, with no rounding:
+## value() is the correctly rounded sum, as math.fsum() of the window
+class RollingSum(object):
+
+    def __init__(self,length,power=1):
+        self.length = length
+        self.power = power
+        self.values = deque()
+        self.clear()
+
+    def clear(self):
+        self.values.clear()
+        self.total = 0
+        self.scale = 0
+        ## counts of inf, -inf and nan in the window
+        self.specials = [0,0,0]
+
+    ## x as a long at self.scale (rescaling the window if x is finer),
+    ## None for inf and nan
+    def _fixed(self,x):
+        try:
+            num, den = x.as_integer_ratio()
+        except AttributeError:
+            num, den = int(x), 1
+        except (OverflowError,ValueError):
+            return None
+        shift = den.bit_length() - 1
+        if self.power == 2:
+            num, shift = num * num, 2 * shift
+        if shift > self.scale:
+            grow = shift - self.scale
+            self.total <<= grow
+            self.values = deque([ v if v.__class__ is float else v << grow for v in self.values ])
+            self.scale = shift
+        return num << (self.scale - shift)
+
+    def _special(self,x,count):
+        j = 2 if x != x else (0 if x > 0 else 1)
+        self.specials[j] += count
+
+    def push(self,x):
+        n = self._fixed(x)
+        if n is None:
+            n = x ** self.power
+            self._special(n,1)
+        else:
+            self.total += n
+        values = self.values
+        values.append(n)
+        if len(values) > self.length:
+            n = values.popleft()
+            if n.__class__ is float:
+                self._special(n,-1)
+            else:
+                self.total -= n
+
+    ## the exact sum is total / 2**scale
+    def exact(self):
+        return self.total, self.scale
+
+    def value(self):
+        inf, ninf, nan = self.specials
+        if nan or (inf and ninf): return NAN
+        if inf: return float('inf')
+        if ninf: return float('-inf')
+        return truediv(self.total,1 << self.scale)
+
+
+## monotonic deque of (index, value): value() is max (or min) of the window
+class RollingExtreme(object):
+
+    def __init__(self,length,highest=True):
+        self.length = length
+        self.highest = highest
+        self.window = deque()
+        self.count = 0
+
+    def clear(self):
+        self.window.clear()
+        self.count = 0
+
+    def push(self,x):
+        window = self.window
+        if self.highest:
+            while window and window[-1][1] <= x: window.pop()
+        else:
+            while window and window[-1][1] >= x: window.pop()
+        window.append((self.count,x))
+        self.count += 1
+        if window[0][0] <= self.count - 1 - self.length:
+            window.popleft()
+
+    def value(self):
+        return self.window[0][1]
+
+
+## two heaps over (value, index) with lazy deletion of expired entries:
+## value() is sorted(window)[int(length/2)], as _median()
+class RollingMedian(object):
+
+    def __init__(self,length):
+        self.length = length
+        self.k = int(length/2)
+        self.values = deque()
+        self.clear()
+
+    def clear(self):
+        self.values.clear()
+        ## lo: max heap (-value, -index) of the k+1 smallest, hi: min heap of the rest
+        self.lo = []
+        self.hi = []
+        self.lo_size = self.hi_size = 0
+        self.count = 0
+
+    def _prune(self,start):
+        lo, hi = self.lo, self.hi
+        while lo and -lo[0][1] < start: heapq.heappop(lo)
+        while hi and hi[0][1] < start: heapq.heappop(hi)
+
+    def push(self,x):
+        lo, hi = self.lo, self.hi
+        i = self.count
+        self.count += 1
+        self.values.append(x)
+
+        if not lo or (x,i) < (-lo[0][0],-lo[0][1]):
+            heapq.heappush(lo,(-x,-i))
+            self.lo_size += 1
+        else:
+            heapq.heappush(hi,(x,i))
+            self.hi_size += 1
+
+        start = self.count - self.length
+        if start > 0:
+            ## drop the value that left the window
+            j = start - 1
+            y = self.values.popleft()
+            if (y,j) <= (-lo[0][0],-lo[0][1]):
+                self.lo_size -= 1
+            else:
+                self.hi_size -= 1
+            self._prune(start)
+
+        ## keep k+1 values in lo
+        target = min(self.lo_size + self.hi_size,self.k + 1)
+        while self.lo_size > target:
+            y, j = heapq.heappop(lo)
+            heapq.heappush(hi,(-y,-j))
+            self.lo_size -= 1
+            self.hi_size += 1
+            self._prune(start)
+        while self.lo_size < target:
+            y, j = heapq.heappop(hi)
+            heapq.heappush(lo,(-y,-j))
+            self.hi_size -= 1
+            self.lo_size += 1
+            self._prune(start)
+
+    def value(self):
+        return -self.lo[0][0]
+
+
 class RiskMgr:
 
     def __init__(self,ticksz,tickval,unitsz,cap,ff,maxunits):
@@ -216,16 +390,141 @@ class PriceBar:
         return s
 
 
+## Metric.series storage: a growable ring buffer, newest first, with the
+## deque calls the indicators use (appendleft, pop, clear, [i], len).
+## a series of numbers is kept in one array('d'): ints and bools come back
+## as floats, None as NaN. a series of rows (tuples, lists, anything else)
+## keeps the rows as pushed in a python list, read back without a copy.
+## a number pushed on a series of rows is kept as is; a row pushed on a
+## series of numbers moves it to a list, as floats
+class RingSeries(object):
+
+    __slots__ = ('buffer','numeric','head','count','capacity')
+
+    def __init__(self,iterable=()):
+        self.buffer = None
+        ## None until the first push, then True (array('d')) or False (list)
+        self.numeric = None
+        self.head = 0
+        self.count = 0
+        self.capacity = 0
+        for x in reversed(list(iterable)): self.appendleft(x)
+
+    def appendleft(self,value):
+        numeric = self.numeric
+        if numeric:
+            if type(value) is not float:
+                value = self._coerce(value)
+        elif numeric is None:
+            value = self._coerce(value)
+        if self.count == self.capacity:
+            self._grow()
+        head = self.head - 1
+        if head < 0: head = self.capacity - 1
+        self.buffer[head] = value
+        self.head = head
+        self.count += 1
+
+    ## value as stored in a numeric series, deciding the kind of series on
+    ## the first push; a row on a numeric series moves it to a list
+    def _coerce(self,value):
+        if value is None:
+            number = NAN
+        elif isinstance(value,numbers.Real):
+            number = float(value)
+        else:
+            if self.numeric:
+                self._to_objects()
+            self.numeric = False
+            return value
+        if self.numeric is None:
+            self.numeric = True
+        return number
+
+    def _slot(self,index):
+        i = self.head + index
+        if i >= self.capacity: i -= self.capacity
+        return i
+
+    def __getitem__(self,index):
+        if index < 0: index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError('RingSeries index out of range')
+        return self.buffer[self._slot(index)]
+
+    ## self[index] or None when out of range, as Metric.__getitem__()
+    def get(self,index):
+        if index >= 0 and index < self.count:
+            i = self.head + index
+            if i >= self.capacity: i -= self.capacity
+            return self.buffer[i]
+        return None
+
+    def pop(self):
+        if not self.count:
+            raise IndexError('pop from an empty RingSeries')
+        self.count -= 1
+        i = self._slot(self.count)
+        value = self.buffer[i]
+        if not self.numeric: self.buffer[i] = None
+        return value
+
+    def clear(self):
+        if self.numeric is False:
+            self.buffer = [None] * self.capacity
+        self.head = self.count = 0
+
+    ## drop the oldest row if there are more than limit, as Metric._pop()
+    def trim(self,limit):
+        if self.count > limit:
+            self.count -= 1
+            if not self.numeric: self.buffer[self._slot(self.count)] = None
+
+    def reverse(self):
+        items = list(self)
+        self.head = self.count = 0
+        for x in items: self.appendleft(x)
+
+    def __len__(self):
+        return self.count
+
+    def __nonzero__(self):
+        return self.count > 0
+
+    def __iter__(self):
+        buffer = self.buffer
+        return ( buffer[self._slot(i)] for i in xrange(self.count) )
+
+    def __repr__(self):
+        return 'RingSeries(%s)' % list(self)
+
+    ## double the buffer, rows moved to its end (newest first)
+    def _grow(self):
+        capacity = max(8,self.capacity * 2)
+        rows = list(self)
+        if self.numeric:
+            buffer = array('d',[0.0]) * capacity
+            buffer[capacity-len(rows):] = array('d',rows)
+        else:
+            buffer = [None] * (capacity - len(rows)) + rows
+        self.buffer = buffer
+        self.head = capacity - self.count if self.count else 0
+        self.capacity = capacity
+
+    def _to_objects(self):
+        rows = list(self)
+        self.buffer = [None] * (self.capacity - len(rows)) + rows
+        self.head = self.capacity - self.count if self.count else 0
+
+
 class Metric:
 
     def __init__(self):
-        self.series = deque()
+        self.series = RingSeries()
         self.hlimit = 50
 
     def __getitem__(self,index):
-        if self.series and index >= 0 and index < len(self.series):
-            return self.series[index]
-        return None
+        return self.series.get(index)
 
     def __nonzero__(self):
         return True
@@ -249,7 +548,7 @@ class Metric:
         self.hlimit = limit
 
     def _pop(self):
-        if len(self.series) > self.hlimit: self.series.pop()
+        self.series.trim(self.hlimit)
 
 
 
@@ -1071,19 +1370,22 @@ class SMA(Metric):
         Metric.__init__(self)
         self.length = length
         self.prices = deque()
+        self.total = RollingSum(length)
 
     def reset(self):
         Metric.reset(self)
         self.prices.clear()
+        self.total.clear()
 
     def push(self, price):
         self.prices.appendleft(price)
+        self.total.push(price)
         if len(self.prices) >= self.length:
             self.calc()
             self.prices.pop()
 
     def calc(self):
-        u = _average(self.prices,self.length)
+        u = self.total.value() / (self.length * 1.0)
         self.series.appendleft(u)
         self._pop()
 
@@ -1093,19 +1395,22 @@ class MEDIAN(Metric):
         Metric.__init__(self)
         self.length = length
         self.prices = deque()
+        self.window = RollingMedian(length)
 
     def reset(self):
         Metric.reset(self)
         self.prices.clear()
+        self.window.clear()
 
     def push(self, price):
         self.prices.appendleft(price)
+        self.window.push(price)
         if len(self.prices) >= self.length:
             self.calc()
             self.prices.pop()
 
     def calc(self):
-        u = _median(self.prices,self.length)
+        u = self.window.value()
         self.series.appendleft(u)
         self._pop()
 
@@ -1143,18 +1448,37 @@ class STAT(Metric):
         Metric.__init__(self)
         self.prices = deque()
         self.limit = limit
+        ## running sums of the prices and their squares by length,
+        ## built on first use of a length
+        self.sums = {}
+        self.squares = {}
 
     def reset(self):
         Metric.reset(self)
         self.prices.clear()
+        self.sums = {}
+        self.squares = {}
 
     def push(self, price):
         self.prices.appendleft(price)
         if len(self.prices) > self.limit:
             self.prices.pop()
+        for w in self.sums.itervalues(): w.push(price)
+        for w in self.squares.itervalues(): w.push(price)
+
+    def _window(self, windows, length, power=1):
+        try:
+            return windows[length]
+        except KeyError:
+            w = RollingSum(length,power)
+            for x in reversed(list(islice(self.prices,length))): w.push(x)
+            windows[length] = w
+            return w
 
     def average(self, length):
-        u = _average(self.prices,length)
+        if len(self.prices) < length:
+            return _average(self.prices,length)
+        u = self._window(self.sums,length).value() / (length * 1.0)
         return u
 
     def max(self, length):
@@ -1172,20 +1496,21 @@ class STAT(Metric):
         n = int(length/2)
         return tmp[n]
 
+    ## sqrt of the correctly rounded sum((x - avg)**2)/length: with the exact
+    ## sums of x and x**2, sum((x - avg)**2) = sum(x**2) - 2*avg*sum(x) + length*avg**2
     def stdev(self, length):
-        avg = _average(self.prices,length)
-        lst = list(self.prices)[:length]
-        cnt = sum = 0
-        vv = None
-        std = None
-        if len(lst) > 0:
-            for x in lst:
-                if x is not None:
-                    sum += (x - avg)*(x-avg)
-                    cnt += 1
-            if cnt > 0: vv = sum/cnt
-            if vv is not None: std = math.sqrt(vv)
-        return std
+        avg = self.average(length)
+        sums = self._window(self.sums,length)
+        squares = self._window(self.squares,length,2)
+        if math.isinf(avg) or math.isnan(avg):
+            return math.sqrt(sum([ (x - avg)*(x-avg) for x in islice(self.prices,length) ])/length)
+        t1, k1 = sums.exact()
+        t2, k2 = squares.exact()
+        num, den = avg.as_integer_ratio()
+        ka = den.bit_length() - 1
+        k = max(k2,ka + k1,2 * ka)
+        v = (t2 << (k - k2)) - ((2 * num * t1) << (k - ka - k1)) + ((length * num * num) << (k - 2 * ka))
+        return math.sqrt(truediv(v,length << k))
 
     def zscore(self, length):
         v = self.prices[0]
@@ -1373,21 +1698,26 @@ class BOX(Metric):
         Metric.__init__(self)
         self.length = length
         self.prices = deque()
+        self.high_window = RollingExtreme(length,highest=True)
+        self.low_window = RollingExtreme(length,highest=False)
 
     def reset(self):
         Metric.reset(self)
         self.prices.clear()
+        self.high_window.clear()
+        self.low_window.clear()
 
     def push(self, price):
         self.prices.appendleft(price)
+        self.high_window.push(price)
+        self.low_window.push(price)
         if len(self.prices) >= self.length:
             self.calc()
             self.prices.pop()
 
     def calc(self):
-        tmp = list(self.prices)
-        hi = max(tmp)
-        lo = min(tmp)
+        hi = self.high_window.value()
+        lo = self.low_window.value()
         pct = 0.50
         if (hi-lo) != 0: pct = (self.prices[0] - lo)/(hi-lo)
         vec = (pct,hi,lo)
@@ -1402,15 +1732,48 @@ class HILO(Metric):
         self.length = length
         self.prices = deque()
         self.lowest = self.highest = False
-        self.highs = self.lows = None
+        ## highs/lows of the last 'length' bars, newest first
+        self._highs = deque()
+        self._lows = deque()
+        ## what highs/lows show: None before the first calc(), 'live' for
+        ## the deques, or the lists of the last calc() before a reset()
+        self._view = None
+        self.high_window = RollingExtreme(length,highest=True)
+        self.low_window = RollingExtreme(length,highest=False)
 
     def reset(self):
         Metric.reset(self)
         self.prices.clear()
         self.lowest = self.highest = False
+        if self._view == 'live':
+            self._view = (list(self._highs),list(self._lows))
+        self._highs.clear()
+        self._lows.clear()
+        self.high_window.clear()
+        self.low_window.clear()
+
+    ## the 'length' highs (lows) of the last calc(), newest first, None before it
+    @property
+    def highs(self):
+        if self._view == 'live': return list(self._highs)
+        if self._view is None: return None
+        return self._view[0]
+
+    @property
+    def lows(self):
+        if self._view == 'live': return list(self._lows)
+        if self._view is None: return None
+        return self._view[1]
 
     def push(self, pricevector):
         self.prices.appendleft(pricevector)
+        self._highs.appendleft(pricevector[1])
+        self._lows.appendleft(pricevector[2])
+        if len(self._highs) > self.length:
+            self._highs.pop()
+            self._lows.pop()
+        self.high_window.push(pricevector[1])
+        self.low_window.push(pricevector[2])
         if len(self.prices) >= self.length:
             self.calc()
             self.prices.pop()
@@ -1423,16 +1786,12 @@ class HILO(Metric):
 
     def calc(self):
         self.lowest = self.highest = False
-        tmp = list(self.prices)
-        highs = unpack(tmp,1)
-        lows = unpack(tmp,2)
-        self.highs = highs[:self.length]
-        hi = max(self.highs)
-        self.lows = lows[:self.length]
-        lo = min(self.lows)
+        hi = self.high_window.value()
+        lo = self.low_window.value()
         vec = (hi,lo)
-        if hi == highs[0]: self.highest = True
-        if lo == lows[0]: self.lowest = True
+        if hi == self._highs[0]: self.highest = True
+        if lo == self._lows[0]: self.lowest = True
+        self._view = 'live'
         self.series.appendleft(vec)
         self._pop()
 
@@ -1483,20 +1842,22 @@ class Highest(Metric):
         Metric.__init__(self)
         self.length = length
         self.prices = deque()
+        self.window = RollingExtreme(length,highest=True)
 
     def reset(self):
         Metric.reset(self)
         self.prices.clear()
+        self.window.clear()
 
     def push(self, price):
         self.prices.appendleft(price)
+        self.window.push(price)
         if len(self.prices) >= self.length:
             self.calc()
             self.prices.pop()
 
     def calc(self):
-        tmp = list(self.prices)
-        hi = max(tmp[:self.length])
+        hi = self.window.value()
         self.series.appendleft(hi)
         self._pop()
 
@@ -1506,20 +1867,22 @@ class Lowest(Metric):
         Metric.__init__(self)
         self.length = length
         self.prices = deque()
+        self.window = RollingExtreme(length,highest=False)
 
     def reset(self):
         Metric.reset(self)
         self.prices.clear()
+        self.window.clear()
 
     def push(self, price):
         self.prices.appendleft(price)
+        self.window.push(price)
         if len(self.prices) >= self.length:
             self.calc()
             self.prices.pop()
 
     def calc(self):
-        tmp = list(self.prices)
-        lo = min(tmp[:self.length])
+        lo = self.window.value()
         self.series.appendleft(lo)
         self._pop()
 
@@ -0,0 +1,204 @@
+import math
+
+'''
+LiveStats keeps running versions of the Portfolio.stats() numbers,
+updated a fill or a mark at a time, so they can be read in the middle
+of a run (Portfolio.live_stats()) without building any tables.
+
+    trades: Welford mean/std of the closed trade pnls, wins and losses
+    curves: running peak (max_equ), drawdown from it, max and average drawdown
+
+the curve of an owner (strategy or portfolio) is the sum of the last
+mtm_pnl of each of its symbols, like the blended curve stats() builds.
+a point is settled once a later timestamp comes in, so rows recorded again
+at the same timestamp replace it (as stats() keeps the last one).
+on data in timestamp order the numbers match stats() to within 1e-9
+(relative, absolute below 1.0) - the trade stats both truncate to 4 places
+to within 1e-4 - except avg_dd of sparse curves, which only counts the
+points recorded. portfolio_stats_test.test_live_stats holds them to that.
+'''
+
+NAN = float('nan')
+
+
+## Welford's running mean and variance
+class Moments(object):
+
+    __slots__ = ('n','mean','m2')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self,x):
+        x = float(x)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(x - self.mean)
+
+    ## sample std (ddof=1), NaN below two values
+    def std(self):
+        if self.n < 2:
+            return NAN
+        return math.sqrt(self.m2/(self.n - 1))
+
+
+## the trades of one symbol or owner: win_loss_stats() as it goes
+class LiveTrades(object):
+
+    __slots__ = ('rows','pnl','all','wins','losses')
+
+    def __init__(self):
+        self.rows = 0
+        self.pnl = 0
+        self.all = Moments()
+        self.wins = Moments()
+        self.losses = Moments()
+
+    ## pnl: None for a trade opening a position
+    def push(self,pnl):
+        self.rows += 1
+        if pnl is None:
+            return
+        self.pnl += pnl
+        self.all.push(pnl)
+        if pnl > 0:
+            self.wins.push(pnl)
+        else:
+            self.losses.push(pnl)
+
+    def stats(self,tag):
+        cnt = self.all.n
+        if not self.rows:
+            return dict(tag=tag,cnt=0,w_avg=0,w_std=0,pr=0,l_avg=0,l_std=0,w_pct=0,pnl=0,shrp=0)
+
+        sharpe = 0
+        if cnt > 0:
+            stdv = self.all.std()
+            if stdv != 0:
+                sharpe = self.all.mean/stdv
+            else:
+                sharpe = math.copysign(float('inf'),self.all.mean) if self.all.mean else NAN
+        avg_win = stdv_win = 0
+        if self.wins.n:
+            avg_win, stdv_win = self.wins.mean, self.wins.std()
+        avg_loss = stdv_loss = 0
+        if self.losses.n:
+            avg_loss, stdv_loss = self.losses.mean, self.losses.std()
+        profit_ratio = 0
+        if avg_loss != 0:
+            profit_ratio = -1*avg_win/avg_loss
+        tot = self.pnl if cnt > 0 else NAN
+        wpct = 0
+        if cnt > 0:
+            wpct = float(self.wins.n)/cnt
+
+        return dict(tag=tag,cnt=cnt,w_avg=avg_win,w_std=stdv_win,pr=profit_ratio,
+                    l_avg=avg_loss,l_std=stdv_loss,w_pct=wpct,pnl=tot,shrp=sharpe)
+
+
+## one equity curve: equ_curve_stats() as it goes
+class LiveCurve(object):
+
+    __slots__ = ('timestamp','value','peak','max_dd','dd_sum','dd_count')
+
+    def __init__(self):
+        ## the point not settled yet
+        self.timestamp = None
+        self.value = None
+        self.peak = None
+        self.max_dd = 0
+        self.dd_sum = 0
+        self.dd_count = 0
+
+    def update(self,timestamp,value):
+        last = self.value
+        if last is not None and timestamp != self.timestamp:
+            ## settle the last point
+            peak = self.peak
+            if peak is None or last >= peak:
+                self.peak = last
+            else:
+                dd = peak - last
+                self.dd_sum += dd
+                self.dd_count += 1
+                if dd > self.max_dd:
+                    self.max_dd = dd
+        self.timestamp = timestamp
+        self.value = value
+
+    def stats(self,tag):
+        value = self.value
+        if value is None:
+            return dict(tag=tag,mtm_pnl=0,max_equ=0,max_dd=0,avg_dd=0)
+
+        ## the pending point as if settled
+        peak, max_dd, dd_sum, dd_count = self.peak, self.max_dd, self.dd_sum, self.dd_count
+        if peak is None or value >= peak:
+            peak = value
+        else:
+            dd = peak - value
+            dd_sum += dd
+            dd_count += 1
+            max_dd = max(max_dd,dd)
+
+        if not dd_count:
+            max_dd = avg_dd = NAN
+        else:
+            avg_dd = dd_sum/float(dd_count)
+        return dict(tag=tag,mtm_pnl=value,max_equ=peak,max_dd=max_dd,avg_dd=avg_dd)
+
+
+## everything one owner (strategy or portfolio) has traded and marked
+class LiveStats(object):
+
+    __slots__ = ('owner','trades','curve','symbols','equity','total')
+
+    def __init__(self,owner):
+        self.owner = owner
+        self.trades = LiveTrades()
+        self.curve = LiveCurve()
+        ## dict[symbol] = (LiveTrades, LiveCurve)
+        self.symbols = {}
+        ## last mtm_pnl by symbol and their sum, the blended curve's value
+        self.equity = {}
+        self.total = 0
+
+    def _symbol(self,symbol):
+        pair = self.symbols.get(symbol)
+        if pair is None:
+            pair = self.symbols[symbol] = (LiveTrades(),LiveCurve())
+        return pair
+
+    ## the symbol's first tick: stats() fills sparse curves in
+    ## with zeros from there until something is recorded
+    def start(self,symbol,timestamp):
+        curve = self._symbol(symbol)[1]
+        if curve.value is None:
+            curve.update(timestamp,0)
+        if self.curve.value is None:
+            self.curve.update(timestamp,0)
+
+    def trade(self,symbol,pnl):
+        self._symbol(symbol)[0].push(pnl)
+        self.trades.push(pnl)
+
+    def mark(self,symbol,timestamp,mtm_pnl):
+        pair = self.symbols.get(symbol)
+        if pair is None:
+            pair = self._symbol(symbol)
+        pair[1].update(timestamp,mtm_pnl)
+        last = self.equity.get(symbol,0)
+        if mtm_pnl != last:
+            self.total += mtm_pnl - last
+            self.equity[symbol] = mtm_pnl
+        self.curve.update(timestamp,self.total)
+
+    ## (trade stats, curve stats) of the owner or one of its symbols
+    def stats(self,symbol=None):
+        if symbol is None:
+            return self.trades.stats(self.owner), self.curve.stats(self.owner)
+        trades, curve = self.symbols.get(symbol) or (LiveTrades(),LiveCurve())
+        return trades.stats(symbol), curve.stats(symbol)
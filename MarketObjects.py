@@ -3,6 +3,7 @@ from datetime import datetime
 import re
 import collections
 import Indicators
+import VectorIndicators
 import copy
 
 INTEGER = re.compile(r"^-?\d+$")
@@ -99,17 +100,200 @@ def parse_date_time(date_str, time_str):
     return datetime(date.year,date.month,date.day,time_t.hour,time_t.minutes,time_t.seconds,time_t.millis)
 
 
-class Position(object):
+## fixed offset date/time layouts
+## each entry = (layout name, strptime-style format, parser)
+## a parser takes the raw string and raises ValueError/IndexError
+## when the string does not fit its layout
+
+def _date_ymd(s):
+    if len(s) != 8: raise ValueError(s)
+    return int(s[:4]), int(s[4:6]), int(s[6:8])
+
+def _date_y_m_d(s):
+    if len(s) != 10 or s[4] != '-' or s[7] != '-': raise ValueError(s)
+    return int(s[:4]), int(s[5:7]), int(s[8:10])
+
+def _date_m_d_y(s):
+    if len(s) != 10 or s[2] != '/' or s[5] != '/': raise ValueError(s)
+    return int(s[6:10]), int(s[:2]), int(s[3:5])
+
+## time parsers return (hour, minutes, seconds, millis) as parse_time() does
+def _time_military(s):
+    if len(s) > 4: raise ValueError(s)
+    v = int(s)
+    return v // 100, v % 100, 0, 0
+
+def _time_hm(s):
+    if len(s) != 5 or s[2] != ':': raise ValueError(s)
+    return int(s[:2]), int(s[3:5]), 0, 0
+
+def _time_hms(s):
+    if len(s) != 8 or s[2] != ':' or s[5] != ':': raise ValueError(s)
+    return int(s[:2]), int(s[3:5]), int(s[6:8]), 0
+
+def _time_hms_millis(s):
+    if len(s) < 10 or s[2] != ':' or s[5] != ':' or s[8] != '.': raise ValueError(s)
+    return int(s[:2]), int(s[3:5]), int(s[6:8]), int(s[9:])
+
+DATE_LAYOUTS = [ ('YYYYMMDD', '%Y%m%d', _date_ymd),
+                 ('YYYY-MM-DD', '%Y-%m-%d', _date_y_m_d),
+                 ('MM/DD/YYYY', '%m/%d/%Y', _date_m_d_y) ]
+
+TIME_LAYOUTS = [ ('HHMM', None, _time_military),
+                 ('HH:MM', '%H:%M', _time_hm),
+                 ('HH:MM:SS', '%H:%M:%S', _time_hms),
+                 ('HH:MM:SS.millis', None, _time_hms_millis) ]
+
+
+def _fits(layout, value, generic):
+    ## True when layout parses value exactly as the generic parser does
+    try:
+        return layout[2](value) == generic(value)
+    except (ValueError, IndexError):
+        return False
+
+def _sniff(layouts, value, generic):
+    ## pick the first layout that reproduces the generic parse of value
+    for layout in layouts:
+        if _fits(layout, value, generic):
+            return layout
+    return None
+
+def _generic_date(s):
+    d = parse_date(s)
+    if d is None: return None
+    return d.year, d.month, d.day
+
+def _generic_time(s):
+    return tuple(parse_time(s))
+
+
+## DateTimeParser infers the date (and time) layout of a data file
+## from the first rows it is handed and then parses with a fixed offset
+## parser for that layout - no strptime format hunting, no regex per row.
+## any row that does not fit the layout goes through the generic
+## parse_date() / parse_date_time() path.
+## one instance is held per DataFeed so the layout is sniffed once per file.
+
+class DateTimeParser(object):
+
+    ## rows cross-checked against the generic parser before
+    ## the fast path is trusted on its own
+    SAMPLE = 5
+
+    def __init__(self, sniff=True):
+        self.sniff = sniff
+        self.date_layout = None
+        self.time_layout = None
+        self.checked = 0
+        ## rows that fell back to the generic parsers
+        self.misses = 0
+
+    def _check(self, date_str, time_str=None):
+        ## while sampling, (re)sniff the layouts against the generic parsers
+        if not self.date_layout or not _fits(self.date_layout, date_str, _generic_date):
+            self.date_layout = _sniff(DATE_LAYOUTS, date_str, _generic_date)
+        if time_str is not None:
+            if not self.time_layout or not _fits(self.time_layout, time_str, _generic_time):
+                self.time_layout = _sniff(TIME_LAYOUTS, time_str, _generic_time)
+        self.checked += 1
+
+    def layout(self):
+        ## (date layout name, time layout name) once sniffed
+        d = self.date_layout[0] if self.date_layout else None
+        t = self.time_layout[0] if self.time_layout else None
+        return d, t
+
+    def parse_date(self, date_str):
+        if self.sniff:
+            try:
+                if self.checked < DateTimeParser.SAMPLE:
+                    self._check(date_str)
+                y, m, d = self.date_layout[2](date_str)
+                return datetime(y, m, d)
+            except (ValueError, IndexError, TypeError):
+                self.misses += 1
+        return parse_date(date_str)
+
+    def parse_date_time(self, date_str, time_str):
+        if self.sniff:
+            try:
+                if self.checked < DateTimeParser.SAMPLE:
+                    self._check(date_str, time_str)
+                y, m, d = self.date_layout[2](date_str)
+                hh, mm, ss, millis = self.time_layout[2](time_str)
+                return datetime(y, m, d, hh, mm, ss, millis)
+            except (ValueError, IndexError, TypeError):
+                self.misses += 1
+        return parse_date_time(date_str, time_str)
+
+
+## base for the per bar / per fill objects:
+## attributes live in __slots__ (no per object __dict__) and are listed in FIELDS.
+## copy() is a flat copy of the fields - the fields hold immutable values
+## (str, numbers, datetime) so it also stands in for copy.deepcopy()
+##
+## freeze() marks a record read only by switching it to its Frozen* class
+## (same slots, no setattr) so it can be shared by reference between
+## queues and consumers; copy() of a frozen record is writable again.
+class SlotRecord(object):
+
+    __slots__ = ()
+    FIELDS = ()
+    FROZEN = None
+    frozen = False
+
+    def copy(self):
+        cls = self.__class__
+        if cls.frozen: cls = cls.__bases__[0]
+        other = cls.__new__(cls)
+        for k in self.FIELDS:
+            setattr(other,k,getattr(self,k))
+        return other
+
+    def freeze(self):
+        if self.FROZEN is None:
+            raise TypeError('%s cannot be frozen' % self.__class__.__name__)
+        if not self.frozen:
+            object.__setattr__(self,'__class__',self.FROZEN)
+        return self
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self,memo):
+        ## frozen records are immutable - share them
+        if self.frozen: return self
+        return self.copy()
+
+    def as_dict(self):
+        return dict([(k,getattr(self,k)) for k in self.FIELDS])
+
+    def __getstate__(self):
+        return self.as_dict()
+
+    def __setstate__(self,state):
+        for k, v in state.iteritems():
+            object.__setattr__(self,k,v)
+
+    def __repr__(self):
+        return str(self.as_dict())
+
+
+class Position(SlotRecord):
+
+    __slots__ = FIELDS = ('symbol','qty','price')
+
     def __init__(self,symbol,qty,price):
         self.symbol = symbol
         self.qty = qty
         self.price = price
 
-    def __repr__(self):
-        return str(self.__dict__)
 
+class PriceData(SlotRecord):
 
-class PriceData(object):
+    __slots__ = FIELDS = ('timestamp','symbol','bid','ask','bid_volume','ask_volume',
+                          'open','high','low','close','trade_volume')
 
     def __init__(self):
         self.timestamp = None
@@ -124,11 +308,12 @@ class PriceData(object):
         self.close = None
         self.trade_volume = None
 
-    def __repr__(self):
-        return str(self.__dict__)
 
 class PriceDataBar(PriceData):
 
+    __slots__ = ('start_timestamp',)
+    FIELDS = PriceData.FIELDS + __slots__
+
     def __init__(self):
         super(PriceDataBar, self).__init__()
         self.start_timestamp = None
@@ -202,11 +387,8 @@ class PriceDataBar(PriceData):
 
 
     def clear(self):
-        for k in self.__dict__:
-            self.__dict__[k] = None
-
-    def __repr__(self):
-        return str(self.__dict__)
+        for k in self.FIELDS:
+            setattr(self,k,None)
 
 
 
@@ -254,7 +436,7 @@ class PriceBook(object):
         except KeyError:
             self.data[sym] = PriceDataBar()
             p = self.data[sym]
-            override_data = copy.deepcopy(market_data)
+            override_data = market_data.copy()
             override_data.timestamp = ts_override    
             p.update(override_data)
 
@@ -283,7 +465,9 @@ class PriceBook(object):
 
 
 
-class Fill(object):
+class Fill(SlotRecord):
+
+    __slots__ = FIELDS = ('qty','price','symbol','side','qty_left','order_id','fill_id','timestamp','tag')
 
     __id = 0
     @classmethod
@@ -305,11 +489,11 @@ class Fill(object):
         ## optional info identifier that can be used to tag a fill
         self.tag = None
 
-    def __repr__(self):
-        return str(self.__dict__)
 
+class Order(SlotRecord):
 
-class Order(object):
+    __slots__ = FIELDS = ('order_id','owner','symbol','side','qty','qty_left','order_type',
+                          'limit_price','stop_price','timestamp')
 
     __id = 0
     @classmethod
@@ -350,13 +534,91 @@ class Order(object):
             q = -self.qty
         return q
 
-    def __repr__(self):
-        return str(self.__dict__)
+
+## cancel / replace requests for a resting order, sent by the
+## owning strategy down the same queue as its orders
+class OrderCancel(SlotRecord):
+
+    __slots__ = FIELDS = ('order_id','owner','symbol','timestamp')
+
+    def __init__(self, owner, symbol, order_id):
+        self.order_id = order_id
+        self.owner = owner
+        self.symbol = symbol
+        self.timestamp = None
+
+    def stamp_time(self,timestamp):
+        self.timestamp = timestamp
 
 
+## None = leave that field as is, qty is the new total order qty
+class OrderReplace(SlotRecord):
+
+    __slots__ = FIELDS = ('order_id','owner','symbol','qty','limit_price','stop_price','timestamp')
+
+    def __init__(self, owner, symbol, order_id, qty=None, limit_price=None, stop_price=None):
+        self.order_id = order_id
+        self.owner = owner
+        self.symbol = symbol
+        self.qty = qty
+        self.limit_price = limit_price
+        self.stop_price = stop_price
+        self.timestamp = None
+
+    def stamp_time(self,timestamp):
+        self.timestamp = timestamp
+
+
+
+def _read_only(self,*args):
+    raise AttributeError('%s is frozen, copy() it to modify' % self.__class__.__name__)
+
+
+class FrozenFill(Fill):
+
+    __slots__ = ()
+    frozen = True
+    __setattr__ = _read_only
+    __delattr__ = _read_only
+
+
+class FrozenOrder(Order):
+
+    __slots__ = ()
+    frozen = True
+    __setattr__ = _read_only
+    __delattr__ = _read_only
+
+
+class FrozenOrderCancel(OrderCancel):
+
+    __slots__ = ()
+    frozen = True
+    __setattr__ = _read_only
+    __delattr__ = _read_only
+
+
+class FrozenOrderReplace(OrderReplace):
+
+    __slots__ = ()
+    frozen = True
+    __setattr__ = _read_only
+    __delattr__ = _read_only
+
+
+Fill.FROZEN = FrozenFill
+Order.FROZEN = FrozenOrder
+OrderCancel.FROZEN = FrozenOrderCancel
+OrderReplace.FROZEN = FrozenOrderReplace
+
 
 ## holds indicators for a given symbol
 class IndicatorMap(object):
+
+    ## process wide IndicatorRegistry.IndicatorRegistry, when set every map
+    ## hands out shared views instead of building its own indicators
+    registry = None
+
     def __init__(self,indicator_defs):
         ## create an array of indicator definitions
 
@@ -368,12 +630,26 @@ class IndicatorMap(object):
         self.idict = {}
         self.overrides = {} 
 
+        ## preloaded price series - see preload()
+        self.series = None
+        self.positions = {}
+
     ## override generic indicator setup
     ## with custom setting specfic to a symbol
     ## list = [ (symbol,name,{kwargs}) ]
     def override(self,override_list):
         self.overrides = dict([((x[0],x[1]),x[2]) for x in override_list])
 
+    ## simulation only: hand over the whole price series up front,
+    ## dict(symbol = VectorIndicators.SymbolSeries) from VectorIndicators.feed_series().
+    ## supported indicators are then precomputed with numpy instead of per push.
+    ## an indicator definition may name the price fields it is pushed with:
+    ## dict(name=.., class_name=.., kwargs=.., input=('close',))
+    def preload(self,series):
+        self.series = series
+        self.positions = {}
+        self.idict = {}
+
     ## reset all indicators = start by building a completely new map
     def reset(self):
         self.idict = {}
@@ -392,6 +668,17 @@ class IndicatorMap(object):
                 class_name = indicator_def['class_name']
                 kwargs = self.overrides.get((symbol,name),indicator_def['kwargs'])
 
+                inputs = indicator_def.get('input')
+                if self.series and symbol in self.series and \
+                        VectorIndicators.supports(class_name,kwargs,self.series[symbol],inputs):
+                    indicators[name] = VectorIndicators.VectorMetric(class_name,kwargs,self.series[symbol],
+                                                                     self.positions,symbol,inputs)
+                    continue
+
+                if self.registry is not None:
+                    indicators[name] = self.registry.view(symbol,class_name,kwargs)
+                    continue
+
                 ## dynamically build an indicator of 'class_name'
                 ## defined within the 'Indicators.py' module
                 indicators[name] = getattr(Indicators,class_name)(**kwargs)
@@ -9,9 +9,13 @@ import logging
 import pprint
 import sys
 import datetime
+import copy
+import multiprocessing
 
 from Simulator import Simulator
 from Simulator import fitness_function
+from Simulator import Pruner
+from DataFeed import DataFeed
 
 '''
 	Optimizer of strategy
@@ -43,8 +47,16 @@ from Simulator import fitness_function
     for p in param_list:
         optimizer.add_parameter(p)
 
+    ## optional: stop runs early that go past a 5000 drawdown, checked every
+    ## 250 bars. Pruner(optimism=1.0) also stops runs that look unlikely to
+    ## make the elites - a heuristic, it can cut a run with a late surge
+    optimizer.pruner = Pruner(every=250,max_dd=5000)
+
     optimizer.run()
 
+    ## SuccessiveHalving() is set up the same way: it scores a broad population
+    ## on short slices of the feed and runs only the best on all of it
+
 '''
 
 
@@ -95,6 +107,86 @@ def _order_dict(dct,order_list):
 	return x
 
 
+## one simulation run: returns the stats dict score() takes
+def _simulate(strategy_class,name,strategy_setup,strategy_params,data_feed,reset_on_EOD,verbose,pruner=None,max_bars=None):
+	s = Simulator()
+	s.reset_on_EOD = reset_on_EOD
+	s.pruner = pruner
+	s.max_bars = max_bars
+	## if you want have unique portfolio names per optimizer run
+	## s.portfolio.name = "".join(['portfolio_',name])
+	s.verbose = verbose 
+	s.add_strategy(strategy_class(name,strategy_setup=strategy_setup,strategy_params=strategy_params))
+	data_feed.reset()
+	return s.run(data_feed)
+
+
+## many runs in one pass over the feed: one Simulator lane per parameter set
+## jobs = [(run_id, name, strategy_params)], returns the summaries in job order
+def _simulate_batch(strategy_class,jobs,strategy_setup,data_feed,reset_on_EOD,verbose,pruner=None,max_bars=None):
+	s = Simulator(batch=True)
+	s.reset_on_EOD = reset_on_EOD
+	s.pruner = pruner
+	s.max_bars = max_bars
+	s.verbose = verbose 
+	for run_id, name, strategy_params in jobs:
+		s.add_strategy(strategy_class(name,strategy_setup=strategy_setup,strategy_params=strategy_params))
+	data_feed.reset()
+	return s.run(data_feed)
+
+
+## process pool workers:
+## the run settings (and the pre-loaded data feed) are handed over once
+## when the worker starts, jobs only carry (index, run_id, name, strategy_params, pruner, max_bars)
+_worker = {}
+
+def _init_worker(strategy_class,strategy_setup,data_feed,reset_on_EOD,verbose):
+	_worker.update(strategy_class=strategy_class,strategy_setup=strategy_setup,
+				data_feed=data_feed,reset_on_EOD=reset_on_EOD,verbose=verbose)
+
+def _run_job(job):
+	index, run_id, name, strategy_params, pruner, max_bars = job
+	w = _worker
+	summary = _simulate(w['strategy_class'],name,w['strategy_setup'],strategy_params,
+				w['data_feed'],w['reset_on_EOD'],w['verbose'],pruner,max_bars)
+	return index, run_id, summary
+
+## tasks = [(index, run_id, name, strategy_params, pruner, max_bars)] run as one batch
+def _run_batch(tasks):
+	w = _worker
+	summaries = _simulate_batch(w['strategy_class'],[ x[1:4] for x in tasks ],w['strategy_setup'],
+				w['data_feed'],w['reset_on_EOD'],w['verbose'],tasks[0][4],tasks[0][5])
+	return [ (x[0],x[1],summary) for x, summary in zip(tasks,summaries) ]
+
+
+## bars in a data feed: one pass over it
+def _feed_bars(data_feed):
+	data_feed.reset()
+	bars = 0
+	for market_data in data_feed:
+		if market_data != DataFeed.SENTINEL:
+			bars += 1
+	data_feed.reset()
+	return bars
+
+
+## bulk load a DataFeedList into memory once, before the workers fork,
+## so no worker re-parses the text files on every run.
+## the workers get a preloaded copy, the caller's feed is left as it was
+def _preload(data_feed):
+	if not (hasattr(data_feed,'load_array') and hasattr(data_feed,'master_list')):
+		return data_feed
+	feed = copy.copy(data_feed)
+	feed.preload = True
+	feed.arrays = dict(data_feed.arrays)
+	feed.feeds = []
+	feed.heap = None
+	feed.reset()
+	for filename in feed.master_list:
+		feed.load_array(filename)
+	return feed
+
+
 '''
 Segment defines a single 'gene'.
 steps = the number of values to be generated between min_val, max_val
@@ -380,6 +472,34 @@ class Optimizer(object):
 		## turn on Simulator verbosity
 		self.verbose = False
 
+		## number of processes evaluating a generation
+		## workers = 1 runs every simulation in this process
+		self.workers = 1
+
+		## batch = True: a generation runs as one Simulator(batch=True)
+		## pass over the feed per worker instead of one pass per parameter set
+		self.batch = False
+
+		## FitnessCache: results looked up before simulating
+		## needs a data_feed with a fingerprint()
+		self.fitness_cache = None
+		## dict[run_id] = 'hit' or 'miss'
+		self.cache_status = {}
+
+		## Pruner: stops runs that pass its max_dd, or (optimism set) look unlikely
+		## to make the elites, early.
+		## run() keeps its cutoff at the elite cutoff score of each generation
+		## and its total at the bars of a full run, pruned runs are scored
+		## on the stats they had and listed with status 'pruned:<reason>'
+		self.pruner = None
+
+		## simulate the first max_bars bars of the data_feed only
+		self.max_bars = None
+
+		## dict[bitcode] = bars simulated for it (cache hits are free)
+		self.budget = {}
+		self.bars_simulated = 0
+
 		## output controls
 		self.display_dump = True
 		## filename to write output to
@@ -455,6 +575,18 @@ class Optimizer(object):
 	def score(self,score_input,run_id):
 		fitness_score = fitness_function(score_input, min_trades=self.min_trade_count)
 
+		score_input = dict(score_input)
+		## cached runs from before pruning or bar counts
+		score_input.setdefault('bars',None)
+		pruner = self.pruner
+		if pruner is not None:
+			score_input.setdefault('status','done')
+			if score_input['status'] == 'pruned:max_dd':
+				## past the drawdown limit: not a candidate whatever it made
+				fitness_score = min(fitness_score,0)
+			if not pruner.total and score_input['status'] == 'done':
+				pruner.total = score_input['bars']
+
 		## self.population = [] of
 		## [fitness_score, strand_bit_string] elements
 		self.population[self.index][0] = fitness_score
@@ -468,6 +600,12 @@ class Optimizer(object):
 
 		self.results_map[bitcode] = (score_input, run_id)
 
+		bars = score_input['bars'] or 0
+		if self.cache_status.get(run_id) == 'hit':
+			bars = 0
+		self.budget[bitcode] = self.budget.get(bitcode,0) + bars
+		self.bars_simulated += bars
+
 		##increment pointer into the population
 		self.index += 1
 
@@ -479,7 +617,7 @@ class Optimizer(object):
 		for score, bitcode in self.population:
 			stats, run_id = self.results_map[bitcode]
 			params = self.factory.decode(bitcode)
-			output.append((score,stats,params,run_id))
+			output.append((score,stats,params,run_id,self.budget.get(bitcode,0)))
 			self.run_map[run_id] = params
 
 		stats_table, df = self._table(output)
@@ -488,6 +626,13 @@ class Optimizer(object):
 		self.optimizer_df = pandas.concat([self.optimizer_df,df])
 
 		if display:
+			if self.fitness_cache:
+				cache = self.fitness_cache
+				stats_table = '%s\nfitness cache: hits = %d, misses = %d' % (stats_table,cache.hits,cache.misses)
+			if self.pruner is not None:
+				pruned = len([ x for x in output if x[1]['status'] != 'done' ])
+				stats_table = '%s\npruned (%s): %d of %d' % (stats_table,self.pruner.describe(),pruned,len(output))
+			stats_table = '%s\nbars simulated: %d' % (stats_table,self.bars_simulated)
 			log.info('\n%s' % stats_table)
 
 		## persists the last generation	
@@ -535,7 +680,7 @@ class Optimizer(object):
 		df_header = None
 		stats_table = None
 		for row, item in enumerate(output):
-			score, stats, params, run_id = item
+			score, stats, params, run_id, budget = item
 
 			params = _order_dict(params,[])
 			stats = _order_dict(stats,['cnt','w_pct','pr','pnl','mtm_pnl','max_equ','max_dd'])
@@ -547,7 +692,8 @@ class Optimizer(object):
 			stats['tag'] = marker
 			
 			if not header:
-				header = ['gen_id', 'run_id', 'score']
+				header = ['gen_id', 'run_id', 'score', 'budget']
+				if self.fitness_cache: header.append('cache')
 				header.extend(stats.keys())
 				df_header = header[:]
 				## separate stats from parameters by and empty column
@@ -560,7 +706,8 @@ class Optimizer(object):
 						stats_table.float_format[col] = '0.2'
 				stats_table.float_format['score'] = '0.2'
 
-			s_items = [self.generation,run_id,score]
+			s_items = [self.generation,run_id,score,budget]
+			if self.fitness_cache: s_items.append(self.cache_status.get(run_id,''))
 			s_items.extend(stats.values())
 			stats_table.add_row(s_items)
 
@@ -575,7 +722,9 @@ class Optimizer(object):
 		## just show an abbrievated version of stats_table
 		## keep the full table around just in case needed
 		
-		abbrv = ['gen_id','run_id','score','cnt','pnl','pr','mtm_pnl','max_equ','max_dd','w_pct','tag']
+		abbrv = ['gen_id','run_id','score','budget','cnt','pnl','pr','mtm_pnl','max_equ','max_dd','w_pct','tag']
+		if self.fitness_cache: abbrv.insert(4,'cache')
+		if self.pruner is not None: abbrv.insert(4,'status')
 		stats_table = stats_table.get_string(fields=abbrv)
 		
 		return stats_table, df
@@ -675,33 +824,204 @@ class Optimizer(object):
 		return "".join([random.choice(string.ascii_uppercase) for i in range(name_length)])
 
 
+	## run the jobs [(run_id, name, strategy_params)] of a generation
+	## returns [(run_id, summary)] in job order, whatever order the pool finished in
+	## with a fitness_cache only the parameter sets not seen before are simulated
+	def evaluate(self,jobs,pool=None):
+
+		cache = self.fitness_cache
+		if cache is None:
+			return self._evaluate(jobs,pool)
+
+		fingerprint = self.data_feed.fingerprint()
+		results = [None] * len(jobs)
+		pending = collections.OrderedDict()
+		for index, job in enumerate(jobs):
+			run_id, name, strategy_params = job
+			flags = dict(reset_on_EOD=self.reset_on_EOD)
+			if self.max_bars: flags['max_bars'] = self.max_bars
+			key = cache.key(self.strategy_class,strategy_params,self.strategy_setup,fingerprint,**flags)
+			if key in pending:
+				## same values decoded twice in this generation
+				cache.hits += 1
+				self.cache_status[run_id] = 'hit'
+				pending[key].append(index)
+				continue
+			summary = cache.get(key)
+			if summary is None:
+				self.cache_status[run_id] = 'miss'
+				pending[key] = [index]
+			else:
+				self.cache_status[run_id] = 'hit'
+				results[index] = (run_id,summary)
+
+		if pending:
+			keys = pending.keys()
+			for key, (run_id, summary) in zip(keys,self._evaluate([ jobs[pending[k][0]] for k in keys ],pool)):
+				## a pruned run depends on the cutoff it ran against
+				if summary.get('status','done') == 'done':
+					cache.put(key,summary,self.strategy_class,jobs[pending[key][0]][2])
+				for index in pending[key]:
+					results[index] = (jobs[index][0],summary)
+
+		return results
+
+
+	def _evaluate(self,jobs,pool=None):
+
+		if self.batch:
+			return self._evaluate_batch(jobs,pool)
+
+		if pool is None:
+			results = []
+			for run_id, name, strategy_params in jobs:
+				summary = _simulate(self.strategy_class,name,self.strategy_setup,strategy_params,
+							self.data_feed,self.reset_on_EOD,self.verbose,self.pruner,self.max_bars)
+				results.append((run_id,summary))
+			return results
+
+		results = [None] * len(jobs)
+		tasks = [ (index,) + job + (self.pruner,self.max_bars) for index, job in enumerate(jobs) ]
+		for index, run_id, summary in pool.imap_unordered(_run_job,tasks):
+			results[index] = (run_id,summary)
+		return results
+
+
+	def _evaluate_batch(self,jobs,pool=None):
+
+		if pool is None:
+			summaries = _simulate_batch(self.strategy_class,jobs,self.strategy_setup,
+							self.data_feed,self.reset_on_EOD,self.verbose,self.pruner,self.max_bars)
+			return [ (job[0],summary) for job, summary in zip(jobs,summaries) ]
+
+		## one batch per worker
+		tasks = [ (index,) + job + (self.pruner,self.max_bars) for index, job in enumerate(jobs) ]
+		chunks = [ tasks[i::self.workers] for i in range(self.workers) ]
+		results = [None] * len(jobs)
+		for batch in pool.imap_unordered(_run_batch,[ x for x in chunks if x ]):
+			for index, run_id, summary in batch:
+				results[index] = (run_id,summary)
+		return results
+
+
+	def _pool(self):
+		if self.workers <= 1:
+			return None
+		initargs = (self.strategy_class,self.strategy_setup,_preload(self.data_feed),self.reset_on_EOD,self.verbose)
+		return multiprocessing.Pool(self.workers,_init_worker,initargs)
+
+
+	## the score a new strand has to beat to make the elites
+	def _set_cutoff(self):
+		pruner = self.pruner
+		if pruner is None:
+			return
+		pruner.min_trades = self.min_trade_count
+		pruner.cutoff = None
+		if self.generation > 1 and len(self.population) >= self.cutoff:
+			pruner.cutoff = self.population[self.cutoff-1][0]
+
+
 	def run(self):
 
-	    run_id = 0
-	    while not self.converged():
-			params_set = self.generate_set()
-			for strategy_params in params_set:
-				log.info('run_id = %d: %s' % (run_id,pprint.pformat(strategy_params)))
-				name = '%s_%s' % (self.strategy_class.__name__, self._tempname())
-				s = Simulator()
-				s.reset_on_EOD = self.reset_on_EOD
-				## if you want have unique portfolio names per optimizer run
-				## s.portfolio.name = "".join(['portfolio_',name])
-				s.verbose = self.verbose 
-				s.add_strategy(self.strategy_class(name,strategy_setup=self.strategy_setup,strategy_params=strategy_params))
-				self.data_feed.reset()
-				summary = s.run(self.data_feed)
-				self.score(summary,run_id)
-				run_id += 1
-			self.dump(display=self.display_dump)
+		pool = self._pool()
+		try:
+			run_id = 0
+			while not self.converged():
+				params_set = self.generate_set()
+				jobs = []
+				for strategy_params in params_set:
+					log.info('run_id = %d: %s' % (run_id,pprint.pformat(strategy_params)))
+					name = '%s_%s' % (self.strategy_class.__name__, self._tempname())
+					jobs.append((run_id,name,strategy_params))
+					run_id += 1
+				self._set_cutoff()
+				## score() walks the population in order - results come back in job order
+				for job_id, summary in self.evaluate(jobs,pool):
+					self.score(summary,job_id)
+				self.dump(display=self.display_dump)
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
 
 
 
+'''
+Successive Halving search engine:
+a multi-fidelity alternative to the GA loop in Optimizer.run()
+'''
 
-		
+
+class SuccessiveHalving(Optimizer):
+
+	## size strands are scored on the first total/eta**(rungs-1) bars of the
+	## data_feed, the best 1/eta of them go on to a slice eta times as long,
+	## and so on up to the finalists on the full history.
+	## each rung is dumped as a generation (gen_id = rung), the cutoff line
+	## marks the strands promoted, 'budget' the bars each strand has cost.
+	## min_trade_count is scaled down with the slice on the shorter rungs
+	def __init__(self):
+		super(SuccessiveHalving,self).__init__()
+
+		self.size = 81
+		self.eta = 3
+		self.rungs = 4
 
 
+	## bars per rung for a feed of total bars
+	def slices(self,total):
+		return [ int(math.ceil(total / float(self.eta ** (self.rungs - 1 - k)))) for k in range(self.rungs) ]
 
 
+	def run(self):
 
+		total = _feed_bars(self.data_feed)
+		min_trade_count = self.min_trade_count
 
+		strands = []
+		while len(strands) < self.size:
+			v = self.factory.gen_value()
+			if not v:
+				break
+			strands.append(v)
+
+		pool = self._pool()
+		try:
+			run_id = 0
+			for rung, bars in enumerate(self.slices(total)):
+				final = rung == self.rungs - 1
+				self.max_bars = None if bars >= total else bars
+				self.min_trade_count = int(math.ceil(min_trade_count * min(bars,total) / float(total)))
+				if self.pruner is not None:
+					self.pruner.min_trades = self.min_trade_count
+					self.pruner.cutoff = None
+					self.pruner.total = min(bars,total)
+
+				## a new round of scores for the strands left
+				self.generation = rung + 1
+				self.population = [ [0,v] for v in strands ]
+				self.results_map = {}
+				self.index = 0
+
+				jobs = []
+				for v in strands:
+					strategy_params = self.factory.decode(v)
+					log.info('run_id = %d: %s' % (run_id,pprint.pformat(strategy_params)))
+					name = '%s_%s' % (self.strategy_class.__name__, self._tempname())
+					jobs.append((run_id,name,strategy_params))
+					run_id += 1
+				for job_id, summary in self.evaluate(jobs,pool):
+					self.score(summary,job_id)
+
+				self.cutoff = len(strands) if final else max(1,len(strands) // self.eta)
+				self.dump(display=self.display_dump)
+
+				## dump() sorted the population best first
+				strands = [ v for score, v in self.population[:self.cutoff] ]
+		finally:
+			self.min_trade_count = min_trade_count
+			self.max_bars = None
+			if pool is not None:
+				pool.terminate()
+				pool.join()
@@ -3,10 +3,14 @@ import logging
 from threading import Thread, Lock
 from MarketObjects import Order, Fill, Position
 from ConfigParser import SafeConfigParser
-from DataQueues import DQueue
+from DataQueues import DQueue, SimQueue
 import pandas
+import numpy
 import cPickle
 import datetime
+from array import array
+from DataFeed import to_micros, from_micros
+from LiveStats import LiveStats
 
 '''
 Portfolio is the gatekeeper of all Strategy to Exchange communication.
@@ -19,14 +23,166 @@ The Porfolio class' functions are:
         - and a composite 'portofolio' level that combines all strategies activity
     3. Provides summary stats in simulations and optimazations
         - stats()  output can been write to pickle and Excel files
+        - live_stats() running stats that can be polled mid-run
 '''
 
+## fields of the trade and equity curve snapshots stats() tabulates
+TRADE_COLUMNS = ['symbol','qty','price','pnl','owner','timestamp']
+CURVE_COLUMNS = ['timestamp','symbol','qty','mtm','realized_pnl','mtm_pnl','owner']
+
+## the numeric fields recorded per snapshot
+TRADE_FIELDS = ('qty','price','pnl')
+CURVE_FIELDS = ('qty','mtm','realized_pnl','mtm_pnl')
+## sparse curves also keep the position of each row on the symbol's ticks
+SPARSE_CURVE_FIELDS = CURVE_FIELDS + ('tick',)
+## the fields recorded as ints
+INT_FIELDS = ('qty','tick')
+
+NAN = float('nan')
+
+## one entry cache: every strategy marks the same bar timestamp
+_last_stamp = (None,0)
+
+def _micros(timestamp):
+    global _last_stamp
+    if timestamp is not _last_stamp[0]:
+        _last_stamp = (timestamp,to_micros(timestamp))
+    return _last_stamp[1]
+
+
+## sampling clocks for sparse curves: timestamp -> sample period
+def _minute(timestamp):
+    return timestamp.replace(second=0,microsecond=0)
+
+def _hour(timestamp):
+    return timestamp.replace(minute=0,second=0,microsecond=0)
+
+def _day(timestamp):
+    return timestamp.date()
+
+SAMPLE_CLOCKS = dict(minute=_minute,hour=_hour,day=_day)
+
+
+## the trade or equity curve snapshots of one (owner, symbol), in typed
+## columns instead of a dict per snapshot: timestamps as int64 micros
+## since EPOCH, the numeric fields as float64 with NaN for None, in
+## growable array buffers. qty and tick are int64 as long as they only
+## get ints (a float or None turns the column to float64, the way pandas
+## typed the dict rows). owner and symbol are the same for every row
+## and are kept once. a timestamp that isn't a datetime turns the
+## timestamps into a plain list.
+class Snapshots(object):
+
+    def __init__(self,owner,symbol,fields):
+        self.owner = owner
+        self.symbol = symbol
+        self.fields = fields
+        self.index = dict([ (f, j) for j, f in enumerate(fields) ])
+        self.stamps = array('l')
+        self.last_timestamp = None
+        self.columns = [ array('l' if f in INT_FIELDS else 'd') for f in fields ]
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def append(self,timestamp,values):
+        self.last_timestamp = timestamp
+        stamps = self.stamps
+        try:
+            stamps.append(_micros(timestamp))
+        except (TypeError,AttributeError,OverflowError):
+            if stamps.__class__ is array:
+                stamps = self.stamps = [ from_micros(s) for s in stamps ]
+            stamps.append(timestamp)
+        columns = self.columns
+        for j, value in enumerate(values):
+            if value is None: value = NAN
+            try:
+                columns[j].append(value)
+            except TypeError:
+                self.floats(j).append(value)
+
+    ## True if the last row was recorded at timestamp
+    def at(self,timestamp):
+        if not self.stamps:
+            return False
+        return timestamp == self.last_timestamp
+
+    ## replace the last row in place (same timestamp)
+    def overwrite(self,values):
+        last = len(self.stamps) - 1
+        for j, value in enumerate(values):
+            if value is None: value = NAN
+            try:
+                self.columns[j][last] = value
+            except TypeError:
+                self.floats(j)[last] = value
+
+    ## an int column given a float: float from there on
+    def floats(self,j):
+        self.columns[j] = array('d',self.columns[j])
+        return self.columns[j]
+
+    def last(self,field):
+        return self.columns[self.index[field]][-1]
+
+    ## numeric field as a float64 array, NaN for None (or int64, see above)
+    def values(self,field):
+        column = self.columns[self.index[field]]
+        return numpy.frombuffer(column,dtype=numpy.dtype(column.typecode)).copy()
+
+    def timestamps(self):
+        if self.stamps.__class__ is array:
+            micros = numpy.frombuffer(self.stamps,dtype=numpy.dtype('l')).astype(numpy.int64)
+            return micros.view('M8[us]').astype('M8[ns]')
+        return list(self.stamps)
+
+    def column(self,field):
+        if field == 'timestamp':
+            return self.timestamps()
+        if field == 'owner':
+            return [ self.owner ] * len(self)
+        if field == 'symbol':
+            return [ self.symbol ] * len(self)
+        return self.values(field)
+
+    def table(self,columns):
+        data = dict([ (f, self.column(f)) for f in columns ])
+        return pandas.DataFrame(data,columns=columns)
+
+
+## mean and ddof=1 std of a float array, as pandas computes them.
+## sequential: the values came from an object column, which pandas
+## sums left to right in python for the mean (the std still sums in numpy)
+def _mean_std(values,sequential=False):
+    count = len(values)
+    avg = values.sum(dtype=numpy.float64)/count
+    mean = avg
+    if sequential:
+        mean = sum(values.tolist())/float(count)
+    if count <= 1:
+        return mean, numpy.nan
+    sqr = (avg - values)**2
+    return mean, numpy.sqrt(sqr.sum(dtype=numpy.float64)/(count - 1))
+
+
 class Portfolio(Thread):
 
-    def __init__(self,name,config_file):
+    ## threaded=False: lock free queues for single threaded simulation
+    ##
+    ## sparse=True: mark_to_market() only records the curves of strategies
+    ## holding the symbol, a flat strategy's curve is carried forward
+    ## and filled back in onto every tick of the symbol by stats().
+    ## sample_clock: record held positions once per period instead of every
+    ## tick, the last mark of each period (and before every fill) is kept.
+    ## 'minute', 'hour', 'day' or a function timestamp -> period.
+    ## None marks every tick, so the curves come out exactly as dense ones
+    def __init__(self,name,config_file,threaded=True,sparse=False,sample_clock=None):
 
         super(Portfolio,self).__init__()
 
+        self.queue_class = DQueue if threaded else SimQueue
+
         self.portfolio_name = name
         self.running = True # thread flag
         self.lock = Lock()
@@ -52,7 +208,7 @@ class Portfolio(Thread):
         self.strategy_positions = {}
         self.strategy_allocations = {} ##  tuple(portfolio_weight, dollars_allocated)
 
-        # convert this array of dict(symbol,qty,mtm,owner,timestamp) to df for analysis
+        # Snapshots(symbol,qty,mtm,owner,timestamp) by strategy, symbol; stats() makes the dfs
         self.trading_activity = {}
         self.equity_curves = {}
 
@@ -62,11 +218,22 @@ class Portfolio(Thread):
         ## map of current market data by symbol
         self.current_data = {}
 
+        self.sparse = sparse
+        self.sample_clock = SAMPLE_CLOCKS.get(sample_clock,sample_clock)
+        self.curve_fields = SPARSE_CURVE_FIELDS if sparse else CURVE_FIELDS
+        ## sparse: tick timestamps by symbol, the grid the curves are filled onto
+        self.clock = {}
+        ## sampled: dict[owner,symbol] = (timestamp,qty,mtm,tick,period) of the latest mark
+        self.pending_marks = {}
+
         ## portfolio dict that holds aggregate positions across all strats
         self.strategy_positions[self.portfolio_name] = {}
         self.trading_activity[self.portfolio_name] = {}
         self.equity_curves[self.portfolio_name] = {}
 
+        ## LiveStats by owner, updated on every trade and curve row
+        self.live = {}
+        self.live[self.portfolio_name] = LiveStats(self.portfolio_name)
 
         self._attributes = {}           ## general config dict
 
@@ -95,14 +262,23 @@ class Portfolio(Thread):
     ##an interface that provides the name and queue connecitions for the strategy
     ##this allow distributed placement of actual strategies
     def add(self,strategy):
-        # dict[strategy][symbol] = []  #array of dicts that can be converted to df
+        # dict[strategy][symbol] = Snapshots  #trade and curve columns that stats() turns into dfs
         self.strategy_positions[strategy.name] = {}
         self.equity_curves[strategy.name] = {}
         self.trading_activity[strategy.name] = {}
+        self.live[strategy.name] = LiveStats(strategy.name)
 
         self.strategy_attributes[strategy.name] = dict(strategy.strategy_params)
 
-        self.STRAT_orders[strategy.name] = strategy.OUT_orders.new()
+        self.STRAT_orders[strategy.name] = strategy.OUT_orders.new(self.queue_class())
+
+
+    ## orders are kept to map fills back to their owner,
+    ## cancel/replace requests are for the exchange only
+    def register_order(self,order):
+        if isinstance(order,Order):
+            self.order_lookup[order.order_id] = order
+            self.log.info("registered order: %s" % order)
 
 
     def update_allocations(self,alloc):
@@ -154,44 +330,71 @@ class Portfolio(Thread):
 
         pnl = self.normalize_pnl(fill.symbol,ticks)
 
-        trade = {
-            'symbol': fill.symbol,
-            'qty':fill.qty if fill.side == Order.BUY else -fill.qty,
-            'price':fill.price,
-            'pnl':pnl,
-            'owner':owner,
-            'timestamp':fill.timestamp
-        }
+        qty = fill.qty if fill.side == Order.BUY else -fill.qty
+
         activity = self.trading_activity[owner]
-        if fill.symbol not in activity.keys(): activity[fill.symbol] = []
-        activity[fill.symbol].append(trade)
-        self.log.info("trade: %s" % trade)
+        trades = activity.get(fill.symbol)
+        if trades is None:
+            trades = activity[fill.symbol] = Snapshots(owner,fill.symbol,TRADE_FIELDS)
+        trades.append(fill.timestamp,(qty,fill.price,pnl))
+        if self.log.isEnabledFor(logging.INFO):
+            trade = {
+                'symbol': fill.symbol,
+                'qty':qty,
+                'price':fill.price,
+                'pnl':pnl,
+                'owner':owner,
+                'timestamp':fill.timestamp
+            }
+            self.log.info("trade: %s" % trade)
+
+        live = self.live_owner(owner)
+        live.trade(fill.symbol,pnl)
+
+        if self.pending_marks:
+            self.flush_mark(owner,fill.symbol)
 
         curves = self.equity_curves[owner]
-        if fill.symbol not in curves.keys(): curves[fill.symbol] = []
-        equ = curves[fill.symbol]
+        equ = curves.get(fill.symbol)
+        if equ is None:
+            equ = curves[fill.symbol] = Snapshots(owner,fill.symbol,self.curve_fields)
         prev_pnl = 0
-        if equ: prev_pnl = equ[-1]['realized_pnl']
+        if equ: prev_pnl = equ.last('realized_pnl')
         if not pnl: pnl = 0
 
-        snapshot = {
-            'symbol':fill.symbol,
-            'qty':qty_left,
-            'mtm':pnl,
-            'realized_pnl':prev_pnl + pnl,
-            'mtm_pnl':prev_pnl + pnl,
-            'owner':owner,
-            'timestamp':fill.timestamp
-        }
+        snapshot = (qty_left,pnl,prev_pnl + pnl,prev_pnl + pnl)
+        if self.sparse:
+            snapshot += (self.clock_tick(fill.symbol,fill.timestamp),)
 
-        equ.append(snapshot)
-        self.log.info("pnl snap: %s" % snapshot)
+        ## a pnl snapshot replaces anything recorded at the same timestamp
+        if equ.at(fill.timestamp):
+            equ.overwrite(snapshot)
+        else:
+            equ.append(fill.timestamp,snapshot)
+        live.mark(fill.symbol,fill.timestamp,prev_pnl + pnl)
+
+        if self.log.isEnabledFor(logging.INFO):
+            snapshot = {
+                'symbol':fill.symbol,
+                'qty':qty_left,
+                'mtm':pnl,
+                'realized_pnl':prev_pnl + pnl,
+                'mtm_pnl':prev_pnl + pnl,
+                'owner':owner,
+                'timestamp':fill.timestamp
+            }
+            self.log.info("pnl snap: %s" % snapshot)
 
         ##self.update_allocations(pnl)
 
 
     def mark_position(self, price_data, owner, position):
-        mtm = prev_pnl = 0
+        qty, mtm = self.position_value(price_data, position)
+        self.record_mark(owner, price_data.symbol, price_data.timestamp, qty, mtm)
+
+
+    def position_value(self, price_data, position):
+        mtm = 0
         qty = 0
         symbol = price_data.symbol
 
@@ -205,36 +408,39 @@ class Portfolio(Thread):
                 if price_data.ask: mtm_price = price_data.ask
                 mtm = self.normalize_pnl(symbol, abs(qty)*(position.price - mtm_price))
 
-        curves = self.equity_curves[owner]
-        if symbol not in curves.keys(): curves[symbol] = []
-        equ = curves[symbol]
-        prev_pnl = 0
-        if equ: prev_pnl = equ[-1]['realized_pnl']
-
-        snapshot = {
-            'symbol':symbol,
-            'qty':qty,
-            'mtm':mtm,
-            'realized_pnl':prev_pnl,
-            'mtm_pnl':prev_pnl + mtm,
-            'owner':owner,
-            'timestamp':price_data.timestamp
-        }
+        return qty, mtm
 
-        
-        ## make sure pnl snapshots due to trading come after
-        ## mtm snapshots of at the same timestamp.
-        ## duplicate timestamps will be reduced out when blending the curves
-              
-        last = None 
-        if equ:
-            if equ[-1]['timestamp'] == snapshot['timestamp']:
-                last = equ.pop()
-
-        equ.append(snapshot)
-        if last: equ.append(last)
 
-        self.log.info("mtm snap: %s" % snapshot)
+    def record_mark(self, owner, symbol, timestamp, qty, mtm, tick=None):
+        curves = self.equity_curves[owner]
+        equ = curves.get(symbol)
+        if equ is None:
+            equ = curves[symbol] = Snapshots(owner,symbol,self.curve_fields)
+        prev_pnl = 0
+        if equ: prev_pnl = equ.last('realized_pnl')
+
+        snapshot = (qty,mtm,prev_pnl,prev_pnl + mtm)
+        if self.sparse:
+            if tick is None: tick = self.clock_tick(symbol,timestamp)
+            snapshot += (tick,)
+
+        ## pnl snapshots due to trading take precedence over
+        ## mtm snapshots of the same timestamp
+        if not equ.at(timestamp):
+            equ.append(timestamp,snapshot)
+            (self.live.get(owner) or self.live_owner(owner)).mark(symbol,timestamp,prev_pnl + mtm)
+
+        if self.log.isEnabledFor(logging.INFO):
+            snapshot = {
+                'symbol':symbol,
+                'qty':qty,
+                'mtm':mtm,
+                'realized_pnl':prev_pnl,
+                'mtm_pnl':prev_pnl + mtm,
+                'owner':owner,
+                'timestamp':timestamp
+            }
+            self.log.info("mtm snap: %s" % snapshot)
 
 
     def update_positions(self, symbol, fill, strategy_owner):
@@ -301,6 +507,10 @@ class Portfolio(Thread):
 
     def mark_to_market(self, market_data):
 
+        if self.sparse:
+            self.mark_to_market_sparse(market_data)
+            return
+
         symbol = market_data.symbol
         for strategy, positions in self.strategy_positions.iteritems():
             if symbol in positions.keys():
@@ -310,6 +520,125 @@ class Portfolio(Thread):
                 self.mark_position(market_data,strategy,None)
 
 
+    def mark_to_market_sparse(self, market_data):
+
+        symbol = market_data.symbol
+        timestamp = market_data.timestamp
+        clock = self.clock.get(symbol)
+        if clock is None:
+            clock = self.clock[symbol] = Snapshots(None,symbol,())
+            for owner in self.strategy_positions:
+                self.live_owner(owner).start(symbol,timestamp)
+        if not clock.at(timestamp):
+            clock.append(timestamp,())
+        tick = len(clock) - 1
+
+        sample_clock = self.sample_clock
+        for strategy, positions in self.strategy_positions.iteritems():
+            position = positions.get(symbol)
+            ## flat: nothing to record, stats() carries the curve forward
+            if position is None or position.qty == 0:
+                continue
+            qty, mtm = self.position_value(market_data, position)
+            if sample_clock is None:
+                self.record_mark(strategy, symbol, timestamp, qty, mtm, tick)
+                continue
+            key = (strategy,symbol)
+            period = sample_clock(timestamp)
+            pending = self.pending_marks.get(key)
+            if pending is not None and pending[4] != period:
+                self.record_mark(strategy, symbol, *pending[:4])
+            self.pending_marks[key] = (timestamp,qty,mtm,tick,period)
+
+
+    ## index of timestamp on the symbol's ticks: fills come in before
+    ## mark_to_market() has seen the tick they belong to
+    def clock_tick(self, symbol, timestamp):
+        clock = self.clock.get(symbol)
+        if clock is None:
+            return 0
+        if clock.at(timestamp):
+            return len(clock) - 1
+        return len(clock)
+
+
+    ## record the sampled mark of owner/symbol still waiting for its period to end
+    def flush_mark(self, owner, symbol):
+        pending = self.pending_marks.pop((owner,symbol),None)
+        if pending is not None:
+            self.record_mark(owner, symbol, *pending[:4])
+
+
+    ## a sparse curve filled in with the rows mark_to_market() records
+    ## for a flat strategy on every tick of the symbol: the last row
+    ## recorded at or before the tick, carried forward with no mtm
+    def dense_curve(self, owner, symbol):
+
+        clock = self.clock[symbol]
+        clock_stamps = numpy.asarray(clock.column('timestamp'))
+        n = len(clock)
+        fields = ['qty','mtm','realized_pnl','mtm_pnl']
+
+        equ = self.equity_curves[owner].get(symbol)
+        if equ is None:
+            equ = Snapshots(owner,symbol,SPARSE_CURVE_FIELDS)
+        rows = equ.table(['timestamp'] + fields)
+        row_stamps = numpy.asarray(rows['timestamp'].values)
+        if not len(equ):
+            row_stamps = clock_stamps[:0]
+        ticks = equ.values('tick').astype(numpy.int64)
+
+        ## ticks without a row of their own
+        on_tick = ticks < n
+        on_tick[on_tick] = row_stamps[on_tick] == clock_stamps[ticks[on_tick]]
+        covered = numpy.zeros(n,dtype=bool)
+        covered[ticks[on_tick]] = True
+        missing = numpy.flatnonzero(~covered)
+        source = numpy.searchsorted(ticks,missing,side='right') - 1
+        carried = source >= 0
+
+        columns = {}
+        for f in ['qty','realized_pnl','mtm_pnl']:
+            values = numpy.zeros(len(missing),dtype=rows[f].dtype)
+            values[carried] = rows[f].values[source[carried]]
+            columns[f] = values
+        columns['mtm'] = columns['mtm_pnl'] - columns['realized_pnl']
+
+        ## rows before their tick's (filled in) row, in the order recorded
+        order = numpy.lexsort(( numpy.arange(len(ticks) + len(missing)),
+                                numpy.concatenate([ on_tick, numpy.ones(len(missing),dtype=bool) ]),
+                                numpy.concatenate([ ticks, missing ]) ))
+
+        data = dict(symbol=symbol,owner=owner)
+        data['timestamp'] = numpy.concatenate([ row_stamps, clock_stamps[missing] ])[order]
+        for f in fields:
+            data[f] = numpy.concatenate([ rows[f].values, columns[f] ])[order]
+
+        return pandas.DataFrame(data,columns=CURVE_COLUMNS)
+
+
+    def live_owner(self,owner):
+        live = self.live.get(owner)
+        if live is None:
+            live = self.live[owner] = LiveStats(owner)
+        return live
+
+
+    ## the stats() summary of owner (default the portfolio) or one of its
+    ## symbols, from the running LiveStats: cheap enough to poll every bar.
+    ## matches stats() to 1e-9, 1e-4 on the truncated trade stats (see LiveStats).
+    ## sampled marks still waiting for their period aren't in it yet
+    def live_stats(self,owner=None,symbol=None):
+        live = self.live.get(owner or self.portfolio_name)
+        if live is None:
+            live = LiveStats(owner)
+        trade_stats, curve_stats = live.stats(symbol)
+        dct = self._trunc_results(trade_stats,exclude=['tag','cnt','pnl'])
+        curve_stats.pop('tag')
+        dct.update(curve_stats)
+        return dct
+
+
     def _trunc_results(self,dct,exclude=[]):
         for k, v in dct.iteritems():
             try:
@@ -319,31 +648,44 @@ class Portfolio(Thread):
                 pass
         return dct
 
-    def win_loss_stats(self,tag,stat_table):
+    ## the stats below are vectorized numpy reductions that follow the
+    ## pandas Series calls they replaced (skipna sums/means, ddof=1 std),
+    ## so the numbers come out the same to the last bit
+
+    def win_loss_stats(self,tag,pnl,sequential=False):
+        ## pnl: float array of trade pnls, NaN where a trade opened a position.
+        ## sequential: the pnl column was object typed (see stats())
 
-        if stat_table.empty:
+        if not len(pnl):
             return dict(tag=tag,cnt=0,w_avg=0,w_std=0,pr=0,l_avg=0,l_std=0,w_pct=0,pnl=0,shrp=0)
 
-        wins = stat_table[stat_table['pnl'] > 0]
-        losses = stat_table[stat_table['pnl'] <= 0]
-        trades = stat_table[~pandas.isnull(stat_table['pnl'])] ## grab all not null pnls
+        with numpy.errstate(invalid='ignore'):
+            valid = ~numpy.isnan(pnl)
+            wins = pnl[pnl > 0]
+            losses = pnl[pnl <= 0]
+        ## numpy.int64, as Series.count() gave
+        cnt = valid.sum()
         sharpe = 0
-        if trades['pnl'].count() >0:
-            sharpe = trades['pnl'].mean()/trades['pnl'].std()
+        if cnt > 0:
+            avg, stdv = _mean_std(pnl[valid],sequential)
+            sharpe = avg/stdv
         avg_win = stdv_win = 0
-        if wins['pnl'].count() > 0:
-            avg_win, stdv_win = wins['pnl'].mean(), wins['pnl'].std()
+        if len(wins) > 0:
+            avg_win, stdv_win = _mean_std(wins,sequential)
         avg_loss = stdv_loss = 0
-        if losses['pnl'].count() > 0:
-            avg_loss, stdv_loss = losses['pnl'].mean(), losses['pnl'].std()
+        if len(losses) > 0:
+            avg_loss, stdv_loss = _mean_std(losses,sequential)
         profit_ratio = 0
         if avg_loss != 0:
             profit_ratio = -1*avg_win/avg_loss
-        cnt = stat_table['pnl'].count()
-        tot = stat_table['pnl'].sum()
+        ## nulls sum as zeros in place, all null sums to NaN
+        tot = numpy.nan
+        if cnt > 0:
+            tot = numpy.where(valid,pnl,0.0)
+            tot = sum(tot.tolist()) if sequential else tot.sum()
         wpct = 0
         if cnt > 0:
-            wpct = float(wins['pnl'].count())/cnt
+            wpct = float(len(wins))/cnt
 
         dct = dict(tag=tag,cnt=cnt,w_avg=avg_win,w_std=stdv_win,pr=profit_ratio, \
                    l_avg=avg_loss,l_std=stdv_loss,w_pct=wpct,pnl=tot,shrp=sharpe)
@@ -351,60 +693,44 @@ class Portfolio(Thread):
         return self._trunc_results(dct,exclude=['tag','cnt','pnl'])
 
 
-    def equ_curve_stats(self,tag,curve_table):
+    def equ_curve_stats(self,tag,mtm):
+        ## mtm: the mtm_pnl column of an equity curve
 
-        if curve_table.empty:
+        if not len(mtm):
             return dict(tag=tag,mtm_pnl=0,max_equ=0,max_dd=0,avg_dd=0)
 
-        max_equ = 0
-        max_dd = avg_dd  = 0
-        mtm_pnl = 0
-        if curve_table['mtm_pnl'].count() > 0:
-            curve_table['top'] = curve_table['mtm_pnl'].cummax()
-            mtm_pnl = curve_table.iloc[-1]['mtm_pnl']
-            curve_table['ddwn'] = curve_table['top'] - curve_table['mtm_pnl']
-            max_equ = curve_table['mtm_pnl'].max()
-            ddwns = curve_table[curve_table['ddwn'] > 0 ]
-            max_dd, avg_dd, = ddwns['ddwn'].max(), ddwns['ddwn'].mean()
-
-        return dict(tag=tag,mtm_pnl=mtm_pnl,max_equ=max_equ,max_dd=max_dd,avg_dd=avg_dd)
-
-
-
-    def blend_curve(self,curve1,curve2,column):
-
-        if curve1 is not None and not curve1.empty:
-            ## setup index of the curve
-            ## and copy mtm column to col=symbol_name
-            
-            if curve2 is not None and not curve2.empty:
-
-                curve2 = curve2.set_index('timestamp')
-                curve2['temp'] = curve2[column]
+        top = numpy.maximum.accumulate(mtm)
+        ddwn = top - mtm
+        ddwns = ddwn[ddwn > 0]
+        max_dd = avg_dd = numpy.nan
+        if len(ddwns) > 0:
+            max_dd, avg_dd = ddwns.max(), ddwns.mean()
 
-                ## concat columns by index
-                ## and fill in NaN with prev value of each column
-                curve1 = pandas.concat([curve1[column],curve2['temp']],join='outer',axis=1)
-                curve1 = curve1.fillna(method='ffill')
+        return dict(tag=tag,mtm_pnl=mtm[-1],max_equ=mtm.max(),max_dd=max_dd,avg_dd=avg_dd)
 
-                ## fill leading NaNs with zeros
-                curve1 = curve1.fillna(value=0)
 
-                #sum across columns
-                #and replace tot mtm_pnl with the new value
-                #curve1['new_pnl'] = curve1.sum(axis=1)
-                #curve1['mtm_pnl'] = curve1['new_pnl']
-                #curve1 = curve1[['mtm_pnl']]
-                curve1 = pandas.DataFrame(curve1.sum(axis=1),columns=[column])
-        else:
+    def blend_curves(self,curves):
 
-            if curve2 is not None and not curve2.empty:
-                curve1 = curve2.copy()
+        ## curves: one table per symbol, indexed by timestamp.
+        ## a single outer join on timestamp, each column carried forward
+        ## (zero before its first point), then summed across symbols
+        columns = list(curves[0].columns)
+        width = len(columns)
+        table = curves[0]
+        if len(curves) > 1:
+            table = pandas.concat(curves,join='outer',axis=1)
+            table = table.fillna(method='ffill')
+            table = table.fillna(value=0)
 
-        if curve1 is not None and 'timestamp' in curve1.columns:    
-            curve1 = curve1.set_index('timestamp')
+        blended = pandas.DataFrame(index=table.index)
+        for j, column in enumerate(columns):
+            ## added symbol by symbol, the order the curves were blended in
+            total = table.iloc[:,j]
+            for i in range(j + width, len(table.columns), width):
+                total = total + table.iloc[:,i]
+            blended[column] = total
 
-        return curve1
+        return blended
 
 
     def stats(self):
@@ -414,12 +740,12 @@ class Portfolio(Thread):
             self.storage[k] = dict()
 
         portfolio_stats = None
-        ## portfolio_curve = None
         portfolio_curve_stats = None
 
         ## note: strat = portfolio_name holds all agg trade info
         for strat, activity in self.trading_activity.iteritems():
-            comp_table = pandas.DataFrame()
+            comp_pnl = []
+            comp_objects = False
             comp_stats = []
             activity_keys = activity.keys()
             activity_keys.sort()
@@ -432,19 +758,23 @@ class Portfolio(Thread):
                 self.storage['settings'][strat] = attr_table 
 
             for sym in activity_keys:
-                stat_table = pandas.DataFrame(activity[sym])
-                stat_table['pnl_tot'] = stat_table['pnl'].cumsum()
-                stat_table = stat_table[['symbol','qty','price','pnl','pnl_tot','owner','timestamp']]  ## rearrange columns
+                stat_table = activity[sym].table(TRADE_COLUMNS)
+                stat_table.insert(4,'pnl_tot',stat_table['pnl'].cumsum())
                 self.storage['trades'][strat,sym] = stat_table
 
-                #combine all symbols into a composite table
-                comp_table = comp_table.append(stat_table,ignore_index=True)
-
                 #calc pnl stats by symbol
-                comp_stats.append(self.win_loss_stats(sym,stat_table))
+                pnl = activity[sym].values('pnl')
+                comp_stats.append(self.win_loss_stats(sym,pnl))
+                comp_pnl.append(pnl)
+
+                ## a symbol with no closed trade had an all None pnl column,
+                ## which pandas typed object, and so the composite column too
+                if numpy.isnan(pnl).all():
+                    comp_objects = True
 
             ## do overall calcs for strategy across all symbols
-            blended_stats = self.win_loss_stats(strat,comp_table)
+            comp_pnl = numpy.concatenate(comp_pnl) if comp_pnl else numpy.empty(0)
+            blended_stats = self.win_loss_stats(strat,comp_pnl,comp_objects)
             comp_stats.append(blended_stats)
 
             comp_table = pandas.DataFrame(comp_stats)
@@ -455,47 +785,47 @@ class Portfolio(Thread):
                 portfolio_stats = blended_stats.copy()
 
 
+        ## sampled marks still waiting for the end of their period
+        for owner, symbol in self.pending_marks.keys():
+            self.flush_mark(owner,symbol)
+
         ##dump equ curves
         ##NOTE the composite curve is listed under strat=self.portfolio_name
         for strat, curves in self.equity_curves.iteritems():
-            mtm = None
-            realized = None
-            comp_table = pandas.DataFrame()
+            strands = []
             comp_stats = []
-            curve_keys = curves.keys()
-            curve_keys.sort()
+            curve_keys = set(curves.keys())
+            if self.sparse:
+                curve_keys.update(self.clock.keys())
+            curve_keys = sorted(curve_keys)
             for sym in curve_keys:
-                curve_df = pandas.DataFrame(curves[sym])
-
-                ## trading equ entries take precedence
-                ## so drop duplicate index entries where a pnl snap and mtm snap
-                ## happen on the same timestamp
-                ## DEPRECATED --> curve_df.drop_duplicates(subset=['timestamp'],take_last=True,inplace=True)
-                curve_df.drop_duplicates(subset=['timestamp'],keep='last',inplace=True)
-                curve_df.reset_index(inplace=True)
-                curve_table = curve_df[['timestamp', 'symbol','qty','mtm','realized_pnl','mtm_pnl','owner']]
+                if self.sparse and sym in self.clock:
+                    curve_table = self.dense_curve(strat,sym)
+                else:
+                    curve_table = curves[sym].table(CURVE_COLUMNS)
+
+                ## a timestamp recorded again later on (out of order data)
+                ## keeps its last entry
+                dups = curve_table['timestamp'].duplicated(keep='last').values
+                if dups.any():
+                    curve_table = curve_table[~dups].reset_index(drop=True)
                 self.storage['curve'][strat,sym] = curve_table
 
                 ## calc equ_curve stats for that symbol
-                comp_stats.append(self.equ_curve_stats(sym,curve_df))
-
-                ## add in curve of each symbol per strategy
-                strand = curve_df[['timestamp','mtm_pnl']]
-                mtm = self.blend_curve(mtm,strand,'mtm_pnl')
+                comp_stats.append(self.equ_curve_stats(sym,curve_table['mtm_pnl'].values))
 
-                strand = curve_df[['timestamp','realized_pnl']]
-                realized = self.blend_curve(realized,strand,'realized_pnl')
+                strands.append(curve_table.set_index('timestamp')[['realized_pnl','mtm_pnl']])
 
             ## start with blank curve data
             ## only blend curves that have data
-            stat_curve = pandas.DataFrame() 
-            blended_curve = None 
-            if realized is not None:
-                blended_curve =  pandas.concat([realized['realized_pnl'],mtm['mtm_pnl']],join='outer',axis=1)
-                stat_curve = blended_curve[['mtm_pnl']]
+            blended_curve = None
+            mtm = numpy.empty(0)
+            if strands:
+                blended_curve = self.blend_curves(strands)
+                mtm = blended_curve['mtm_pnl'].values
 
             ##do overall stats of strategy's blended curve
-            overall_stats = self.equ_curve_stats(strat,stat_curve)
+            overall_stats = self.equ_curve_stats(strat,mtm)
             comp_stats.append(overall_stats)
 
             if strat == self.portfolio_name:
@@ -572,9 +902,7 @@ class Portfolio(Thread):
                 ### published by each strategy
                 for strat in self.STRAT_orders.keys():
                     try:
-                        order = self.STRAT_orders[strat].get()
-                        self.order_lookup[order.order_id] = order
-                        self.log.info("registered order: %s" % order)
+                        self.register_order(self.STRAT_orders[strat].get())
                     except IndexError:
                         pass
 
@@ -605,9 +933,7 @@ class Portfolio(Thread):
                 for strat in self.STRAT_orders.keys():
                     orders = self.STRAT_orders[strat]
                     while orders:
-                        order = orders.get()
-                        self.order_lookup[order.order_id] = order
-                        self.log.info("registered order: %s" % order)
+                        self.register_order(orders.get())
 
                 ## deplete fill queue first
                 while self.IN_fills:
@@ -640,9 +966,7 @@ class Portfolio(Thread):
             for strat in self.STRAT_orders.keys():
                 orders = self.STRAT_orders[strat]
                 while orders:
-                    order = orders.get()
-                    self.order_lookup[order.order_id] = order
-                    self.log.info("registered order: %s" % order)
+                    self.register_order(orders.get())
 
             ## deplete fill queue first
             while self.IN_fills:
@@ -1,13 +1,15 @@
 
-from DataQueues import DQueue, DataLatch
+from DataQueues import DQueue, DataLatch, SimQueue, SimDataLatch
 from Exchange import Exchange
 from Portfolio import Portfolio
 from DataFeed import DataFeed
+import VectorIndicators
+import IndicatorRegistry
+from MarketObjects import IndicatorMap
 import logging
 import sys
 import datetime
 import math
-from collections import OrderedDict
 from prettytable import PrettyTable
 import matplotlib.pylab as pylab
 import pandas
@@ -90,15 +92,132 @@ def fitness_function(score_input,min_trades=1):
     return fit_value
 
 
+## checked by Simulator.run() every `every` bars against the portfolio's
+## live_stats(), stops runs that can no longer pay off:
+##   max_dd: stop once the drawdown is past this
+##   cutoff: score to beat (the optimizer's elite cutoff), total: bars in the feed.
+##     from min_progress of the way through, stop once bound() is below cutoff.
+##     bound() is a heuristic, not a true upper bound: it assumes the rest of
+##     the run makes money no faster than `optimism` times the pace so far,
+##     so a run with a late surge can be cut. off unless optimism is set
+## the default bound() is for fitness_function(min_trades)
+class Pruner(object):
+    def __init__(self,every=250,max_dd=None,cutoff=None,total=None,min_trades=1,
+                 min_progress=0.2,optimism=None):
+        self.every = every
+        self.max_dd = max_dd
+        self.cutoff = cutoff
+        self.total = total
+        self.min_trades = min_trades
+        self.min_progress = min_progress
+        ## how fast the rest of the run may make money, as a multiple of the
+        ## biggest move so far (max_equ or max_dd) per bar. None: no cutoff pruning
+        self.optimism = optimism
+
+
+    ## None to carry on, otherwise why the run should stop
+    def check(self,stats,bars):
+        if self.max_dd is not None and math.fabs(stats['max_dd']) > self.max_dd:
+            return 'max_dd'
+        if self.optimism is None or self.cutoff is None or not self.total or bars < self.min_progress * self.total:
+            return None
+        best = self.bound(stats,bars)
+        if best is not None and best < self.cutoff:
+            return 'cutoff'
+        return None
+
+
+    ## estimate of the best fitness_function() score the run can still end with:
+    ## max_dd only grows and (1 - 1/sqrt(cnt)) stays below 1, so it is the
+    ## mtm_pnl the rest of the run makes at `optimism` times its pace so far,
+    ## over today's max_dd (never below 0, a losing curve or too few trades
+    ## score about 0 at worst). None while there is no drawdown to divide by
+    def bound(self,stats,bars):
+        max_dd = math.fabs(stats['max_dd'])
+        if not max_dd or pandas.isnull(max_dd):
+            return None
+        mtm_pnl = stats['mtm_pnl']
+        if pandas.isnull(mtm_pnl): mtm_pnl = 0
+        pace = max(stats['max_equ'],max_dd,0) / float(bars)
+        optimism = 1.0 if self.optimism is None else self.optimism
+        best = mtm_pnl + optimism * pace * max(self.total - bars,0)
+        return max(best,0) / max_dd
+
+    ## what check() stops runs on, for the optimizer dump
+    def describe(self):
+        rules = []
+        if self.max_dd is not None:
+            rules.append('max_dd > %s' % self.max_dd)
+        if self.optimism is not None:
+            rules.append('cutoff heuristic at optimism %s' % self.optimism)
+        return ', '.join(rules) or 'off'
+
+
+
+## one isolated book: strategies with their own exchange and portfolio
+class Lane(object):
+    def __init__(self,lock_free=True,sparse_curves=False,sample_clock=None,shared_volume=False):
+        self.strategies = []
+        self.portfolio = Portfolio('portfolio',None,threaded=not lock_free,
+                                   sparse=sparse_curves,sample_clock=sample_clock)
+        self.exchange = Exchange(threaded=not lock_free)
+        self.exchange.shared_volume = shared_volume
+        self.portfolio.IN_fills = self.exchange.OUT_fills
+        self.latch = None
+        self.stats = None
+        ## bars run, and why a Pruner stopped the lane (None if it didn't)
+        self.bars = 0
+        self.pruned = None
 
-class Simulator(object):
-    def __init__(self):
 
+class Simulator(object):
+    ## lock_free=True: everything runs on this thread via on_data_sim(),
+    ## so use the lock free Sim* queues and latch
+    ##
+    ## batch=True: every add_strategy() gets its own lane (exchange + portfolio),
+    ## all lanes are driven from one pass over the data feed and
+    ## run()/dump() return one stats dict per strategy, as if each ran alone
+    ##
+    ## vector_indicators=True: run() preloads the feed's price series into the
+    ## strategies so IndicatorMap indicators are precomputed with numpy
+    ## (see VectorIndicators), results are unchanged
+    ##
+    ## share_indicators=True: during run() every IndicatorMap draws on an
+    ## IndicatorRegistry of that run's own (self.registry), so strategies/lanes
+    ## asking for the same indicator on a symbol compute it once per bar.
+    ## nothing is shared from one run to the next. defaults to on in batch mode
+    ##
+    ## sparse_curves=True: the portfolio only records the equity curves of
+    ## strategies holding a position, stats() fills in the flat stretches.
+    ## sample_clock ('minute', 'hour', 'day' or a function of the timestamp)
+    ## also thins held positions' marks to the last one of each period
+    ## (see Portfolio). without a sample_clock results are unchanged
+    ##
+    ## shared_volume=True: orders filling on the same tick share its volume
+    ## (see Exchange), off by default
+    ##
+    ## pruner: a Pruner that stops lanes early (see run()), the stats of
+    ## every lane then carry 'status' ('done' or 'pruned:<reason>')
+    ##
+    ## max_bars: run the first max_bars bars of the feed only.
+    ## the stats carry 'bars', the bars each lane ran. a lane stopped
+    ## early (max_bars or pruned) gets the end of data EOD handling
+    def __init__(self,lock_free=True,batch=False,vector_indicators=False,share_indicators=None,
+                 sparse_curves=False,sample_clock=None,shared_volume=False):
+
+        self.lock_free = lock_free
+        self.batch = batch
+        self.sparse_curves = sparse_curves
+        self.sample_clock = sample_clock
+        self.shared_volume = shared_volume
+        self.vector_indicators = vector_indicators
+        if share_indicators is None: share_indicators = batch
+        self.share_indicators = share_indicators
         self.latch = None
         self.strategies = []
-        self.portfolio = Portfolio('portfolio',None)
-        self.exchange = Exchange()
-        self.portfolio.IN_fills = self.exchange.OUT_fills
+        self.lanes = [ Lane(lock_free,sparse_curves,sample_clock,shared_volume) ]
+        self.portfolio = self.lanes[0].portfolio
+        self.exchange = self.lanes[0].exchange
 
         self.stats = None
 
@@ -109,45 +228,112 @@ class Simulator(object):
 
         self.scoring_function = None
 
+        self.pruner = None
+        self.max_bars = None
+
+        ## the IndicatorRegistry of the last run sharing indicators
+        self.registry = None
+
 
     def add_strategy(self,strategy):
         self.strategies.append(strategy)
 
-        strategy.IN_fills = DQueue() 
-        self.portfolio.add(strategy)
-        self.exchange.add(strategy)
+        lane = self.lanes[-1]
+        if self.batch and lane.strategies:
+            lane = Lane(self.lock_free,self.sparse_curves,self.sample_clock,self.shared_volume)
+            self.lanes.append(lane)
+        lane.strategies.append(strategy)
+
+        if self.lock_free:
+            strategy.IN_fills = SimQueue()
+            strategy.IN_data = SimQueue()
+        else:
+            strategy.IN_fills = DQueue() 
+        lane.portfolio.add(strategy)
+        lane.exchange.add(strategy)
+
+
+    def _on_data(self,lane,market_data):
+        lane.latch.trap(market_data)
+        ## ORDER MATTERS! 
+        ## this allows submit-fill loop to happen in a single on_data() event
+        for s in lane.strategies:
+            s.on_data_sim(market_data)
+        lane.exchange.on_data_sim(market_data)
+        lane.portfolio.on_data_sim(market_data)
+
+
+    def _on_EOD(self,lane):
+        ## handle EOD processing
+        lane.portfolio.on_EOD()
+        for s in lane.strategies:
+            s.on_EOD()
+        lane.exchange.on_EOD()
 
 
     def run(self,datafeed):
 
         log.info("reset_on_EOD = %s" % self.reset_on_EOD)
 
-        self.latch = DataLatch(len(self.strategies)+2)
-        self.portfolio.latch = self.latch
-        self.exchange.latch = self.latch
+        latch_class = SimDataLatch if self.lock_free else DataLatch
+        for lane in self.lanes:
+            lane.latch = latch_class(len(lane.strategies)+2)
+            lane.portfolio.latch = lane.latch
+            lane.exchange.latch = lane.latch
+            for s in lane.strategies:
+                s.latch = lane.latch
+        self.latch = self.lanes[0].latch
+
+        if self.vector_indicators:
+            series = VectorIndicators.feed_series(datafeed)
+            if series:
+                for s in self.strategies:
+                    s.preload(series)
+            else:
+                log.info('vector_indicators: no price series from %s' % datafeed.__class__.__name__)
 
-        for s in self.strategies:
-            s.latch = self.latch
+        registry = IndicatorMap.registry
+        if self.share_indicators and registry is None:
+            self.registry = IndicatorRegistry.IndicatorRegistry()
+            IndicatorMap.registry = self.registry
 
         bg = datetime.datetime.now()
         if self.verbose: log.info('Sim Start: %s' % bg)
 
-        for market_data in datafeed:
-            if market_data != DataFeed.SENTINEL:
-                self.latch.trap(market_data)
-                ## ORDER MATTERS! 
-                ## this allows submit-fill loop to happen in a single on_data() event
-                for s in self.strategies:
-                    s.on_data_sim(market_data)
-                self.exchange.on_data_sim(market_data)
-                self.portfolio.on_data_sim(market_data)
-            else:
-                if self.reset_on_EOD:
-                    ## handle EOD processing
-                    self.portfolio.on_EOD()
-                    for s in self.strategies:
-                        s.on_EOD()
-                    self.exchange.on_EOD()
+        ## stats are worked out fresh by dump() at the end of every run
+        self.stats = None
+        lanes = self.lanes
+        for lane in lanes:
+            lane.bars = 0
+            lane.pruned = None
+            lane.stats = None
+        pruner = self.pruner
+        max_bars = self.max_bars
+        bars = 0
+        try:
+            for market_data in datafeed:
+                if market_data != DataFeed.SENTINEL:
+                    for lane in lanes:
+                        self._on_data(lane,market_data)
+                    bars += 1
+                    if pruner is not None and bars % pruner.every == 0:
+                        lanes = self._prune(lanes,bars)
+                        if not lanes: break
+                    if bars == max_bars:
+                        ## stopped short of the data's end: end the day as its SENTINEL would
+                        if self.reset_on_EOD:
+                            for lane in lanes:
+                                self._on_EOD(lane)
+                        break
+                else:
+                    if self.reset_on_EOD:
+                        for lane in lanes:
+                            self._on_EOD(lane)
+        finally:
+            IndicatorMap.registry = registry
+
+        for lane in lanes:
+            lane.bars = bars
 
         nd = datetime.datetime.now()
 
@@ -158,22 +344,54 @@ class Simulator(object):
         return self.dump()
 
 
+    ## checkpoint: the lanes the pruner lets carry on
+    def _prune(self,lanes,bars):
+        active = []
+        for lane in lanes:
+            reason = self.pruner.check(lane.portfolio.live_stats(),bars)
+            if reason is None:
+                active.append(lane)
+                continue
+            lane.bars = bars
+            lane.pruned = reason
+            ## a lane leaving the run ends the day as the data's end would
+            if self.reset_on_EOD:
+                self._on_EOD(lane)
+            if self.verbose: log.info('%s pruned at bar %d: %s' % (lane.strategies[0].name,bars,reason))
+        return active
+
+
+    ## the running portfolio stats, as dump() would report them so far
+    ## (one dict per lane in batch mode), readable from inside a run
+    def live_stats(self):
+        if self.batch:
+            return [ lane.portfolio.live_stats() for lane in self.lanes ]
+        return self.portfolio.live_stats()
+
+
     def dump(self):
 
         if not self.scoring_function:
             self.scoring_function = fitness_function
 
-        if not self.stats:
-            self.stats = self.portfolio.stats()
-
-        self.stats['_score'] = self.scoring_function(self.stats)
-        summary = OrderedDict()
         header = ['_score', 'cnt','w_pct','pr','pnl','mtm_pnl','max_equ','max_dd']
-        for k in header:
-            summary[k] = self.stats[k]
 
-        table = PrettyTable(header)
-        table.add_row(summary.values())
+        if self.batch:
+            table = PrettyTable(['strategy'] + header)
+            for lane in self.lanes:
+                if not lane.stats:
+                    lane.stats = self._lane_stats(lane)
+                lane.stats['_score'] = self.scoring_function(lane.stats)
+                table.add_row([lane.strategies[0].name] + [ lane.stats[k] for k in header ])
+            self.stats = self.lanes[0].stats
+        else:
+            if not self.stats:
+                self.stats = self._lane_stats(self.lanes[0])
+
+            self.stats['_score'] = self.scoring_function(self.stats)
+            table = PrettyTable(header)
+            table.add_row([ self.stats[k] for k in header ])
+
         header.pop(1)  ## remove 'cnt' label
         for k in header:
             table.float_format[k] = '0.2'
@@ -181,10 +399,19 @@ class Simulator(object):
         if self.verbose: log.info('\n%s' % table)
 
         ## return stat summary for potential use elsewhere
-        #return summary
+        if self.batch:
+            return [ lane.stats for lane in self.lanes ]
         return self.stats
 
 
+    def _lane_stats(self,lane):
+        stats = lane.portfolio.stats()
+        stats['bars'] = lane.bars
+        if self.pruner is not None:
+            stats['status'] = 'pruned:%s' % lane.pruned if lane.pruned else 'done'
+        return stats
+
+
     ## show the equity curve
     def show(self):
         if not self.stats:
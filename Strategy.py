@@ -1,11 +1,10 @@
 
 import collections
 from datetime import timedelta
-from MarketObjects import Order, Fill, PriceBook, Position
+from MarketObjects import Order, Fill, PriceBook, Position, OrderCancel, OrderReplace, IndicatorMap
 import logging
 from threading import Thread, Lock
 from DataQueues import DQueue, OutQueue
-import copy
 import pprint
 
 '''
@@ -72,6 +71,7 @@ class StrategyBase(Thread):
         self.start_up = True
 
         self.order_book = {}    ## dict[order_id]
+        self.cancels = set()    ## order_ids with a cancel on its way to the exchange
         self.orders = []
         self.positions = {}
         self.trading_activity = collections.defaultdict(list)
@@ -117,6 +117,56 @@ class StrategyBase(Thread):
         self.orders.append(order)
         self.order_book[order.order_id] = order
 
+    ## pull a resting order: it stays in the order book, and can still
+    ## fill, until the exchange acks the cancel (see cancel_acked())
+    def cancel_order(self,order_id):
+        order = self.order_book.get(order_id)
+        if order is None:
+            self.log.warning("cancel: no open order %s" % order_id)
+            return
+        if order_id in self.cancels:
+            return
+        self.cancels.add(order_id)
+        cancel = OrderCancel(self.name,order.symbol,order_id)
+        cancel.stamp_time(self.current_timestamp)
+        self.orders.append(cancel)
+
+    ## the exchange pulled the order (or it had filled before the cancel got there)
+    def cancel_acked(self,cancel):
+        self.cancels.discard(cancel.order_id)
+        order = self.order_book.pop(cancel.order_id,None)
+        if order is not None:
+            self.log.info("cancelled order %s" % order)
+
+    ## change qty (new total qty) and/or prices of a resting order
+    def replace_order(self,order_id,qty=None,limit_price=None,stop_price=None):
+        order = self.order_book.get(order_id)
+        if order is None:
+            self.log.warning("replace: no open order %s" % order_id)
+            return
+        order = order.copy()
+        if qty is not None:
+            order.qty_left = qty - (order.qty - order.qty_left)
+            order.qty = qty
+        if limit_price is not None: order.limit_price = limit_price
+        if stop_price is not None: order.stop_price = stop_price
+        if order.qty_left <= 0:
+            del self.order_book[order_id]
+        else:
+            self.order_book[order_id] = order
+
+        replace = OrderReplace(self.name,order.symbol,order_id,qty,limit_price,stop_price)
+        replace.stamp_time(self.current_timestamp)
+        self.orders.append(replace)
+
+    ## what the exchange sends back: fills, and cancel acks
+    def receive(self, fill):
+        if isinstance(fill,OrderCancel):
+            self.cancel_acked(fill)
+            return
+        self.update_positions(fill)
+        self.update_orders(fill)
+
     def update_orders(self, fill):
 
         ## update outstanding orders
@@ -126,8 +176,9 @@ class StrategyBase(Thread):
             if self.order_book[fill.order_id].qty_left == 0:
                 self.log.info("rm filled order %s" % self.order_book[fill.order_id])
                 del self.order_book[fill.order_id]
+                self.cancels.discard(fill.order_id)
         else:
-            self.log.error("fill= %s cannot find order_id %d" % (fill,fill.order_id))
+            self.log.error("fill= %s cannot find order_id %s" % (fill,fill.order_id))
 
         ## for logging purposes only
         self.log.info('remaining orders (count=%d)' % len(self.order_book.values()))
@@ -249,15 +300,14 @@ class StrategyBase(Thread):
                     fill = self.IN_fills.peek()
                     if fill.timestamp <= self.current_timestamp:
                         fill = self.IN_fills.get()
-                        self.update_positions(fill)
-                        self.update_orders(fill)
+                        self.receive(fill)
                 except IndexError:
                     pass
 
                 ### send out new orders to the portfolio
                 for order in self.orders:
                     self.log.info("sending: %s" % order)
-                    self.OUT_orders.put(copy.deepcopy(order))
+                    self.OUT_orders.put(order)
                     # FIX NOT NEEDED ? 
                     ##orders.append(order)
                 if self.orders:
@@ -304,12 +354,13 @@ class StrategyBase(Thread):
                     else:
                         self.price_book.update(price_data)
 
-                    price_book = copy.deepcopy(self.price_book)
+                    ## hand off the filled book and start a new one
+                    price_book = self.price_book
+                    self.price_book = PriceBook()
                     self.log.info("bundled: %s to %s" % (price_book.start_timestamp,price_book.last_timestamp))
 
                     self.target_timestamp = self.target_timestamp + timedelta(seconds=interval)
                     self.log.info("next target_timestamp: %s" % self.target_timestamp)
-                    self.price_book.clear()
 
                 self.price_book.update(price_data)
 
@@ -323,14 +374,14 @@ class StrategyBase(Thread):
 
         with self.lock:
 
-            price_book = copy.deepcopy(self.price_book)
+            price_book = self.price_book
+            self.price_book = PriceBook()
             self.target_timestamp = price_book.last_timestamp + timedelta(seconds=self.bar_interval)
             self.log.info("flushed bundle: %s to %s" % (price_book.start_timestamp,price_book.last_timestamp))
             self.log.info("next target_timestamp: %s" % self.target_timestamp)
-            self.price_book.clear()
 
             if not price_book.empty():
-                self.current_data = copy.deepcopy(price_book)
+                self.current_data = price_book
                 self.current_timestamp = price_book.last_timestamp
                 self.execute_on(price_book)
 
@@ -354,8 +405,7 @@ class StrategyBase(Thread):
                 fill = self.IN_fills.peek()
                 if fill.timestamp <= self.current_timestamp:
                     fill = self.IN_fills.get()
-                    self.update_positions(fill)
-                    self.update_orders(fill)
+                    self.receive(fill)
                 else:
                     ## no fills ready to be processed
                     break
@@ -363,7 +413,7 @@ class StrategyBase(Thread):
             new_data = self.pull(interval=self.bar_interval)
             if new_data:
                 self.log.debug('LIVE_BOOK: %s'  % new_data)
-                self.current_data = copy.deepcopy(new_data)
+                self.current_data = new_data
                 self.execute_on(new_data)
 
             self.latch.notify()
@@ -387,8 +437,7 @@ class StrategyBase(Thread):
             fill = self.IN_fills.peek()
             if fill.timestamp <= self.current_timestamp:
                 fill = self.IN_fills.get()
-                self.update_positions(fill)
-                self.update_orders(fill)
+                self.receive(fill)
             else:
                 ## no fills ready to be processed
                 break
@@ -396,13 +445,13 @@ class StrategyBase(Thread):
         new_data = self.pull(interval=self.bar_interval)
         if new_data:
             self.log.debug('SIM_BOOK: %s'  % new_data)
-            self.current_data = copy.deepcopy(new_data)
+            self.current_data = new_data
             self.execute_on(new_data)
 
         ### send out new orders to the EXCHANGE 
         for order in self.orders:
             self.log.info("sending: %s" % order)
-            self.OUT_orders.put(copy.deepcopy(order))
+            self.OUT_orders.put(order)
         if self.orders:
             del self.orders[:]
 
@@ -422,8 +471,7 @@ class StrategyBase(Thread):
                 if fill.timestamp <= self.current_timestamp:
                     fill = self.IN_fills.get()
                     self.log.info('grab EOD fill %s' % fill)
-                    self.update_positions(fill)
-                    self.update_orders(fill)
+                    self.receive(fill)
                 else:
                     ## no fills ready to be processed
                     break
@@ -445,6 +493,16 @@ class StrategyBase(Thread):
         return "\n".join([setup,params])
 
 
+    ## simulation only: the whole price series of the run, up front
+    ## dict(symbol = VectorIndicators.SymbolSeries)
+    ## hands it to every IndicatorMap the strategy holds.
+    ## override to preload anything else
+    def preload(self,series):
+        for value in self.__dict__.values():
+            if isinstance(value,IndicatorMap):
+                value.preload(series)
+
+
     ## override this to implement strategy       
     def execute_on(self,price_book):
         raise NotImplementedError
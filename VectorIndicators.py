@@ -0,0 +1,271 @@
+import bisect
+import logging
+import numpy
+from numpy.lib.stride_tricks import as_strided
+import Indicators
+
+'''
+VectorIndicators precomputes indicators over a whole price series with
+numpy rolling windows, for simulations where every price is known up front.
+
+IndicatorMap.preload(feed_series(datafeed)) swaps the supported
+Indicators classes (SMA, MO, MEDIAN, BOX, HILO, Highest, Lowest) for a
+VectorMetric. push() then only checks the pushed price against the
+preloaded series and advances a cursor; [0], [1], size() serve the
+precomputed values exactly as the Indicators class would have built them.
+
+a push that doesn't match the preloaded series (a strategy pushing a spread,
+fill forward bars, ...) or any use of the Indicators internals (.series,
+.prices, ...) quietly rebuilds the real Indicators object, replays what
+was pushed so far and hands everything over to it.
+'''
+
+log = logging.getLogger('VectorIndicators')
+
+## rows per block when a window has to be copied (MEDIAN)
+CHUNK = 4096
+
+
+## (rows, length) view of every full window of x, oldest value first
+def _windows(x,length):
+    stride = x.strides[0]
+    return as_strided(x,shape=(len(x)-length+1,length),strides=(stride,stride))
+
+
+## the correctly rounded window sum of Indicators.RollingSum has no
+## numpy equivalent, so SMA is precomputed with it directly
+def _sma(x,length):
+    total = Indicators.RollingSum(length)
+    out = []
+    for i, p in enumerate(x.tolist()):
+        total.push(p)
+        if i >= length - 1:
+            out.append(total.value() / (length * 1.0))
+    return out
+
+def _mo(x,length):
+    a = x[length-1:]
+    b = x[:len(x)-length+1]
+    u = a - b
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        r = u / b
+    return [ (du, dr if db != 0 else 0) for du, dr, db in zip(u.tolist(),r.tolist(),b.tolist()) ]
+
+def _median(x,length):
+    w = _windows(x,length)
+    k = int(length/2)
+    out = []
+    for i in xrange(0,len(w),CHUNK):
+        out.extend(numpy.partition(w[i:i+CHUNK],k,axis=1)[:,k].tolist())
+    return out
+
+def _highest(x,length):
+    return _windows(x,length).max(axis=1).tolist()
+
+def _lowest(x,length):
+    return _windows(x,length).min(axis=1).tolist()
+
+def _box(x,length):
+    w = _windows(x,length)
+    hi = w.max(axis=1)
+    lo = w.min(axis=1)
+    rng = hi - lo
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        pct = (x[length-1:] - lo) / rng
+    return [ (p if r != 0 else 0.50, h, l) for p, h, l, r in zip(pct.tolist(),hi.tolist(),lo.tolist(),rng.tolist()) ]
+
+def _hilo(high,low,length):
+    return zip(_highest(high,length),_lowest(low,length))
+
+
+## class_name = (precompute function, default input fields)
+VECTOR = dict(  SMA=(_sma,('close',)),
+                MO=(_mo,('close',)),
+                MEDIAN=(_median,('close',)),
+                Highest=(_highest,('close',)),
+                Lowest=(_lowest,('close',)),
+                BOX=(_box,('close',)),
+                HILO=(_hilo,('high','low')) )
+
+
+## can class_name(**kwargs) be precomputed from the input fields of series
+def supports(class_name,kwargs,series,inputs=None):
+    if class_name not in VECTOR or kwargs.keys() != ['length']:
+        return False
+    length = kwargs['length']
+    if not isinstance(length,(int,long)) or length < 1:
+        return False
+    return all(f in series.columns for f in inputs or VECTOR[class_name][1])
+
+
+## the preloaded input columns of one symbol, in the order the feed plays them
+class SymbolSeries(object):
+    def __init__(self,columns,ends):
+        ## dict(field = float64 array)
+        self.columns = columns
+        ## row count at the end of each data file, so a reset_on_EOD run
+        ## only precomputes up to the end of the current file
+        self.ends = ends
+        self.lists = {}
+
+    def values(self,field):
+        try:
+            return self.lists[field]
+        except KeyError:
+            self.lists[field] = self.columns[field].tolist()
+            return self.lists[field]
+
+
+## dict(symbol = SymbolSeries) of the price columns a data feed will play
+## returns None for feeds that can't hand over their data up front
+def feed_series(datafeed):
+
+    if hasattr(datafeed,'master_list'):
+        ## DataFeedList
+        arrays = [ datafeed.load_array(f) for f in datafeed.master_list[::-1] ]
+    elif hasattr(datafeed,'array'):
+        ## DataFeedArray
+        arrays = [ datafeed.array ]
+    elif hasattr(datafeed,'data_feed'):
+        ## DataFeedPrefetch
+        return feed_series(datafeed.data_feed)
+    elif hasattr(datafeed,'load_array'):
+        arrays = [ datafeed.load_array() ]
+    else:
+        return None
+
+    pieces = {}
+    for bar_array in arrays:
+        for code, symbol in enumerate(bar_array.symbols):
+            rows = numpy.flatnonzero(bar_array.symbol == code)
+            columns, ends = pieces.setdefault(symbol,({},[]))
+            for field, col in bar_array.columns.iteritems():
+                columns.setdefault(field,[]).append(col[rows])
+            ends.append((ends[-1] if ends else 0) + len(rows))
+
+    series = {}
+    for symbol, (columns, ends) in pieces.iteritems():
+        columns = dict([ (f, numpy.concatenate(c)) for f, c in columns.iteritems() if len(c) == len(ends) ])
+        series[symbol] = SymbolSeries(columns,ends)
+    return series
+
+
+## stands in for an Indicators Metric over a preloaded SymbolSeries
+class VectorMetric(object):
+
+    def __init__(self,class_name,kwargs,series,positions,symbol,inputs=None):
+        self.class_name = class_name
+        self.kwargs = kwargs
+        self.length = kwargs['length']
+        self.func, default_inputs = VECTOR[class_name]
+        self.inputs = inputs or default_inputs
+        self.arrays = [ series.columns[f] for f in self.inputs ]
+        self.values = [ series.values(f) for f in self.inputs ]
+        self.ends = series.ends
+
+        ## positions = dict(symbol = rows consumed), shared by the IndicatorMap
+        ## so indicators rebuilt after a reset() pick up where the last ones stopped
+        self.positions = positions
+        self.symbol = symbol
+        self.start = self.pos = self.stop = positions.get(symbol,0)
+
+        self.hlimit = 50
+        self.out = []
+        ## outputs made since start / outputs dropped off the back (hlimit)
+        self.count = 0
+        self.low = 0
+        self.live = None
+
+    def __getitem__(self,index):
+        if self.live is not None:
+            return self.live[index]
+        if index >= 0 and index < self.count - self.low:
+            return self.out[self.count-1-index]
+        return None
+
+    def __nonzero__(self):
+        return True
+
+    def size(self):
+        if self.live is not None:
+            return self.live.size()
+        return self.count - self.low
+
+    def reset(self):
+        if self.live is not None:
+            return self.live.reset()
+        self.start = self.stop = self.pos
+        self.out = []
+        self.count = self.low = 0
+
+    def push(self,price):
+        if self.live is not None:
+            return self.live.push(price)
+
+        pos = self.pos
+        if not self._matches(price,pos):
+            self._go_live()
+            return self.live.push(price)
+
+        self.pos = pos = pos + 1
+        if self.positions.get(self.symbol,0) < pos:
+            self.positions[self.symbol] = pos
+
+        if pos - self.start >= self.length:
+            if pos > self.stop:
+                self._compute()
+            ## Metric._pop() drops one value per push
+            self.count += 1
+            if self.count - self.low > self.hlimit:
+                self.low += 1
+
+    def feed(self,series2):
+        tmp = list(series2)
+        tmp.reverse()
+        for i in tmp: self.push(i)
+
+    def sethistory(self,limit):
+        assert limit > 1
+        if self.live is not None:
+            return self.live.sethistory(limit)
+        self.hlimit = limit
+
+    def _matches(self,price,pos):
+        if pos >= len(self.values[0]):
+            return False
+        if len(self.values) == 1:
+            return price == self.values[0][pos]
+        ## HILO pricevector: [1] = high, [2] = low
+        try:
+            return price[1] == self.values[0][pos] and price[2] == self.values[1][pos]
+        except (TypeError, IndexError):
+            return False
+
+    def _pushed(self,pos):
+        if len(self.values) == 1:
+            return self.values[0][pos]
+        return (None,self.values[0][pos],self.values[1][pos],None)
+
+    ## precompute from start to the end of the data file holding pos
+    def _compute(self):
+        i = bisect.bisect_left(self.ends,self.pos)
+        self.stop = self.ends[i] if i < len(self.ends) else len(self.values[0])
+        inputs = [ x[self.start:self.stop] for x in self.arrays ]
+        self.out = self.func(*(inputs + [self.length]))
+
+    ## build the real indicator and replay everything pushed since start
+    def _go_live(self):
+        log.debug('%s %s: leaving preloaded series at row %d' % (self.symbol,self.class_name,self.pos))
+        live = getattr(Indicators,self.class_name)(**self.kwargs)
+        live.hlimit = self.hlimit
+        for pos in xrange(self.start,self.pos):
+            live.push(self._pushed(pos))
+        self.live = live
+
+    ## anything else is Indicators internals: go live and delegate
+    def __getattr__(self,name):
+        if name.startswith('__') or 'live' not in self.__dict__:
+            raise AttributeError(name)
+        if self.live is None:
+            self._go_live()
+        return getattr(self.live,name)
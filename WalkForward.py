@@ -0,0 +1,334 @@
+import random
+import cPickle
+import logging
+import multiprocessing
+import numpy
+import pandas
+from prettytable import PrettyTable
+from Simulator import Simulator
+from DataFeed import BarArray, from_micros
+from FitnessCache import FitnessCache
+
+'''
+WalkForward runs an Optimizer over rolling in-sample windows of a data feed
+and replays the best parameters of each window on the out-of-sample window
+that follows it, then stitches the out-of-sample equity curves together.
+
+the feed is loaded once into a single BarArray (DataFeedList.bar_array());
+each window is served as a DataFeedArray over a slice of it - views into
+the same columns, no files re-read or copied.
+windows are optimized (and replayed) in parallel, one window per worker
+process; the optimizer inside a window runs in its worker alone.
+
+Example:
+    >> optimizer = Optimizer()
+    >> optimizer.strategy_class = RetraceStrategy
+    >> optimizer.size = 40
+    >> optimizer.max_generations = 20
+    >> for p in param_list: optimizer.add_parameter(p)
+
+    >> w = WalkForward(optimizer,DataFeedList(['SPY.csv'],data_type='D'))
+    >> w.in_sample = pandas.DateOffset(years=3)
+    >> w.out_sample = pandas.DateOffset(years=1)
+    >> w.run()
+    >> w.results        ## one row per window: dates, best params, in and out-of-sample stats
+    >> w.curve          ## the stitched out-of-sample equity curve
+    >> w.stats          ## curve stats of it
+
+every window is a feed of its own: with reset_on_EOD positions are
+flattened at the end of each window. the out-of-sample replay starts
+warmup bars before the window (default: the whole in-sample window) so
+indicators are warm on its first bar; only what happens from that bar on
+counts - the curve is taken from there, relative to where it stood, and
+the trade stats are of the trades closed from there.
+'''
+
+log = logging.getLogger('Optimizer')
+
+## the out-of-sample stats listed in results, the rest stay in stats_map
+OOS_COLUMNS = ['cnt','pnl','w_pct','mtm_pnl','max_equ','max_dd']
+
+
+## pool workers: the loaded bars and the pickled optimizer
+## are handed over once when the worker starts
+_worker = {}
+
+def _init_worker(bar_array,optimizer):
+    _worker.update(bar_array=bar_array,optimizer=optimizer)
+
+
+## optimize one in-sample window and replay its winner out-of-sample
+## window = (index, (start, stop) in-sample rows, (start, stop) out-of-sample rows,
+##           replay start row, seed)
+def _run_window(window):
+    index, in_rows, out_rows, warm_start, seed = window
+    bar_array = _worker['bar_array']
+
+    ## a fresh optimizer per window
+    optimizer = cPickle.loads(_worker['optimizer'])
+    cache_file = getattr(optimizer,'_cache_file',None)
+    if cache_file:
+        optimizer.fitness_cache = FitnessCache(cache_file)
+    optimizer.workers = 1
+    root = optimizer.outfile or optimizer.strategy_class.__name__
+    root = '.'.join(root.split('.')[:-1]) or root
+    optimizer.outfile = '%s_wf%02d' % (root,index)
+    optimizer.data_feed = bar_array.slice(*in_rows).feed()
+
+    random.seed(seed)
+    optimizer.run()
+
+    score, bitcode = optimizer.population[0]
+    in_stats = optimizer.results_map[bitcode][0]
+    params = optimizer.factory.decode(bitcode)
+
+    s = Simulator()
+    s.verbose = False
+    s.reset_on_EOD = optimizer.reset_on_EOD
+    name = '%s_wf%02d' % (optimizer.strategy_class.__name__,index)
+    s.add_strategy(optimizer.strategy_class(name,strategy_setup=optimizer.strategy_setup,strategy_params=params))
+    s.run(bar_array.slice(warm_start,out_rows[1]).feed())
+    begin = from_micros(bar_array.timestamp[out_rows[0]])
+    out_stats, curve = _out_of_sample(s,begin)
+
+    return index, params, score, in_stats, out_stats, curve
+
+
+## the stats and curve of a replay from the first out-of-sample bar (begin) on:
+## the curve relative to the last warm-up row, the trades closed from begin
+def _out_of_sample(s,begin):
+    portfolio = s.portfolio
+    tag = portfolio.portfolio_name
+    curve = portfolio.storage['curve'][tag]
+    curve = curve[['timestamp','realized_pnl','mtm_pnl']]
+    warm = curve[curve['timestamp'] < begin]
+    curve = curve[curve['timestamp'] >= begin].reset_index(drop=True)
+    if len(warm):
+        curve['realized_pnl'] -= warm['realized_pnl'].iloc[-1]
+        curve['mtm_pnl'] -= warm['mtm_pnl'].iloc[-1]
+
+    pnl = []
+    for (strat, sym), trades in sorted(portfolio.storage['trades'].items()):
+        if strat == tag:
+            trades = trades[trades['timestamp'] >= begin]
+            pnl.append(trades['pnl'].astype(numpy.float64).values)
+    pnl = numpy.concatenate(pnl) if pnl else numpy.empty(0)
+
+    stats = portfolio.win_loss_stats(tag,pnl)
+    stats.update(portfolio.equ_curve_stats(tag,curve['mtm_pnl'].values.astype(numpy.float64)))
+    stats['_score'] = s.scoring_function(stats)
+    return stats, curve
+
+
+class WalkForward(object):
+
+    def __init__(self,optimizer=None,data_feed=None):
+
+        ## an Optimizer (or SuccessiveHalving) set up with strategy_class,
+        ## parameters and run settings, run afresh on every window
+        self.optimizer = optimizer
+        ## a DataFeedList, or any feed BarArray.from_feed() can load
+        self.data_feed = data_feed
+
+        ## window lengths: anything a datetime adds, timedelta or pandas.DateOffset
+        self.in_sample = None
+        self.out_sample = None
+        ## shift from one window to the next, default out_sample (back to back
+        ## out-of-sample windows)
+        self.step = None
+        ## first in-sample date, default the first bar
+        self.start = None
+        ## or explicit [(in_begin, in_end, out_end)] date triples,
+        ## in-sample [in_begin,in_end), out-of-sample [in_end,out_end)
+        self.windows = None
+
+        ## windows optimized at once, one process each
+        self.workers = multiprocessing.cpu_count()
+        ## random seed of window k is seed + k, so runs repeat whatever the
+        ## workers. None seeds every window from the system
+        self.seed = None
+        ## bars the out-of-sample replay starts before the window, for the
+        ## indicators to warm up on. None: from the start of the in-sample window
+        self.warmup = None
+
+        self.bar_array = None
+
+        ## outputs
+        self.results = None
+        self.curve = None
+        self.stats = None
+        ## dict[window] = (in-sample stats, out-of-sample stats)
+        self.stats_map = {}
+
+
+    ## the feed's bars, loaded once
+    def load(self):
+        if self.bar_array is None:
+            feed = self.data_feed
+            if hasattr(feed,'bar_array'):
+                bar_array = feed.bar_array()
+            elif hasattr(feed,'array'):
+                bar_array = feed.array
+            else:
+                feed.reset()
+                bar_array = BarArray.from_feed(iter(feed))
+            if len(bar_array) and (numpy.diff(bar_array.timestamp) < 0).any():
+                raise ValueError('WalkForward: the bars of %s are not in timestamp order' % feed.__class__.__name__)
+            self.bar_array = bar_array
+        return self.bar_array
+
+
+    ## [(in_begin, in_end, out_end)] of the windows
+    def dates(self):
+        if self.windows is not None:
+            return list(self.windows)
+
+        if self.in_sample is None or self.out_sample is None:
+            raise ValueError('WalkForward: set in_sample and out_sample (or windows)')
+
+        bar_array = self.load()
+        if not len(bar_array):
+            return []
+        first = from_micros(bar_array.timestamp[0])
+        last = from_micros(bar_array.timestamp[-1])
+        step = self.step or self.out_sample
+
+        out = []
+        begin = _datetime(self.start or first)
+        while True:
+            in_end = _datetime(begin + self.in_sample)
+            out_end = _datetime(in_end + self.out_sample)
+            if in_end > last:
+                break
+            out.append((begin,in_end,out_end))
+            begin = _datetime(begin + step)
+        return out
+
+
+    def run(self):
+
+        bar_array = self.load()
+        optimizer = self.optimizer
+
+        tasks = []
+        dates = {}
+        for k, (in_begin, in_end, out_end) in enumerate(self.dates()):
+            in_rows = bar_array.between(in_begin,in_end)
+            out_rows = bar_array.between(in_end,out_end)
+            if in_rows[0] == in_rows[1] or out_rows[0] == out_rows[1]:
+                log.info('walk forward window %d: no bars, skipped' % k)
+                continue
+            seed = None if self.seed is None else self.seed + k
+            warm_start = in_rows[0]
+            if self.warmup is not None:
+                warm_start = max(out_rows[0] - self.warmup,0)
+            tasks.append((k,in_rows,out_rows,warm_start,seed))
+            dates[k] = (in_begin,in_end,out_end,in_rows[1] - in_rows[0],out_rows[1] - out_rows[0])
+
+        ## the optimizer goes to the windows pickled, without its feed
+        ## and cache connection (each window reopens the cache file)
+        feed, cache = optimizer.data_feed, optimizer.fitness_cache
+        try:
+            optimizer.data_feed = None
+            optimizer.fitness_cache = None
+            if cache is not None:
+                optimizer._cache_file = cache.filename
+            blob = cPickle.dumps(optimizer,cPickle.HIGHEST_PROTOCOL)
+        finally:
+            optimizer.data_feed, optimizer.fitness_cache = feed, cache
+            optimizer.__dict__.pop('_cache_file',None)
+
+        outputs = []
+        if self.workers <= 1 or len(tasks) <= 1:
+            _init_worker(bar_array,blob)
+            try:
+                outputs = [ _run_window(task) for task in tasks ]
+            finally:
+                _worker.clear()
+        else:
+            pool = multiprocessing.Pool(min(self.workers,len(tasks)),_init_worker,(bar_array,blob))
+            try:
+                outputs = pool.map(_run_window,tasks,chunksize=1)
+            finally:
+                pool.terminate()
+                pool.join()
+
+        self._stitch(sorted(outputs),dates)
+        self.dump()
+        return self.stats
+
+
+    ## the results table, and the out-of-sample curves end to end:
+    ## each one carried on from where the last one finished
+    def _stitch(self,outputs,dates):
+        rows = []
+        curves = []
+        offset = 0
+        self.stats_map = {}
+        for index, params, score, in_stats, out_stats, curve in outputs:
+            in_begin, in_end, out_end, in_bars, out_bars = dates[index]
+            self.stats_map[index] = (in_stats,out_stats)
+
+            row = dict(window=index,in_begin=in_begin,in_end=in_end,out_end=out_end,
+                       in_bars=in_bars,out_bars=out_bars,in_score=score,
+                       in_mtm_pnl=in_stats['mtm_pnl'],out_score=out_stats['_score'])
+            for k in OOS_COLUMNS:
+                row['out_%s' % k] = out_stats[k]
+            row.update(params)
+            rows.append(row)
+
+            curve = curve.copy()
+            curve['window'] = index
+            curve['realized_pnl'] += offset
+            curve['mtm_pnl'] += offset
+            curves.append(curve)
+            if len(curve):
+                offset = curve['mtm_pnl'].iloc[-1]
+
+        header = ['window','in_begin','in_end','out_end','in_bars','out_bars','in_score','in_mtm_pnl',
+                  'out_score'] + [ 'out_%s' % k for k in OOS_COLUMNS ]
+        params = sorted(set([ k for row in rows for k in row ]) - set(header))
+        self.results = pandas.DataFrame(rows,columns=header + params)
+
+        columns = ['timestamp','window','realized_pnl','mtm_pnl']
+        if curves:
+            self.curve = pandas.concat(curves,ignore_index=True)[columns]
+        else:
+            self.curve = pandas.DataFrame(columns=columns)
+
+        self.stats = self.curve_stats(self.curve['mtm_pnl'].values.astype(numpy.float64))
+        self.stats['cnt'] = sum([ out['cnt'] for inside, out in self.stats_map.values() ])
+        self.stats['windows'] = len(rows)
+
+
+    ## Portfolio.equ_curve_stats() of the stitched curve
+    def curve_stats(self,mtm):
+        if not len(mtm):
+            return dict(tag='walk_forward',mtm_pnl=0,max_equ=0,max_dd=0,avg_dd=0)
+        top = numpy.maximum.accumulate(mtm)
+        ddwn = top - mtm
+        ddwns = ddwn[ddwn > 0]
+        max_dd = avg_dd = numpy.nan
+        if len(ddwns) > 0:
+            max_dd, avg_dd = ddwns.max(), ddwns.mean()
+        return dict(tag='walk_forward',mtm_pnl=mtm[-1],max_equ=mtm.max(),max_dd=max_dd,avg_dd=avg_dd)
+
+
+    def dump(self):
+        if self.optimizer is not None and not self.optimizer.display_dump:
+            return
+        header = ['window','in_end','out_end','in_score','out_score','out_cnt','out_mtm_pnl','out_max_dd']
+        table = PrettyTable(header)
+        for row in self.results[header].itertuples(index=False):
+            table.add_row(list(row))
+        for k in ['in_score','out_score','out_mtm_pnl','out_max_dd']:
+            table.float_format[k] = '0.2'
+        log.info('\n%s\nwalk forward: mtm_pnl = %.2f, max_dd = %.2f, trades = %d' %
+                 (table,self.stats['mtm_pnl'],self.stats['max_dd'],self.stats['cnt']))
+
+
+## pandas offsets add up to Timestamps
+def _datetime(value):
+    if isinstance(value,pandas.Timestamp):
+        return value.to_pydatetime()
+    return value
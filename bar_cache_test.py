@@ -0,0 +1,110 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import numpy
+from DataFeed import DataFeedDaily, DataFeedList, DataFeedArray, BarCache
+from test_helpers import bars, write_daily, row, run_tests
+
+'''
+checks that BarCache converts a file once, serves the memory mapped
+columns on later loads, and converts again once the file changes
+'''
+
+logging.getLogger('DataFeed').setLevel(logging.CRITICAL)
+
+
+## DataFeedDaily that counts the files it is opened on
+class CountingFeed(DataFeedDaily):
+    opened = 0
+
+    def __init__(self,filename):
+        CountingFeed.opened += 1
+        DataFeedDaily.__init__(self,filename)
+
+
+def text_rows(filename):
+    feed = DataFeedDaily(filename)
+    out = [ row(m) for m in feed ]
+    feed.close()
+    return out
+
+
+def test_hit():
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'SPY.csv')
+        write_daily(filename, bars(100))
+        cache = BarCache(os.path.join(tmp, 'cache'))
+
+        CountingFeed.opened = 0
+        first = cache.load(filename, CountingFeed)
+        path = cache.path(filename, CountingFeed)
+        assert os.path.isdir(path) and CountingFeed.opened == 1
+
+        ## served from the cache: nothing parsed, the columns memory mapped
+        second = cache.load(filename, CountingFeed)
+        assert CountingFeed.opened == 1
+        assert isinstance(second.columns['close'], numpy.memmap)
+        assert (second.timestamp == first.timestamp).all() and second.symbols == first.symbols
+        assert [ row(m) for m in DataFeedArray(second) ] == text_rows(filename)
+
+        ## no build left behind next to the entry
+        assert os.listdir(os.path.dirname(path)) == [ os.path.basename(path) ]
+
+        ## the entry is per feed class, the default lives next to the file
+        assert cache.path(filename, DataFeedDaily) != path
+        assert BarCache().path(filename, CountingFeed).startswith(os.path.join(tmp, '.bar_cache'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_invalidation():
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'SPY.csv')
+        write_daily(filename, bars(100))
+        cache = BarCache(os.path.join(tmp, 'cache'))
+        CountingFeed.opened = 0
+        cache.load(filename, CountingFeed)
+        old = cache.path(filename, CountingFeed)
+
+        ## the file rewritten: a new entry, converted again
+        write_daily(filename, bars(120, seed=3))
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 10))
+        assert cache.path(filename, CountingFeed) != old
+        fresh = cache.load(filename, CountingFeed)
+        assert CountingFeed.opened == 2 and len(fresh) == 120
+        assert [ row(m) for m in DataFeedArray(fresh) ] == text_rows(filename)
+
+        ## same size, only touched: still converted again
+        os.utime(filename, (st.st_atime, st.st_mtime + 20))
+        cache.load(filename, CountingFeed)
+        assert CountingFeed.opened == 3
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_feed_list():
+    ## a cached DataFeedList plays what the text files play, pass after pass
+    tmp = tempfile.mkdtemp()
+    try:
+        files = [ os.path.join(tmp, name) for name in ['a.csv', 'b.csv'] ]
+        data = bars(150)
+        write_daily(files[0], data[:80])
+        write_daily(files[1], data[80:])
+        text = [ row(m) for m in DataFeedList(files, data_type='D') ]
+        cached = DataFeedList(files, data_type='D', cache=True, cache_dir=os.path.join(tmp, 'cache'))
+        assert [ row(m) for m in cached ] == text
+        cached.reset()
+        assert [ row(m) for m in cached ] == text
+        assert len(os.listdir(os.path.join(tmp, 'cache'))) == 2
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_hit, test_invalidation, test_feed_list ])
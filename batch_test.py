@@ -0,0 +1,54 @@
+import logging
+import Simulator as S
+from Simulator import Simulator
+from RetraceStrategy import RetraceStrategy
+from test_helpers import bars, ListFeed, run_tests
+
+'''
+checks that Simulator(batch=True) gives each strategy the stats it
+gets run on its own
+'''
+
+S.log.setLevel(logging.CRITICAL)
+
+PARAMS = [ dict(average=20,momentum=5,duration=10), dict(average=50,momentum=10,duration=5),
+           dict(average=10,momentum=3,duration=20), dict(average=20,momentum=5,duration=10) ]
+
+
+def simulator(params, batch=False, reset_on_EOD=True):
+    s = Simulator(batch=batch)
+    s.verbose = False
+    s.reset_on_EOD = reset_on_EOD
+    for i, p in enumerate(params):
+        s.add_strategy(RetraceStrategy('R%d' % i,strategy_params=p))
+    return s
+
+
+def test_batch_is_solo():
+    data = bars(1500)
+    for reset_on_EOD in (True, False):
+        solo = [ simulator([p], reset_on_EOD=reset_on_EOD).run(ListFeed(data)) for p in PARAMS ]
+        out = simulator(PARAMS, batch=True, reset_on_EOD=reset_on_EOD).run(ListFeed(data))
+        assert len(out) == len(PARAMS)
+        assert out == solo
+        ## the same parameters twice: the same stats, not the same dict
+        assert out[0] == out[3] and out[0] is not out[3]
+
+
+def test_stats_per_run():
+    ## stats dump()ed before the run are not what the run returns
+    data = bars(600)
+    solo = [ simulator([p]).run(ListFeed(data)) for p in PARAMS[:2] ]
+    s = simulator(PARAMS[:2], batch=True)
+    assert [ st['cnt'] for st in s.dump() ] == [0, 0]
+    assert s.run(ListFeed(data)) == solo
+    assert s.stats == solo[0]
+
+    s = simulator(PARAMS[:1])
+    assert s.dump()['cnt'] == 0
+    assert s.run(ListFeed(data)) == solo[0]
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_batch_is_solo, test_stats_per_run ])
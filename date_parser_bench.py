@@ -0,0 +1,67 @@
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from DataFeed import DataFeed_QuantQuote1m, DataFeed
+from MarketObjects import DateTimeParser, parse_date_time
+
+'''
+benchmark of the sniffed fixed offset date/time parser against the
+generic parse_date_time() path on a synthetic QuantQuote 1m bar file.
+reports rows/second for the raw parse and for a full DataFeed pass.
+'''
+
+def write_1m_file(filename, days=50):
+    ## 390 one minute bars per day, QuantQuote layout (no header)
+    random.seed(11)
+    p = 100.0
+    day = datetime(2010,1,4)
+    with open(filename,'w') as f:
+        for d in range(days):
+            ds = (day + timedelta(days=d)).strftime('%Y%m%d')
+            for m in range(390):
+                t = (570 + m) // 60 * 100 + (570 + m) % 60
+                o = p
+                p = max(1.0, p + random.gauss(0,0.1))
+                f.write('%s,%d,%.2f,%.2f,%.2f,%.2f,%d,1,0,0\n' % (ds,t,o,max(o,p),min(o,p),p,random.randint(100,5000)))
+    return days * 390
+
+
+def parse_rate(rows, parse):
+    bg = time.time()
+    for d, t in rows:
+        parse(d, t)
+    return len(rows)/(time.time() - bg)
+
+
+def feed_rate(filename, sniff):
+    feed = DataFeed_QuantQuote1m(filename)
+    feed.date_parser = DateTimeParser(sniff=sniff)
+    count = 0
+    bg = time.time()
+    while feed.next() is not DataFeed.SENTINEL:
+        count += 1
+    feed.close()
+    return count/(time.time() - bg)
+
+
+if __name__ == '__main__':
+
+    filename = os.path.join(tempfile.mkdtemp(),'SPY.csv')
+    count = write_1m_file(filename)
+    with open(filename) as f:
+        rows = [ tuple(x.split(',')[:2]) for x in f ]
+
+    generic = parse_rate(rows, parse_date_time)
+    sniffed = parse_rate(rows, DateTimeParser().parse_date_time)
+    print 'rows = %d' % count
+    print 'parse_date_time  generic: %10.0f rows/s' % generic
+    print 'parse_date_time  sniffed: %10.0f rows/s  (x%.1f)' % (sniffed, sniffed/generic)
+
+    generic = feed_rate(filename, False)
+    sniffed = feed_rate(filename, True)
+    print 'DataFeed_QuantQuote1m generic: %10.0f rows/s' % generic
+    print 'DataFeed_QuantQuote1m sniffed: %10.0f rows/s  (x%.1f)' % (sniffed, sniffed/generic)
+
+    os.remove(filename)
@@ -0,0 +1,353 @@
+import random
+import logging
+from datetime import datetime, timedelta
+from DataQueues import SimQueue, SimDataLatch, OutQueue
+from Exchange import Exchange, OrderBook
+from Strategy import StrategyBase
+from MarketObjects import Order, PriceData, OrderCancel, OrderReplace
+from test_helpers import run_tests
+
+'''
+matching engine checks for Exchange:
+limit / stop / stop limit / MOO / MOC fills on OHLC bars,
+partial fills against bar volume, cancel and replace,
+and the OrderBook's time priority against a scan of the orders in time order
+'''
+
+class Owner(object):
+    def __init__(self,name):
+        self.name = name
+        self.OUT_orders = OutQueue()
+        self.IN_fills = SimQueue()
+
+
+def setup():
+    exchange = Exchange(threaded=False)
+    owner = Owner('T')
+    exchange.add(owner)
+    exchange.latch = SimDataLatch(1)
+    return exchange, owner
+
+
+def bar(ts, o, h, l, c, v=None, symbol='SPY'):
+    m = PriceData()
+    m.timestamp = ts
+    m.symbol = symbol
+    m.open, m.high, m.low, m.close = o, h, l, c
+    m.trade_volume = v
+    return m
+
+
+def send(owner, order, ts):
+    order.stamp_time(ts)
+    owner.OUT_orders.put(order)
+    return order
+
+
+def tick(exchange, owner, m):
+    exchange.on_data_sim(m)
+    fills = []
+    while owner.IN_fills:
+        fills.append(owner.IN_fills.get())
+    return fills
+
+
+T0 = datetime(2010,1,4,9,30)
+ONE = timedelta(minutes=1)
+
+def test_limit():
+    x, s = setup()
+    buy = send(s, Order('T','SPY',Order.BUY,100,Order.LIMIT,99.0), T0)
+    sell = send(s, Order('T','SPY',Order.SELL,100,Order.LIMIT,103.0), T0)
+    ## not live on the tick it was sent on
+    assert tick(x, s, bar(T0,98,99,97,98)) == []
+    ## not crossed
+    assert tick(x, s, bar(T0+ONE,100,101,99.5,100)) == []
+    ## buy limit touched: fills at the limit
+    f = tick(x, s, bar(T0+2*ONE,100,101,98.5,100))
+    assert [ (y.order_id, y.price, y.qty) for y in f ] == [ (buy.order_id, 99.0, 100) ]
+    ## sell limit gapped through: fills at the better open
+    f = tick(x, s, bar(T0+3*ONE,104,105,103.5,104))
+    assert [ (y.order_id, y.price) for y in f ] == [ (sell.order_id, 104) ]
+    assert not x.order_book
+
+
+def test_stop():
+    x, s = setup()
+    buy = send(s, Order('T','SPY',Order.BUY,100,Order.STOP,None,stop_price=101.0), T0)
+    sell = send(s, Order('T','SPY',Order.SELL,100,Order.STOP,None,stop_price=97.0), T0)
+    assert tick(x, s, bar(T0,100,100,100,100)) == []
+    f = tick(x, s, bar(T0+ONE,100,101.5,99,101))
+    assert [ (y.order_id, y.price) for y in f ] == [ (buy.order_id, 101.0) ]
+    ## gap down through the stop: fills at the open
+    f = tick(x, s, bar(T0+2*ONE,95,96,94,95))
+    assert [ (y.order_id, y.price) for y in f ] == [ (sell.order_id, 95) ]
+
+
+def test_stop_limit():
+    x, s = setup()
+    o = send(s, Order('T','SPY',Order.BUY,100,Order.STOP_LIMIT,101.5,stop_price=101.0), T0)
+    assert tick(x, s, bar(T0,100,100,100,100)) == []
+    ## gaps over the limit: triggered but not filled
+    assert tick(x, s, bar(T0+ONE,102,103,102,102.5)) == []
+    assert o.order_id in x.order_book['SPY'].triggered
+    ## now rests as a 101.5 limit
+    f = tick(x, s, bar(T0+2*ONE,102,102,101.2,101.4))
+    assert [ (y.order_id, y.price) for y in f ] == [ (o.order_id, 101.5) ]
+
+
+def test_moo_moc():
+    x, s = setup()
+    moo = send(s, Order('T','SPY',Order.BUY,100,Order.MOO,None), T0)
+    moc = send(s, Order('T','SPY',Order.SELL,100,Order.MOC,None), T0)
+    assert tick(x, s, bar(T0,100,100,100,100)) == []
+    assert tick(x, s, bar(T0+ONE,100,101,99,100.5)) == []
+    ## next day: MOC at the prior close, MOO at the open
+    nd = T0 + timedelta(days=1)
+    f = tick(x, s, bar(nd,102,103,101,102))
+    got = dict([ (y.order_id, (y.price, y.timestamp)) for y in f ])
+    assert got == { moo.order_id: (102, nd), moc.order_id: (100.5, T0+ONE) }
+
+
+def test_moc_daily():
+    ## daily bars: a MOC sent on a bar fills at that bar's close,
+    ## though the symbol had no book when the bar came in
+    x, s = setup()
+    days = [ T0 + timedelta(days=i) for i in range(4) ]
+    assert tick(x, s, bar(days[0],100,101,99,100.5)) == []
+    moc = send(s, Order('T','SPY',Order.SELL,100,Order.MOC,None), days[0])
+    f = tick(x, s, bar(days[1],102,103,101,102.5))
+    assert [ (y.order_id, y.price, y.timestamp) for y in f ] == [ (moc.order_id, 100.5, days[0]) ]
+    assert not x.order_book
+
+    ## again once the emptied book was deleted, with another symbol in between
+    moc = send(s, Order('T','SPY',Order.BUY,100,Order.MOC,None), days[1])
+    assert tick(x, s, bar(days[1],50,51,49,50.5,symbol='QQQ')) == []
+    f = tick(x, s, bar(days[2],103,104,102,103.5))
+    assert [ (y.order_id, y.price, y.timestamp) for y in f ] == [ (moc.order_id, 102.5, days[1]) ]
+
+    ## no SPY bar on the order's day: the close of the next one
+    moc = send(s, Order('T','SPY',Order.SELL,100,Order.MOC,None), days[3])
+    assert tick(x, s, bar(days[3],51,52,50,51.5,symbol='QQQ')) == []
+    assert tick(x, s, bar(days[3] + timedelta(days=1),104,105,103,104.5)) == []
+    f = tick(x, s, bar(days[3] + timedelta(days=2),105,106,104,105.5))
+    assert [ (y.order_id, y.price) for y in f ] == [ (moc.order_id, 104.5) ]
+
+
+def test_partial_fills():
+    x, s = setup()
+    x.shared_volume = True
+    a = send(s, Order('T','SPY',Order.BUY,300,Order.MARKET,None), T0)
+    b = send(s, Order('T','SPY',Order.BUY,100,Order.MARKET,None), T0)
+    ## shared_volume=True: volume is shared in time priority
+    f = tick(x, s, bar(T0,100,100,100,100,v=250))
+    assert [ (y.order_id, y.qty, y.qty_left) for y in f ] == [ (a.order_id, 250, 50) ]
+    f = tick(x, s, bar(T0+ONE,100,100,100,100,v=120))
+    assert [ (y.order_id, y.qty, y.qty_left) for y in f ] == [ (a.order_id, 50, 0), (b.order_id, 70, 30) ]
+    f = tick(x, s, bar(T0+2*ONE,100,100,100,100,v=1000))
+    assert [ (y.order_id, y.qty, y.qty_left) for y in f ] == [ (b.order_id, 30, 0) ]
+    ## published orders were never touched
+    assert a.qty_left == 300 and b.qty_left == 100
+    assert not x.order_book
+
+
+def test_cancel_replace():
+    x, s = setup()
+    a = send(s, Order('T','SPY',Order.BUY,100,Order.LIMIT,99.0), T0)
+    b = send(s, Order('T','SPY',Order.BUY,100,Order.LIMIT,98.0), T0)
+    assert tick(x, s, bar(T0,100,100,100,100)) == []
+    send(s, OrderCancel('T','SPY',a.order_id), T0+ONE)
+    send(s, OrderReplace('T','SPY',b.order_id,qty=50,limit_price=99.5), T0+ONE)
+    ## the cancel comes back as its ack, to the owner only
+    acks = tick(x, s, bar(T0+ONE,100,100,100,100))
+    assert [ (type(y), y.order_id) for y in acks ] == [ (type(acks[0]), a.order_id) ]
+    assert isinstance(acks[0], OrderCancel) and not x.OUT_fills
+    book = x.order_book['SPY']
+    assert book.get(a.order_id) is None and book.get(b.order_id).limit_price == 99.5
+    f = tick(x, s, bar(T0+2*ONE,100,100,99,99.5))
+    assert [ (y.order_id, y.price, y.qty) for y in f ] == [ (b.order_id, 99.5, 50) ]
+    assert not x.order_book
+
+
+def test_volume_per_order():
+    ## by default each order fills against the whole tick volume
+    x, s = setup()
+    assert not x.shared_volume
+    a = send(s, Order('T','SPY',Order.BUY,300,Order.MARKET,None), T0)
+    b = send(s, Order('T','SPY',Order.BUY,100,Order.MARKET,None), T0)
+    f = tick(x, s, bar(T0,100,100,100,100,v=250))
+    assert [ (y.order_id, y.qty, y.qty_left) for y in f ] == [ (a.order_id, 250, 50), (b.order_id, 100, 0) ]
+
+
+def test_strategy_cancel():
+    ## the strategy keeps a cancelled order, and its fills, until the ack
+    x = Exchange(threaded=False)
+    x.latch = SimDataLatch(1)
+    s = StrategyBase('T')
+    s.log.setLevel(logging.CRITICAL)
+    s.IN_fills = SimQueue()
+    x.add(s)
+
+    def flush(m):
+        for order in s.orders: s.OUT_orders.put(order)
+        del s.orders[:]
+        for y in tick(x, s, m): s.receive(y)
+
+    s.current_timestamp = T0
+    s.send_order(Order('T','SPY',Order.BUY,300,Order.MARKET,None))
+    order_id = s.orders[0].order_id
+    flush(bar(T0,100,100,100,100,v=100))
+    assert s.order_book[order_id].qty_left == 200
+
+    s.current_timestamp = T0+ONE
+    s.cancel_order(order_id)
+    s.cancel_order(order_id)
+    assert len(s.orders) == 1 and order_id in s.order_book and order_id in s.cancels
+    flush(bar(T0+ONE,100,100,100,100,v=100))
+    assert order_id not in s.order_book and not s.cancels
+    assert s.positions['SPY'].qty == 100
+
+    ## filled before the cancel got there: the fill takes it off the book
+    s.send_order(Order('T','SPY',Order.BUY,100,Order.MARKET,None))
+    order_id = s.orders[0].order_id
+    flush(bar(T0+2*ONE,100,100,100,100))
+    assert order_id not in s.order_book
+    s.cancel_order(order_id)
+    assert not s.orders
+
+
+def order(side, order_type, ts, limit=None, stop=None):
+    o = Order('T','SPY',side,100,order_type,limit,stop_price=stop)
+    o.stamp_time(ts)
+    return o
+
+
+def test_order_book():
+    book = OrderBook('SPY')
+    a = order(Order.BUY, Order.MARKET, T0 + timedelta(seconds=2))
+    b = order(Order.BUY, Order.LIMIT, T0, limit=99.0)
+    c = order(Order.SELL, Order.MARKET, T0)
+    d = order(Order.SELL, Order.STOP, T0 + timedelta(seconds=1), stop=97.0)
+    for o in (a, b, c, d):
+        book.add(o)
+    ## time priority, same timestamp in arrival order
+    assert list(book) == [b, c, d, a]
+    assert sorted(book.crossed(98.5, None, None, 96.0), key=book.priority.get) == [b.order_id, d.order_id]
+
+    ## only the due market orders come off the heap, until requeued
+    entries = book.due(T0 + timedelta(seconds=1))
+    assert [ x[2] for x in entries ] == [c.order_id]
+    book.requeue(entries)
+
+    ## removed: off the index and the ladders, its heap entry skipped
+    assert book.remove(c.order_id) is c and book.remove(c.order_id) is None
+    assert book.remove(b.order_id) is b and book.crossed(98.5, None, None, None) == []
+    entries = book.due(T0 + timedelta(minutes=1))
+    assert [ x[2] for x in entries ] == [a.order_id]
+    book.requeue(entries)
+    assert list(book) == [d, a] and len(book) == 2
+
+    ## dead heap entries are compacted away
+    extra = [ order(Order.BUY, Order.MARKET, T0 + timedelta(seconds=10+i)) for i in range(50) ]
+    for o in extra:
+        book.add(o)
+    for o in extra:
+        book.remove(o.order_id)
+    assert len(book.heap) <= 2 * len(book) + 16
+    book.compact()
+    assert [ x[2] for x in book.heap ] == [a.order_id]
+
+    ## the exchange drops a book once its last order is gone
+    x, s = setup()
+    o = send(s, Order('T','SPY',Order.BUY,100,Order.LIMIT,90.0), T0)
+    assert tick(x, s, bar(T0,100,100,100,100)) == [] and 'SPY' in x.order_book
+    send(s, OrderCancel('T','SPY',o.order_id), T0+ONE)
+    tick(x, s, bar(T0+ONE,100,100,100,100))
+    assert not x.order_book
+
+
+## the fills of one bar as the old exchange found them: every resting
+## order checked in time order (without its skip after a removal)
+def scan(resting, m):
+    filled = []
+    for o in sorted(resting, key=lambda o: o.timestamp):
+        if o.order_type == Order.MARKET:
+            hit = o.timestamp <= m.timestamp
+        elif o.order_type == Order.LIMIT:
+            hit = m.low <= o.limit_price if o.side == Order.BUY else m.high >= o.limit_price
+        else:
+            hit = m.high >= o.stop_price if o.side == Order.BUY else m.low <= o.stop_price
+        if hit:
+            filled.append(o.order_id)
+            resting.remove(o)
+    return filled
+
+
+def test_fill_order():
+    ## many orders on one symbol, sent out of time order: fills come
+    ## out in the order a scan of the orders by timestamp finds them
+    rnd = random.Random(5)
+    x, s = setup()
+    resting = []
+    used = set()
+    filled = 0
+    p = 100.0
+    for k in range(1, 80):
+        ts = T0 + k*ONE
+        batch = []
+        for i in range(rnd.randint(0, 6)):
+            ## distinct timestamps, some well before orders already sent
+            while True:
+                sent = T0 + timedelta(seconds=rnd.randint(0, 60*k - 1))
+                if sent not in used: break
+            used.add(sent)
+            side = rnd.choice([Order.BUY, Order.SELL])
+            kind = rnd.choice([Order.MARKET, Order.LIMIT, Order.LIMIT, Order.STOP])
+            px = round(p + rnd.uniform(-3, 3), 1)
+            if kind == Order.LIMIT:
+                batch.append(order(side, kind, sent, limit=px))
+            elif kind == Order.STOP:
+                batch.append(order(side, kind, sent, stop=px))
+            else:
+                batch.append(order(side, kind, sent))
+        for o in batch:
+            send(s, o, o.timestamp)
+        resting.extend(batch)
+
+        last = p
+        p = round(p + rnd.gauss(0, 1), 1)
+        m = bar(ts, last, max(last, p) + 0.5, min(last, p) - 0.5, p)
+        expect = scan(resting, m)
+        assert [ y.order_id for y in tick(x, s, m) ] == expect, k
+        assert [ y.order_id for y in x.order_book.get('SPY', []) ] == [ y.order_id for y in sorted(resting, key=lambda y: y.timestamp) ]
+        filled += len(expect) > 1
+    ## plenty of bars filling several orders at once
+    assert filled > 10
+
+
+def test_shared_orders():
+    x, s = setup()
+    other = s.OUT_orders.new()
+    a = send(s, Order('T','SPY',Order.BUY,100,Order.LIMIT,99.0), T0)
+    ## every subscriber gets the same frozen copy, the sender's order stays its own
+    published = other.get()
+    assert published.frozen and not a.frozen and published is not a
+    a.qty_left = 40
+    a.limit_price = 50.0
+    assert published.qty_left == 100 and published.limit_price == 99.0
+    try:
+        published.qty_left = 0
+        assert False
+    except AttributeError:
+        pass
+    ## the exchange works the order as it was sent
+    assert tick(x, s, bar(T0,100,100,100,100)) == []
+    f = tick(x, s, bar(T0+ONE,100,100,98.5,99))
+    assert [ (y.order_id, y.price, y.qty) for y in f ] == [ (a.order_id, 99.0, 100) ]
+    assert f[0].frozen
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_limit, test_stop, test_stop_limit, test_moo_moc, test_moc_daily, test_partial_fills, test_cancel_replace,
+                  test_volume_per_order, test_strategy_cancel, test_shared_orders, test_order_book, test_fill_order ])
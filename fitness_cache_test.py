@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import numpy
+from DataFeed import BarArray, DataFeedArray
+from FitnessCache import FitnessCache
+from RetraceStrategy import RetraceStrategy
+from test_helpers import run_tests
+
+'''
+checks the FitnessCache round trip and the DataFeedArray fingerprint()
+its keys are built from, on daily style arrays (no bid/ask columns)
+'''
+
+
+def array(closes, symbols=('SPY',)):
+    n = len(closes)
+    timestamp = numpy.arange(n, dtype=numpy.int64) * 86400 * 10**6
+    symbol = numpy.arange(n, dtype=numpy.int32) % len(symbols)
+    columns = dict(close=numpy.array(closes, dtype=numpy.float64),
+                   trade_volume=numpy.ones(n))
+    return BarArray(timestamp, symbol, list(symbols), columns)
+
+
+def test_fingerprint():
+    ## only some of the BarArray.FIELDS, and a bar without a symbol
+    closes = [ 10.0 + i for i in range(20) ]
+    one = DataFeedArray(array(closes)).fingerprint()
+    assert one == DataFeedArray(array(closes)).fingerprint()
+    assert one != DataFeedArray(array(closes[:-1] + [0.0])).fingerprint()
+    assert one != DataFeedArray(array(closes, ['QQQ'])).fingerprint()
+
+    unnamed = DataFeedArray(array(closes, [None, 'SPY'])).fingerprint()
+    assert unnamed != DataFeedArray(array(closes, ['SPY', None])).fingerprint()
+
+
+def test_cache():
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'fitness.db')
+        cache = FitnessCache(filename)
+        fingerprint = DataFeedArray(array([ 1.0, 2.0, 3.0 ])).fingerprint()
+        params = dict(average=20, momentum=5, duration=10)
+        key = cache.key(RetraceStrategy, params, None, fingerprint, reset_on_EOD=True)
+
+        ## the same run, whatever order the params come in
+        assert key == cache.key(RetraceStrategy, dict(reversed(params.items())), None, fingerprint, reset_on_EOD=True)
+        assert key != cache.key(RetraceStrategy, params, None, fingerprint, reset_on_EOD=False)
+
+        assert cache.get(key) is None
+        cache.put(key, dict(cnt=3, mtm_pnl=1.5), RetraceStrategy, params)
+        cache.close()
+
+        cache = FitnessCache(filename)
+        assert cache.get(key) == dict(cnt=3, mtm_pnl=1.5)
+        assert (cache.hits, cache.misses, len(cache)) == (1, 0, 1)
+        cache.clear()
+        assert len(cache) == 0
+        cache.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_fingerprint, test_cache ])
@@ -0,0 +1,93 @@
+import logging
+import Simulator as S
+from Simulator import Simulator, fitness_function
+from GridSearch import GridSearch, RetraceGrid, STATS_COLUMNS
+from RetraceStrategy import RetraceStrategy
+from test_helpers import bars, ListFeed, same, run_tests
+
+'''
+checks the RetraceGrid matrices against the event driven Simulator
+running RetraceStrategy on the same bars
+'''
+
+S.log.setLevel(logging.CRITICAL)
+
+## exact: same arithmetic on the same prices. the rest is summed in another order
+EXACT = ['tag','cnt','mtm_pnl','max_equ','max_dd']
+
+
+def simulate(params, data, reset_on_EOD):
+    s = Simulator()
+    s.verbose = False
+    s.reset_on_EOD = reset_on_EOD
+    s.add_strategy(RetraceStrategy('R',strategy_params=params))
+    return s.run(ListFeed(data))
+
+
+def grid(data, reset_on_EOD=True):
+    g = RetraceGrid(ListFeed(data))
+    g.reset_on_EOD = reset_on_EOD
+    g.grid['momentum'] = [3, 5, 12]
+    g.grid['average'] = [4, 20, 50]
+    g.grid['duration'] = [1, 6, 25]
+    return g
+
+
+def test_simulator():
+    data = bars(500)
+    for reset_on_EOD in (True, False):
+        results = grid(data, reset_on_EOD).run()
+        assert len(results) == 27
+        for row in results.to_dict('records'):
+            params = dict([ (k, row[k]) for k in ('momentum','average','duration') ])
+            ref = simulate(params, data, reset_on_EOD)
+            for k in STATS_COLUMNS:
+                assert same(row[k], ref[k], 0 if k in EXACT else 1e-4), (params, k, row[k], ref[k])
+            assert same(row['score'], fitness_function(ref, 30), 1e-9)
+
+
+def test_edges():
+    ## no bar gets both indicators ready, and an entry on the last bar
+    data = bars(40)
+    g = grid(data)
+    g.grid['average'] = [4, 60]
+    for row in g.run().to_dict('records'):
+        params = dict([ (k, row[k]) for k in ('momentum','average','duration') ])
+        ref = simulate(params, data, True)
+        for k in STATS_COLUMNS:
+            assert same(row[k], ref[k], 1e-4), (params, k, row[k], ref[k])
+
+
+def test_grid():
+    g = RetraceGrid()
+    g.add_parameters([dict(name='momentum',min_val=10,max_val=100,steps=4,converter=int),
+                      dict(name='average',min_val=20,max_val=20,steps=4,converter=int),
+                      dict(name='duration',min_val=5,max_val=20,steps=2,converter=int)])
+    assert g.grid['momentum'] == [10, 40, 70, 100]
+    assert g.grid['average'] == [20] and g.grid['duration'] == [5, 20]
+    assert len(g.combinations()) == 8
+
+    ## blocks of a few rows at a time: the same table, best first
+    data = bars(300)
+    one = grid(data).run()
+    g = grid(data)
+    g.cells = 5 * 300
+    blocks = g.run()
+    assert one.to_csv() == blocks.to_csv()
+    assert list(one['score']) == sorted(one['score'], reverse=True)
+
+
+def test_abstract():
+    ## no entry rule of its own: run() wants a subclass
+    g = GridSearch(ListFeed(bars(50)))
+    g.grid['duration'] = [5]
+    try:
+        g.run()
+        assert False, 'GridSearch ran without signals()'
+    except NotImplementedError:
+        pass
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_simulator, test_edges, test_grid, test_abstract ])
@@ -0,0 +1,126 @@
+import logging
+import Indicators
+import Simulator as S
+from MarketObjects import IndicatorMap
+from IndicatorRegistry import IndicatorRegistry
+from Simulator import Simulator
+from RetraceStrategy import RetraceStrategy
+from test_helpers import prices, bars, ListFeed, history, run_tests
+
+'''
+checks that IndicatorRegistry views behave exactly like private
+indicators, and only compute once while they are in step
+'''
+
+S.log.setLevel(logging.CRITICAL)
+
+def test_shared_in_step():
+    reg = IndicatorRegistry()
+    views = [ reg.view('SPY','SMA',dict(length=10)) for i in range(3) ]
+    ref = Indicators.SMA(10)
+    for p in prices(300):
+        ref.push(p)
+        for v in views:
+            v.push(p)
+            assert history(v) == history(ref)
+    assert len(set([ v.entry for v in views ])) == 1
+    stats = reg.stats()
+    assert stats['instances'] == 1 and stats['deduplicated'] == 2
+    assert stats['computed'] == 300 and stats['pushes'] == 900
+    assert stats['detached'] == 0
+
+
+def test_views_break_away():
+    reg = IndicatorRegistry(snapshot_every=16)
+    a = reg.view('SPY','MO',dict(length=5))
+    b = reg.view('SPY','MO',dict(length=5))
+    c = reg.view('SPY','MO',dict(length=5))
+    d = reg.view('SPY','MO',dict(length=5))
+    refs = [ Indicators.MO(5) for i in range(4) ]
+    data = prices(200)
+    for i, p in enumerate(data):
+        ## b pushes something else half way, c stops reading in step,
+        ## d falls more than a snapshot behind
+        pushed = [ p, p + 1 if i >= 100 else p, p, p if i < 50 or i >= 90 else None ]
+        for v, ref, x in zip([a,b,c,d], refs, pushed):
+            if x is None: continue
+            if v is d and i >= 90:
+                x = data[i - 40]
+            v.push(x)
+            ref.push(x)
+        if i == 120:
+            ## c read before its push of the next bar
+            assert c[0] == refs[2][0]
+        assert history(a) == history(refs[0])
+        assert history(b) == history(refs[1])
+        assert history(c) == history(refs[2])
+    assert history(d) == history(refs[3])
+    assert a.own is None and b.own is not None and d.own is not None
+
+
+def test_copy_on_write():
+    reg = IndicatorRegistry()
+    a = reg.view('SPY','SMA',dict(length=3))
+    b = reg.view('SPY','SMA',dict(length=3))
+    for p in prices(10):
+        a.push(p)
+        b.push(p)
+    b.sethistory(2)
+    a.push(1.0)
+    assert a.size() == 9 and b.size() == 8
+    assert b.hlimit == 2 and a.hlimit == 50
+    b.hlimit = 5
+    assert b.own.hlimit == 5 and a.entry.indicator.hlimit == 50
+    a.reset()
+    assert a.size() == 0 and a.entry.indicator.size() == 9
+
+
+def test_indicator_map():
+    reg = IndicatorRegistry()
+    defs = [ dict(name='mo', class_name='MO', kwargs=dict(length=10)),
+             dict(name='avg', class_name='SMA', kwargs=dict(length=20)) ]
+    IndicatorMap.registry = reg
+    try:
+        maps = [ IndicatorMap(defs), IndicatorMap(defs[:1]) ]
+        maps[1].override([('QQQ','mo',dict(length=12))])
+        for m in maps:
+            m['SPY']
+            m['QQQ']
+    finally:
+        IndicatorMap.registry = None
+    assert maps[0]['SPY']['mo'].entry is maps[1]['SPY']['mo'].entry
+    assert maps[0]['QQQ']['mo'].entry is not maps[1]['QQQ']['mo'].entry
+    assert reg.stats()['deduplicated'] == 1
+
+
+def test_simulator_runs():
+    ## batch lanes share within a run, each run with a registry of its own
+    data = bars(300)
+    params = [ dict(average=20, momentum=5, duration=6), dict(average=20, momentum=5, duration=12),
+               dict(average=30, momentum=5, duration=6) ]
+    s = Simulator(batch=True)
+    s.verbose = False
+    for i, p in enumerate(params):
+        s.add_strategy(RetraceStrategy('R%d' % i, strategy_params=p))
+    first = s.run(ListFeed(data))
+    registry = s.registry
+    assert IndicatorMap.registry is None
+    assert registry.stats()['deduplicated'] > 0
+
+    s.run(ListFeed(data))
+    assert s.registry is not registry
+    assert s.registry.stats()['requested'] == registry.stats()['requested']
+
+    ## the same as strategies running alone
+    for i, p in enumerate(params):
+        alone = Simulator()
+        alone.verbose = False
+        alone.add_strategy(RetraceStrategy('R%d' % i, strategy_params=p))
+        ref = alone.run(ListFeed(data))
+        assert (first[i]['mtm_pnl'], first[i]['cnt']) == (ref['mtm_pnl'], ref['cnt'])
+        assert alone.registry is None
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_shared_in_step, test_views_break_away, test_copy_on_write, test_indicator_map, test_simulator_runs ])
@@ -0,0 +1,240 @@
+import math
+import random
+from fractions import Fraction
+from collections import deque
+import Indicators
+from Indicators import _average, _median
+import test_helpers
+from test_helpers import run_tests
+
+'''
+checks the rolling indicators against the window recomputes they
+replaced (list copy + sum/max/min/sort every bar), value for value.
+SMA and STAT keep exact running sums: their means and deviations are the
+correctly rounded ones, the same as the old code's wherever its own
+left to right float sum was exact
+'''
+
+## rounded to get plenty of ties
+def random_prices(n, seed=3, step=0.5):
+    return test_helpers.prices(n, seed, start=50.0, step=step, digits=1, floor=0.0)
+
+
+## what the indicators computed before the rolling windows, per bar
+def legacy(class_name, window):
+    if class_name == 'SMA': return _average(window, len(window))
+    if class_name == 'MEDIAN': return _median(window, len(window))
+    if class_name == 'Highest': return max(window)
+    if class_name == 'Lowest': return min(window)
+    if class_name == 'BOX':
+        hi, lo = max(window), min(window)
+        pct = 0.50
+        if (hi-lo) != 0: pct = (window[0] - lo)/(hi-lo)
+        return (pct, hi, lo)
+
+
+def check_window(class_name, length, prices, resets=()):
+    ind = getattr(Indicators, class_name)(length)
+    window = []
+    for i, p in enumerate(prices):
+        if i in resets:
+            ind.reset()
+            window = []
+        window.insert(0, p)
+        window = window[:length]
+        ind.push(p)
+        if len(window) < length:
+            assert ind.size() == 0 or i >= length
+            continue
+        want = legacy(class_name, window)
+        assert ind[0] == want, (class_name, length, i, ind[0], want)
+
+
+def test_rolling_indicators():
+    prices = random_prices(2000)
+    for class_name in ('SMA', 'MEDIAN', 'Highest', 'Lowest', 'BOX'):
+        for length in (1, 2, 3, 10, 41, 200):
+            check_window(class_name, length, prices, resets=set([500, 501, 1500]))
+
+
+def test_hilo():
+    random.seed(5)
+    bars = [ (None, round(p + random.random(), 1), round(p - random.random(), 1), None) for p in random_prices(1500) ]
+    for length in (1, 4, 25):
+        ind = Indicators.HILO(length)
+        for i, bar in enumerate(bars):
+            ind.push(bar)
+            if i + 1 < length:
+                assert ind.highs is None and ind.lows is None
+                continue
+            highs = [ b[1] for b in bars[i-length+1:i+1] ]
+            lows = [ b[2] for b in bars[i-length+1:i+1] ]
+            assert ind[0] == (max(highs), min(lows))
+            assert ind.atHigh() == (max(highs) == bar[1])
+            assert ind.atLow() == (min(lows) == bar[2])
+            ## the window as lists, newest first
+            assert ind.highs == highs[::-1] and ind.lows == lows[::-1]
+
+        ## a reset keeps showing the last window until the next calc
+        last = (ind.highs, ind.lows)
+        ind.reset()
+        for bar in bars[:length-1]:
+            ind.push(bar)
+            assert (ind.highs, ind.lows) == last
+        ind.push(bars[length-1])
+        assert ind.highs == [ b[1] for b in bars[length-1::-1] ]
+
+
+def test_median_window():
+    ## heavy ties and even/odd lengths
+    random.seed(9)
+    for length in (2, 5, 6, 51):
+        window = Indicators.RollingMedian(length)
+        values = [ random.randint(0, 6) * 1.0 for i in range(3000) ]
+        for i, x in enumerate(values):
+            window.push(x)
+            if i + 1 >= length:
+                assert window.value() == _median(values[i-length+1:i+1], length), (length, i)
+
+
+## the old SMA/STAT code, verbatim: a float sum newest first
+def old_average(s, length):
+    tmp = list(s)
+    mean = sum(tmp[:length]) / (length * 1.0)
+    return mean
+
+def old_stdev(s, length):
+    avg = old_average(s, length)
+    lst = list(s)[:length]
+    sum = 0
+    for x in lst:
+        sum += (x - avg)*(x-avg)
+    return math.sqrt(sum/len(lst))
+
+
+## exact: the correctly rounded mean and sum((x - avg)**2)/n of the window
+def exact_average(window):
+    return float(sum([ Fraction(x) for x in window ])) / len(window)
+
+def exact_stdev(window, avg):
+    return math.sqrt(float(sum([ (Fraction(x) - Fraction(avg))**2 for x in window ]) / len(window)))
+
+
+def test_sma_exact():
+    ## quarter ticks: the old float sum is exact, so are the results
+    ticks = [ round(p * 4) / 4 for p in random_prices(3000, step=2.0) ]
+    for length in (1, 3, 16, 41, 200):
+        sma = Indicators.SMA(length)
+        for i, p in enumerate(ticks):
+            sma.push(p)
+            if i + 1 >= length:
+                assert sma[0] == old_average(ticks[i::-1], length), (length, i)
+
+    ## any floats: the correctly rounded mean, after any number of pushes,
+    ## within the old sum's own rounding of the old code
+    random.seed(11)
+    prices = [ random.uniform(0.5, 500.0) * random.choice([1, 1e-9, 1e6]) for i in range(5000) ]
+    for length in (2, 7, 200):
+        sma = Indicators.SMA(length)
+        for i, p in enumerate(prices):
+            sma.push(p)
+            if i + 1 < length: continue
+            window = prices[i::-1][:length]
+            assert sma[0] == exact_average(window) == _average(window, length), (length, i)
+            bound = length * 2.0**-52 * sum([ abs(x) for x in window ]) / length
+            assert abs(sma[0] - old_average(window, length)) <= bound
+
+    ## inf and nan come and go with the window
+    sma = Indicators.SMA(2)
+    for p in [1.0, float('inf'), 2.0, float('nan'), 3.0, 4.0]:
+        sma.push(p)
+    assert [ str(x) for x in sma.series ][:4] == ['3.5', 'nan', 'nan', 'inf']
+
+
+def test_stat():
+    ## quarter ticks over power of two lengths: the old code was exact
+    ticks = [ round(p * 4) / 4 for p in random_prices(1500, step=0.5) ]
+    stat = Indicators.STAT(limit=64)
+    for i, p in enumerate(ticks):
+        stat.push(p)
+        for length in (4, 16, 64):
+            if stat.size() < length: continue
+            window = list(stat.prices)
+            assert stat.average(length) == old_average(window, length)
+            assert stat.stdev(length) == old_stdev(window, length), (i, length)
+
+    prices = random_prices(1500, step=0.05)
+    stat = Indicators.STAT(limit=100)
+    for i, p in enumerate(prices):
+        stat.push(p)
+        if i == 700:
+            stat.reset()
+        for length in (5, 20, 100):
+            if stat.size() < length:
+                continue
+            window = list(stat.prices)[:length]
+            avg = exact_average(window)
+            std = exact_stdev(window, avg)
+            assert stat.average(length) == avg == _average(window, length)
+            assert stat.stdev(length) == std, (i, length)
+            assert abs(std - old_stdev(window, length)) <= 1e-12 * max(std, 1.0)
+            if std > 0:
+                assert stat.zscore(length) == (window[0] - avg)/std
+
+
+def test_ring_series():
+    ## the deque calls Metric makes, on floats, tuples, lists and odd values
+    random.seed(6)
+    rows = [ lambda: random.random(),
+             lambda: random.choice([1.5, None, 2, True]),
+             lambda: (random.random(), random.choice([0, None])),
+             lambda: [random.random(), random.random(), random.random()],
+             lambda: random.choice([(1.0, 2.0), dict(a=1), 'x']) ]
+    for make in rows:
+        ring = Indicators.RingSeries()
+        ref = deque()
+        limit = 50
+        for i in range(600):
+            if i == 200: limit = 120
+            if i == 400: limit = 10
+            if i == 500:
+                ring.clear()
+                ref.clear()
+            x = make()
+            ring.appendleft(x)
+            ## numbers are kept as floats, None as NaN; rows as pushed
+            if x is None: x = float('nan')
+            elif not isinstance(x, (tuple, list, dict, str)): x = float(x)
+            ref.appendleft(x)
+            ring.trim(limit)
+            if len(ref) > limit: ref.pop()
+            assert same(list(ring), list(ref)) and len(ring) == len(ref)
+            for k in (0, 1, len(ref) - 1, len(ref), -1):
+                assert same([ ring.get(k) ], [ ref[k] if 0 <= k < len(ref) else None ])
+            assert all([ type(a) is type(b) for a, b in zip(ring, ref) ])
+            ## rows come back as the very object pushed
+            assert not isinstance(ref[0], (tuple, list)) or ring[0] is ref[0]
+        ring.reverse()
+        ref.reverse()
+        assert same(list(ring), list(ref))
+        assert same([ ring.pop() ], [ ref.pop() ])
+
+    ## a row on a series of numbers: the numbers stay floats
+    ring = Indicators.RingSeries([ 1, None, 2.5 ])
+    ring.appendleft((1.0, 0))
+    assert ring[0] == (1.0, 0) and type(ring[1]) is float and ring[2] != ring[2]
+
+    ## MO's int 0 ratio doesn't change how the series is kept
+    mo = Indicators.MO(2)
+    for p in [ 1.0, 0.0, 2.0 ]: mo.push(p)
+    assert mo[0] == (2.0, 0) and type(mo[0][1]) is int
+
+
+## lists equal, NaN matching NaN
+def same(a, b):
+    return len(a) == len(b) and all([ test_helpers.same(x, y) for x, y in zip(a, b) ])
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_rolling_indicators, test_sma_exact, test_hilo, test_median_window, test_stat, test_ring_series ])
@@ -0,0 +1,98 @@
+import os
+import shutil
+import logging
+import tempfile
+from DataFeed import DataFeedDaily, DataFeedIntraday, DataFeedBars, DataFeed_QuantQuote1m
+from test_helpers import row, run_tests
+
+'''
+checks that DataFeed.load_array() replays exactly the rows the text
+parser reads off the same file, odd number formats and gaps included
+'''
+
+logging.getLogger('DataFeed').setLevel(logging.CRITICAL)
+
+FILES = {
+    'daily.csv': (DataFeedDaily, [
+        'Date, Open, High, Low, Close, Volume, Adj Close, Symbol',
+        '2010-01-04, 213.43, 214.5, 212.38, 214.01, 123432400, 29.08, AAPL',
+        '2010-01-05,+214.6,215.59,(1.25),214.38,150476200,29.13,AAPL',
+        '2010-01-06,214.38,215.23,210.75,210.97,,28.67,AAPL',
+        '2010-01-07,-,212,209.06,210.58,119282800,28.61, AAPL ',
+        '2010-01-07,101.5,102.25,100.75,101,5000,101,SPY',
+        '2010-01-08,1e2,101.25,99.5,100.5,7000,100.5,SPY' ]),
+    'intra.csv': (DataFeedIntraday, [
+        'date, time, bid, ask, bidvol, askvol, symbol',
+        '20100315, 08:30:00, 115.2500, 115.2700, 15400, 4600, SPY',
+        '20100315, 08:30:01.250, 115.2600, , 200, 4600, SPY',
+        '20100315, 08:30:01.250, 45.01, 45.02, 100, 300, QQQ',
+        '20100315, 08:31:05, 115.2400, 115.2600, 15000, 4000, SPY' ]),
+    'bars.csv': (DataFeedBars, [
+        'date,time,open,high,low,close,volume,symbol',
+        '03/15/2010,08:30,115.25,115.50,115.00,115.40,1200,SPY',
+        '03/15/2010,08:31,115.40,115.45,115.10,115.20,,SPY',
+        '03/15/2010,08:32,115.20,115.30,115.15,115.25,900,SPY' ]),
+    'SPY.csv': (DataFeed_QuantQuote1m, [
+        '20100104,930,213.43,214.5,212.38,214.01,1234,0,0,0',
+        '20100104,931,214.01,214.1,213.9,214.0,800,0,0,0',
+        '20100104,1330,214.0,214.2,213.7,213.8,950,0,0,0' ]),
+}
+
+
+## the text parse of a file
+def text_rows(data_class, filename):
+    feed = data_class(filename)
+    out = [ row(m) for m in feed ]
+    feed.close()
+    return out
+
+
+def write(tmp):
+    paths = {}
+    for name, (data_class, lines) in FILES.items():
+        paths[name] = os.path.join(tmp, name)
+        with open(paths[name], 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return paths
+
+
+def test_equivalence():
+    tmp = tempfile.mkdtemp()
+    try:
+        for name, filename in write(tmp).items():
+            data_class = FILES[name][0]
+            feed = data_class(filename)
+            bar_array = feed.load_array()
+            feed.close()
+            ## rows, then the one SENTINEL the text feed ends on
+            ref = text_rows(data_class, filename)
+            assert [ row(m) for m in bar_array.feed() ] == ref, name
+            assert len(bar_array) == len(ref) - 1
+            ## only the columns the file populates
+            assert sorted(bar_array.columns) == sorted(data_class.COLUMNS), name
+    finally:
+        shutil.rmtree(tmp)
+
+
+## a feed class the bulk parse fails on
+class Unframed(DataFeedDaily):
+    def _load_frame(self):
+        raise ValueError('no frame')
+
+
+def test_fallback():
+    ## a failed bulk parse is built row by row, with the same result
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = write(tmp)['daily.csv']
+        feed = Unframed(filename)
+        bar_array = feed.load_array()
+        feed.close()
+        assert [ row(m) for m in bar_array.feed() ] == text_rows(DataFeedDaily, filename)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_equivalence, test_fallback ])
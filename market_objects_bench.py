@@ -0,0 +1,131 @@
+import sys
+import copy
+import time
+from datetime import datetime, timedelta
+from MarketObjects import PriceData, Fill, Order, Position
+
+'''
+micro-benchmark of the slotted MarketObjects records against the
+dict-backed classes they replaced.
+reports per object memory, the cost of allocating one PriceData per bar
+over a 1M bar run, and copy.deepcopy() vs copy() on each record.
+usage: python market_objects_bench.py [bars]
+'''
+
+## dict-backed versions, as they were before __slots__
+
+class LegacyPriceData(object):
+    def __init__(self):
+        self.timestamp = None
+        self.symbol = None
+        self.bid = None
+        self.ask = None
+        self.bid_volume = None
+        self.ask_volume = None
+        self.open = None
+        self.high = None
+        self.low = None
+        self.close = None
+        self.trade_volume = None
+
+
+class LegacyFill(object):
+    def __init__(self,symbol,price,qty,side,timestamp,order_id,qty_left=None):
+        self.qty = qty
+        self.price = price
+        self.symbol = symbol
+        self.side = side
+        self.qty_left = qty_left
+        self.order_id = order_id
+        self.fill_id = 1
+        self.timestamp = timestamp
+        self.tag = None
+
+
+class LegacyOrder(object):
+    def __init__(self,owner,symbol,side,qty,order_type,limit_price,stop_price=None):
+        self.order_id = '%s_%d' % (owner,1)
+        self.owner = owner
+        self.symbol = symbol
+        self.side = side
+        self.qty = qty
+        self.qty_left = qty
+        self.order_type = order_type
+        self.limit_price = limit_price
+        self.stop_price = stop_price
+        self.timestamp = None
+
+
+class LegacyPosition(object):
+    def __init__(self,symbol,qty,price):
+        self.symbol = symbol
+        self.qty = qty
+        self.price = price
+
+
+def sizeof(obj):
+    ## object header plus its attribute dict (if any)
+    size = sys.getsizeof(obj)
+    d = getattr(obj,'__dict__',None)
+    if d is not None:
+        size += sys.getsizeof(d)
+    return size
+
+
+def make_bar(cls, ts, px):
+    m = cls()
+    m.timestamp = ts
+    m.symbol = 'SPY'
+    m.open = px
+    m.high = px + 0.5
+    m.low = px - 0.5
+    m.close = px + 0.1
+    m.trade_volume = 1000
+    return m
+
+
+def alloc_rate(cls, bars):
+    ## one bar object per tick, each kept alive like a stored price book
+    ts = datetime(2010,1,4,9,30)
+    one = timedelta(minutes=1)
+    bg = time.time()
+    keep = [ make_bar(cls, ts + i * one, 100.0) for i in xrange(bars) ]
+    secs = time.time() - bg
+    return secs, sum(sizeof(x) for x in keep[:1000]) * len(keep) / 1000
+
+
+def copy_rate(obj, func, count):
+    bg = time.time()
+    for i in xrange(count):
+        func(obj)
+    return count/(time.time() - bg)
+
+
+if __name__ == '__main__':
+
+    bars = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    ts = datetime(2010,1,4,9,30)
+
+    pairs = [ ('PriceData', make_bar(LegacyPriceData,ts,100.0), make_bar(PriceData,ts,100.0)),
+              ('Fill', LegacyFill('SPY',100.0,100,'BUY',ts,'S_1'), Fill('SPY',100.0,100,'BUY',ts,'S_1')),
+              ('Order', LegacyOrder('S','SPY','BUY',100,'MKT',None), Order('S','SPY','BUY',100,'MKT',None)),
+              ('Position', LegacyPosition('SPY',100,100.0), Position('SPY',100,100.0)) ]
+
+    print 'per object memory (bytes)'
+    for name, old, new in pairs:
+        print '  %-10s dict: %5d  slots: %5d' % (name, sizeof(old), sizeof(new))
+
+    print '\n%d bars, one PriceData per bar' % bars
+    old_secs, old_mem = alloc_rate(LegacyPriceData, bars)
+    new_secs, new_mem = alloc_rate(PriceData, bars)
+    print '  dict : %6.2f s  %8.1f ns/bar  %7.1f MB' % (old_secs, old_secs*1e9/bars, old_mem/1e6)
+    print '  slots: %6.2f s  %8.1f ns/bar  %7.1f MB' % (new_secs, new_secs*1e9/bars, new_mem/1e6)
+
+    count = 100000
+    print '\ncopies/s over %d copies' % count
+    for name, old, new in pairs:
+        old_deep = copy_rate(old, copy.deepcopy, count)
+        new_deep = copy_rate(new, copy.deepcopy, count)
+        new_copy = copy_rate(new, lambda x: x.copy(), count)
+        print '  %-10s dict deepcopy: %9.0f  slots deepcopy: %9.0f  slots copy(): %9.0f  (x%.1f)' % \
+              (name, old_deep, new_deep, new_copy, new_copy/old_deep)
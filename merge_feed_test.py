@@ -0,0 +1,103 @@
+import os
+import shutil
+import logging
+import tempfile
+from DataFeed import DataFeed, DataFeedList
+from test_helpers import bars, write_daily, row, run_tests
+
+'''
+checks DataFeedList(mode='merge'): one time ordered stream over the files,
+ties broken by symbol then list order, a single SENTINEL at the end
+'''
+
+logging.getLogger('DataFeed').setLevel(logging.CRITICAL)
+
+
+## files of daily bars: SPY over two files (overlapping on some days),
+## QQQ on every other day, and a file with no rows
+def write(tmp):
+    data = bars(40)
+    spy, late, qqq = data[:25], bars(40, seed=3)[10:40:3], bars(40, seed=5)[::2]
+    files = dict(a=(spy, 'SPY'), b=(qqq, 'QQQ'), c=(late, 'SPY'), empty=([], 'SPY'))
+    paths = {}
+    for name, (rows, symbol) in files.items():
+        paths[name] = os.path.join(tmp, '%s.csv' % name)
+        write_daily(paths[name], rows, symbol)
+    return paths
+
+
+## the rows of each file, sorted by (timestamp, symbol, list position)
+def expected(files):
+    keyed = []
+    for index, filename in enumerate(files):
+        for n, m in enumerate(DataFeedList([filename], data_type='D')):
+            if m is not DataFeed.SENTINEL:
+                keyed.append(((m.timestamp, m.symbol, index, n), row(m)))
+    return [ r for key, r in sorted(keyed) ]
+
+
+def played(feed):
+    return [ row(m) for m in feed ]
+
+
+def test_order():
+    tmp = tempfile.mkdtemp()
+    try:
+        paths = write(tmp)
+        files = [ paths['a'], paths['empty'], paths['b'], paths['c'] ]
+        feed = DataFeedList(files, data_type='D', mode='merge')
+        out = played(feed)
+
+        ## one SENTINEL, once every file is drained, then StopIteration
+        assert out[-1] is None and None not in out[:-1]
+        assert out[:-1] == expected(files)
+        stamps = [ r[0] for r in out[:-1] ]
+        assert stamps == sorted(stamps)
+        try:
+            feed.next()
+            assert False, 'merge went on past its SENTINEL'
+        except StopIteration:
+            pass
+
+        ## ties: QQQ before SPY, then the file listed first
+        day = [ r for r in out[:-1] if r[0] == out[0][0] ]
+        assert [ r[1] for r in day ] == ['QQQ', 'SPY']
+        both = [ stamp for stamp in set(stamps) if stamps.count(stamp) == 3 ]
+        assert both
+        for stamp in both:
+            rows = [ r for r in out[:-1] if r[0] == stamp ]
+            assert rows[1:] == [ r for r in expected([paths['a']]) if r[0] == stamp ] + \
+                               [ r for r in expected([paths['c']]) if r[0] == stamp ]
+        swapped = played(DataFeedList([ paths['c'], paths['b'], paths['a'] ], data_type='D', mode='merge'))
+        assert swapped != out and sorted(swapped) == sorted(out)
+
+        ## again after a reset, and off the preloaded or cached arrays
+        feed.reset()
+        assert played(feed) == out
+        assert played(DataFeedList(files, data_type='D', mode='merge', preload=True)) == out
+        cached = DataFeedList(files, data_type='D', mode='merge', cache=True, cache_dir=os.path.join(tmp, 'cache'))
+        assert played(cached) == out
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_concat():
+    ## the default mode is unchanged: file after file, a SENTINEL after each
+    tmp = tempfile.mkdtemp()
+    try:
+        paths = write(tmp)
+        files = [ paths['a'], paths['b'] ]
+        out = played(DataFeedList(files, data_type='D'))
+        assert out == expected([paths['a']]) + [None] + played(DataFeedList([paths['b']], data_type='D'))
+        try:
+            DataFeedList(files, data_type='D', mode='zip')
+            assert False, 'unknown mode taken'
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_order, test_concat ])
@@ -0,0 +1,262 @@
+import random
+import datetime
+import numpy
+import pandas
+from Portfolio import Portfolio, Snapshots, TRADE_FIELDS, CURVE_FIELDS
+from MarketObjects import PriceData, Fill, Order
+from test_helpers import same, run_tests
+
+'''
+checks the vectorized Portfolio.stats() reductions against the pandas
+Series calls they replaced, to the last bit
+'''
+
+T0 = datetime.datetime(2020,1,2)
+
+def trades(sym, n, owner='portfolio', opened_only=False):
+    out = []
+    for i in range(n):
+        pnl = None if opened_only or random.random() < 0.3 else round(random.gauss(0,2),2)
+        out.append(dict(symbol=sym,qty=1,price=100.0,pnl=pnl,owner=owner,timestamp=T0 + datetime.timedelta(days=i)))
+    return out
+
+
+def curve(sym, n, owner='portfolio'):
+    out = []
+    real = 0
+    for i in range(n):
+        if random.random() < 0.4: continue
+        mtm = round(random.gauss(0,3),2)
+        real += random.choice([0, 1.5, -2.25])
+        out.append(dict(symbol=sym,qty=1,mtm=mtm,realized_pnl=real,mtm_pnl=real + mtm,owner=owner,
+                        timestamp=T0 + datetime.timedelta(days=i)))
+    return out
+
+
+## rows recorded the way Portfolio records them
+def record(rows, fields):
+    out = Snapshots(rows[0]['owner'], rows[0]['symbol'], fields)
+    for row in rows:
+        out.append(row['timestamp'], tuple([ row[f] for f in fields ]))
+    return out
+
+
+## the pandas win_loss_stats() the vectorized one replaced, verbatim
+def pandas_win_loss(port, tag, stat_table):
+    if stat_table.empty:
+        return dict(tag=tag,cnt=0,w_avg=0,w_std=0,pr=0,l_avg=0,l_std=0,w_pct=0,pnl=0,shrp=0)
+
+    wins = stat_table[stat_table['pnl'] > 0]
+    losses = stat_table[stat_table['pnl'] <= 0]
+    trades = stat_table[~pandas.isnull(stat_table['pnl'])] ## grab all not null pnls
+    sharpe = 0
+    if trades['pnl'].count() >0:
+        sharpe = trades['pnl'].mean()/trades['pnl'].std()
+    avg_win = stdv_win = 0
+    if wins['pnl'].count() > 0:
+        avg_win, stdv_win = wins['pnl'].mean(), wins['pnl'].std()
+    avg_loss = stdv_loss = 0
+    if losses['pnl'].count() > 0:
+        avg_loss, stdv_loss = losses['pnl'].mean(), losses['pnl'].std()
+    profit_ratio = 0
+    if avg_loss != 0:
+        profit_ratio = -1*avg_win/avg_loss
+    cnt = stat_table['pnl'].count()
+    tot = stat_table['pnl'].sum()
+    wpct = 0
+    if cnt > 0:
+        wpct = float(wins['pnl'].count())/cnt
+
+    dct = dict(tag=tag,cnt=cnt,w_avg=avg_win,w_std=stdv_win,pr=profit_ratio, \
+               l_avg=avg_loss,l_std=stdv_loss,w_pct=wpct,pnl=tot,shrp=sharpe)
+
+    return port._trunc_results(dct,exclude=['tag','cnt','pnl'])
+
+
+## same value and type, to the last bit
+def exact(a, b):
+    return type(a) == type(b) and same(a, b)
+
+
+## to rounding
+def close(a, b, tol=1e-9):
+    return same(a, b, tol)
+
+
+def test_win_loss():
+    for seed in range(1, 6):
+        random.seed(seed)
+        port = Portfolio('portfolio',None)
+        activity = dict(A=trades('A',40), B=trades('B',3,opened_only=True), C=trades('C',25), D=trades('D',1))
+        if seed % 2:
+            ## no symbol without a closed trade: a float composite column
+            del activity['B']
+        port.trading_activity['portfolio'] = dict([ (sym, record(rows, TRADE_FIELDS)) for sym, rows in activity.items() ])
+        st = port.stats()
+
+        ## each symbol off its dict rows, the composite appended in symbol order
+        summary = port.storage['trade_summary']['portfolio']
+        comp = pandas.DataFrame()
+        refs = []
+        for sym in sorted(activity):
+            table = pandas.DataFrame(activity[sym])
+            refs.append(pandas_win_loss(port, sym, table))
+            comp = comp.append(table,ignore_index=True)
+        refs.append(pandas_win_loss(port, 'portfolio', comp))
+
+        assert list(summary['tag']) == [ ref['tag'] for ref in refs ]
+        for ref, (i, row) in zip(refs, summary.iterrows()):
+            for k in summary.columns:
+                assert same(row[k], ref[k]), (seed, ref['tag'], k, row[k], ref[k])
+        for k in refs[-1]:
+            assert exact(st[k], refs[-1][k]), (seed, k, st[k], refs[-1][k])
+
+
+def test_blended_curve():
+    random.seed(2)
+    port = Portfolio('portfolio',None)
+    port.trading_activity['portfolio'] = dict(A=record(trades('A',5), TRADE_FIELDS))
+    curves = dict([ (sym, curve(sym,60)) for sym in 'ABCDEFGHIJ' ])
+    port.equity_curves['portfolio'] = dict([ (sym, record(rows, CURVE_FIELDS)) for sym, rows in curves.items() ])
+    st = port.stats()
+
+    ## the per symbol concat/ffill/sum the single join replaced
+    blended = None
+    for sym in sorted(curves):
+        strand = pandas.DataFrame(curves[sym]).set_index('timestamp')[['mtm_pnl']]
+        if blended is None:
+            blended = strand
+            continue
+        table = pandas.concat([blended['mtm_pnl'],strand['mtm_pnl']],join='outer',axis=1)
+        table = table.fillna(method='ffill').fillna(value=0)
+        blended = pandas.DataFrame(table.sum(axis=1),columns=['mtm_pnl'])
+
+    ## to the last bit
+    stored = port.storage['curve']['portfolio']
+    assert (stored['mtm_pnl'].values == blended['mtm_pnl'].values).all()
+    assert list(stored['timestamp']) == list(blended.index)
+    top = blended['mtm_pnl'].cummax()
+    ddwn = top - blended['mtm_pnl']
+    assert same(st['max_dd'], ddwn.max()) and same(st['avg_dd'], ddwn[ddwn > 0].mean())
+    assert same(st['mtm_pnl'], blended['mtm_pnl'].iloc[-1])
+
+
+def test_snapshots():
+    ## the dict rows as float64 columns, NaN for None,
+    ## qty typed as pandas typed it: int64 unless a float came along
+    random.seed(3)
+    rows = trades('A', 30) + trades('A', 4, opened_only=True)
+    rows[5]['qty'] = 2.5
+    for fields, data in [ (TRADE_FIELDS, rows), (TRADE_FIELDS, trades('B', 6, opened_only=True)),
+                          (CURVE_FIELDS, curve('C', 80)) ]:
+        ref = pandas.DataFrame(data)
+        table = record(data, fields).table(['timestamp','symbol','owner'] + list(fields))
+        assert list(table['timestamp']) == list(ref['timestamp'])
+        assert list(table['symbol']) == list(ref['symbol']) and list(table['owner']) == list(ref['owner'])
+        for f in fields:
+            assert table[f].dtype == (ref[f].dtype if f == 'qty' else numpy.float64), f
+            assert numpy.allclose(table[f].values, ref[f].astype(float).values, equal_nan=True), f
+
+    ## same timestamp: overwritten in place
+    equ = Snapshots('portfolio', 'A', CURVE_FIELDS)
+    equ.append(T0, (0, 0, 0, 0))
+    assert equ.at(T0) and not equ.at(T0 + datetime.timedelta(1))
+    equ.overwrite((1, None, 2, 2))
+    assert len(equ) == 1 and equ.last('realized_pnl') == 2.0 and equ.last('qty') == 1
+    equ.overwrite((1.5, None, 2, 2))
+    assert equ.values('qty').dtype == numpy.float64 and equ.last('qty') == 1.5
+    assert equ.last('mtm') != equ.last('mtm')
+
+    ## a timestamp that isn't a datetime turns the timestamps into a list
+    equ.append('day 2', (1, 0.5, 2, 2.5))
+    table = equ.table(['timestamp','mtm'])
+    assert table['timestamp'][1] == 'day 2' and table['mtm'][1] == 0.5
+
+
+## a few strategies trading a few symbols on minute bars,
+## some of them stamped out of order
+def trade(port, seed, bars=400, late=97):
+    random.seed(seed)
+    for name in ['A','B','C']:
+        port.strategy_positions[name] = {}
+        port.equity_curves[name] = {}
+        port.trading_activity[name] = {}
+    prices = dict(X=100.0, Y=50.0)
+    t = datetime.datetime(2020,1,2,9,30)
+    for bar in range(bars):
+        t += datetime.timedelta(minutes=1)
+        stamp = t - datetime.timedelta(minutes=30) if late and bar % late == 0 else t
+        for sym in sorted(prices):
+            prices[sym] = round(prices[sym] + random.gauss(0,0.3), 2)
+            if random.random() < 0.05:
+                side = random.choice([Order.BUY, Order.SELL])
+                port.update_positions(sym, Fill(sym, prices[sym], random.randint(1,3), side, stamp, 1), random.choice('AB'))
+            m = PriceData()
+            m.symbol, m.timestamp, m.close = sym, stamp, prices[sym]
+            port.mark_to_market(m)
+
+
+def test_sparse_curves():
+    dense = Portfolio('portfolio',None)
+    trade(dense, 4)
+    dense_stats = dense.stats()
+
+    ## without a sample clock the filled in curves are the dense ones
+    sparse = Portfolio('portfolio',None,sparse=True)
+    trade(sparse, 4)
+    stats = sparse.stats()
+    for k in dense_stats:
+        assert close(stats[k], dense_stats[k]), k
+    for key, table in dense.storage['curve'].items():
+        assert sparse.storage['curve'][key].to_csv() == table.to_csv(), key
+    rows = lambda port: sum([ len(c) for curves in port.equity_curves.values() for c in curves.values() ])
+    assert rows(sparse) < rows(dense)
+
+    ## sampled: same trades, every tick still on the curve, fewer marks
+    sampled = Portfolio('portfolio',None,sparse=True,sample_clock='hour')
+    trade(sampled, 4)
+    stats = sampled.stats()
+    for k in ['cnt','pnl','shrp','w_pct','mtm_pnl']:
+        assert close(stats[k], dense_stats[k]), k
+    for key, table in dense.storage['curve'].items():
+        assert len(sampled.storage['curve'][key]) == len(table)
+    assert rows(sampled) < rows(sparse)
+
+
+def test_live_stats():
+    ## mid-run and at the end, in timestamp order: the running numbers are
+    ## stats()'s to 1e-9, the ones both truncate to 4 places to 1e-4
+    for bars in (30, 150, 400):
+        for sparse in (False, True):
+            port = Portfolio('portfolio',None,sparse=sparse)
+            trade(port, 5, bars=bars, late=None)
+            live = port.live_stats()
+            ref = port.stats()
+            assert sorted(live) == sorted(ref)
+            assert live['tag'] == ref['tag'] and live['cnt'] == ref['cnt']
+            ## trade stats are truncated to 4 places
+            for k in ['w_avg','w_std','pr','l_avg','l_std','w_pct','shrp']:
+                assert close(live[k], ref[k], 1e-4), (k, live[k], ref[k])
+            for k in ['pnl','mtm_pnl','max_equ','max_dd'] + ([] if sparse else ['avg_dd']):
+                assert close(live[k], ref[k]), (k, live[k], ref[k])
+
+            for owner in ['portfolio','A','B','C']:
+                curve_stats = port.storage['curve_stats'][owner].set_index('tag')
+                for sym in ['X','Y',None]:
+                    live = port.live_stats(owner, sym)
+                    row = curve_stats.loc[sym or owner]
+                    assert close(live['max_equ'], row['max_equ']) and close(live['max_dd'], row['max_dd'])
+                    if not sparse:
+                        assert close(live['avg_dd'], row['avg_dd'])
+                    if owner in port.storage['trade_summary'] and sym in [None] + list(port.trading_activity[owner]):
+                        row = port.storage['trade_summary'][owner].set_index('tag').loc[sym or owner]
+                        assert live['cnt'] == row['cnt'] and close(live['pnl'], row['pnl'])
+
+    ## nothing traded or marked yet
+    live = Portfolio('portfolio',None).live_stats()
+    assert live['cnt'] == 0 and live['mtm_pnl'] == 0 and live['max_dd'] == 0
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_win_loss, test_blended_curve, test_snapshots, test_sparse_curves, test_live_stats ])
@@ -0,0 +1,102 @@
+import os
+import shutil
+import logging
+import tempfile
+from DataFeed import DataFeed, DataFeedList, DataFeedPrefetch
+from test_helpers import bars, ListFeed, write_daily, row, run_tests
+
+'''
+checks that DataFeedPrefetch hands over exactly what the wrapped feed
+plays, SENTINELs and the end of the data included, on a worker thread
+and in a worker process
+'''
+
+logging.getLogger('DataFeed').setLevel(logging.CRITICAL)
+
+
+def played(feed):
+    return [ row(m) for m in feed ]
+
+
+def ended(feed):
+    ## StopIteration, every time it is asked again
+    for i in range(2):
+        try:
+            feed.next()
+            return False
+        except StopIteration:
+            pass
+    return True
+
+
+## a feed that breaks after a few rows
+class BrokenFeed(ListFeed):
+    def __iter__(self):
+        for m in self.data[:5]:
+            yield m
+        raise ValueError('bad row')
+
+
+def test_sentinels():
+    tmp = tempfile.mkdtemp()
+    try:
+        data = bars(90)
+        files = [ os.path.join(tmp, name) for name in ['a.csv', 'b.csv'] ]
+        write_daily(files[0], data[:50])
+        write_daily(files[1], data[50:])
+        ref = played(DataFeedList(files, data_type='D'))
+        assert ref.count(None) == 2
+
+        for process in (False, True):
+            ## a SENTINEL after each file, wherever it falls in a batch
+            for batch_size in (1, 7, 51, 92, 500):
+                feed = DataFeedPrefetch(DataFeedList(files, data_type='D'), batch_size=batch_size, depth=2, process=process)
+                assert played(feed) == ref, (process, batch_size)
+                assert ended(feed)
+                assert feed.stats()['rows'] == len(ref)
+                assert feed.worker is None
+
+            ## reset part way through: the whole data again
+            feed = DataFeedPrefetch(DataFeedList(files, data_type='D'), batch_size=8, depth=2, process=process)
+            for i in range(60):
+                feed.next()
+            feed.reset()
+            assert played(feed) == ref and ended(feed)
+
+            ## closed part way through: the worker is stopped
+            feed = DataFeedPrefetch(DataFeedList(files, data_type='D'), batch_size=4, depth=1, process=process)
+            feed.next()
+            feed.close()
+            assert feed.worker is None
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_list_feed():
+    ## a feed that ends on StopIteration after its SENTINEL
+    data = bars(30)
+    for process in (False, True):
+        feed = DataFeedPrefetch(iter(ListFeed(data)), batch_size=4, process=process)
+        out = list(feed)
+        assert out[-1] is DataFeed.SENTINEL and [ row(m) for m in out[:-1] ] == [ row(m) for m in data ]
+        assert ended(feed)
+
+
+def test_errors():
+    ## an error in the wrapped feed is raised to the consumer
+    for process in (False, True):
+        feed = DataFeedPrefetch(iter(BrokenFeed(bars(10))), batch_size=2, process=process)
+        seen = []
+        try:
+            for m in feed:
+                seen.append(m)
+            assert False, 'error swallowed'
+        except ValueError as e:
+            assert str(e) == 'bad row'
+        assert feed.worker is None
+        assert len(seen) <= 5
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_sentinels, test_list_feed, test_errors ])
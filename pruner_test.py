@@ -0,0 +1,104 @@
+import logging
+import Simulator as S
+from Simulator import Simulator, Pruner, fitness_function
+from RetraceStrategy import RetraceStrategy
+from test_helpers import bars, ListFeed, run_tests
+
+'''
+checks that Simulator(pruner) stops only the lanes the Pruner rejects,
+and leaves the others' results as they were
+'''
+
+S.log.setLevel(logging.CRITICAL)
+
+PARAMS = [ dict(average=20,momentum=5,duration=10), dict(average=50,momentum=10,duration=5),
+           dict(average=10,momentum=3,duration=20) ]
+
+def simulate(params, pruner=None, batch=False, data=None, reset_on_EOD=False, max_bars=None):
+    s = Simulator(batch=batch)
+    s.verbose = False
+    s.reset_on_EOD = reset_on_EOD
+    s.pruner = pruner
+    s.max_bars = max_bars
+    for i, p in enumerate(params):
+        s.add_strategy(RetraceStrategy('R%d' % i,strategy_params=p))
+    return s.run(data or bars(1200))
+
+
+def test_max_dd():
+    full = [ simulate([p]) for p in PARAMS ]
+    limit = sorted([ st['max_dd'] for st in full ])[1]
+
+    out = simulate(PARAMS, Pruner(every=50,max_dd=limit), batch=True)
+    for st, ref in zip(out, full):
+        if ref['max_dd'] <= limit:
+            ## never stopped: the same run
+            assert st['status'] == 'done' and st['bars'] == 1200
+            assert dict([ (k, v) for k, v in st.items() if k != 'status' ]) == ref
+        else:
+            assert st['status'] == 'pruned:max_dd' and st['bars'] < 1200
+            assert st['bars'] % 50 == 0 and st['max_dd'] > limit
+
+    ## a lone run stops as soon as its lane does
+    st = simulate(PARAMS[:1], Pruner(every=10,max_dd=1.0))
+    assert st['status'] == 'pruned:max_dd' and st['bars'] <= 100
+
+
+def test_cutoff():
+    ## nothing passes an unreachable cutoff, but not before min_progress
+    pruner = Pruner(every=100,cutoff=1e9,total=1200,min_progress=0.5,optimism=1.0)
+    out = simulate(PARAMS, pruner, batch=True)
+    for st in out:
+        assert st['status'] in ('pruned:cutoff','done')
+        if st['status'] != 'done':
+            assert st['bars'] == 600
+
+    ## cutoff pruning is a heuristic: off unless optimism is set
+    out = simulate(PARAMS, Pruner(every=100,cutoff=1e9,total=1200,min_progress=0.5), batch=True)
+    assert [ st['status'] for st in out ] == ['done'] * 3
+
+    ## bound() is never below 0: a cutoff of 0 stops nothing
+    data = bars(1200)
+    full = [ simulate([p], data=data) for p in PARAMS ]
+    out = simulate(PARAMS, Pruner(every=100,cutoff=0,total=1200,min_progress=0,optimism=1.0), batch=True, data=data)
+    assert [ st['status'] for st in out ] == ['done'] * 3
+    assert [ st['mtm_pnl'] for st in out ] == [ st['mtm_pnl'] for st in full ]
+
+    ## a stopped run scores below the cutoff on what it had so far
+    cutoff = max([ fitness_function(st) for st in full ])
+    for st in simulate(PARAMS, Pruner(every=100,cutoff=cutoff,total=1200,optimism=1.0), batch=True, data=data):
+        if st['status'] == 'pruned:cutoff':
+            assert fitness_function(st) < cutoff and st['bars'] >= 240
+
+
+def test_early_end():
+    ## max_bars, or a lane pruned at bar n, ends as a feed of n bars would,
+    ## positions flattened on EOD
+    data = bars(1200)
+    trim = lambda st: dict([ (k, v) for k, v in st.items() if k not in ('bars','status','_score') ])
+    for n in (300, 777):
+        ref = [ simulate([p], data=ListFeed(data[:n]), reset_on_EOD=True) for p in PARAMS ]
+        out = simulate(PARAMS, batch=True, data=ListFeed(data), reset_on_EOD=True, max_bars=n)
+        assert [ st['bars'] for st in out ] == [n] * 3
+        assert [ trim(st) for st in out ] == [ trim(st) for st in ref ]
+        st = simulate(PARAMS[:1], data=ListFeed(data), reset_on_EOD=True, max_bars=n)
+        assert trim(st) == trim(ref[0])
+
+    ## a lone run pruned at bar 100
+    st = simulate(PARAMS[:1], Pruner(every=100,max_dd=1.0), data=ListFeed(data), reset_on_EOD=True)
+    assert st['status'] == 'pruned:max_dd' and st['bars'] == 100
+    assert trim(st) == trim(simulate(PARAMS[:1], data=ListFeed(data[:100]), reset_on_EOD=True))
+
+
+def test_bound():
+    pruner = Pruner(total=1000,optimism=1.0)
+    stats = dict(max_dd=20.0,mtm_pnl=-10.0,max_equ=30.0,cnt=12)
+    ## 30 a bar per 100 bars for the 900 to come
+    assert pruner.bound(stats, 100) == (-10.0 + 0.3 * 900) / 20.0
+    assert pruner.bound(stats, 1000) == 0
+    assert pruner.bound(dict(stats,max_dd=float('nan')), 100) is None
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_max_dd, test_cutoff, test_early_end, test_bound ])
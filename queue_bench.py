@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import logging
+import tempfile
+from DataQueues import DQueue, OutQueue, OrderHandler, FillHandler, DataLatch
+from DataQueues import SimQueue, SimOrderHandler, SimFillHandler, SimDataLatch
+from MarketObjects import Order, Fill
+from DataFeed import DataFeedList
+from date_parser_bench import write_1m_file
+from RetraceStrategy import RetraceStrategy
+import Simulator
+
+'''
+benchmark of the lock free Sim* queues against the locked queues
+1. the queue traffic of one simulated bar (latch, order in, fill out,
+   the len/peek checks each on_data_sim() makes) for a few strategies
+2. a full Simulator run on a synthetic 1m file, lock_free=True vs False
+usage: python queue_bench.py [strategy_count]
+'''
+
+class Stub(object):
+    def __init__(self,name):
+        self.name = name
+        self.OUT_orders = OutQueue()
+
+
+def bar_rate(strategy_count, lock_free, bars=50000):
+
+    if lock_free:
+        handler, fills, latch = SimOrderHandler(), SimFillHandler(), SimDataLatch(strategy_count + 2)
+        new_queue = SimQueue
+    else:
+        handler, fills, latch = OrderHandler(), FillHandler(), DataLatch(strategy_count + 2)
+        new_queue = DQueue
+
+    strats = [ Stub('S%d' % i) for i in range(strategy_count) ]
+    in_fills = {}
+    portfolio = []
+    for s in strats:
+        handler.connect(s.OUT_orders,s.name)
+        in_fills[s.name] = new_queue()
+        fills.add_queue(in_fills[s.name],s.name)
+        portfolio.append(s.OUT_orders.new(new_queue()))
+
+    order = Order('S0','SPY',Order.BUY,100,Order.MARKET,None)
+    fill = Fill('SPY',100.0,100,Order.BUY,None,order.order_id)
+
+    bg = time.time()
+    for i in xrange(bars):
+        latch.trap(i)
+        for s in strats:
+            q = in_fills[s.name]
+            while q:
+                q.get()
+            s.OUT_orders.put(order)
+            latch.notify()
+        ## exchange
+        while handler:
+            o = handler.get()
+            fills.put(fill,o.owner)
+        latch.notify()
+        ## portfolio
+        for q in portfolio:
+            while q:
+                q.get()
+        while fills:
+            fills.peek()
+            fills.get()
+        latch.notify()
+    return (time.time() - bg) * 1e6 / bars
+
+
+def sim_rate(filename, lock_free):
+    s = Simulator.Simulator(lock_free=lock_free)
+    s.verbose = False
+    s.add_strategy(RetraceStrategy('R1',strategy_params=dict(average=41,momentum=11,duration=15)))
+    feed = DataFeedList([filename],data_type='Q1m')
+    bg = time.time()
+    s.run(feed)
+    return (time.time() - bg) * 1e6 / feed_rows(filename)
+
+
+def feed_rows(filename):
+    with open(filename) as f:
+        return sum(1 for x in f)
+
+
+if __name__ == '__main__':
+
+    logging.disable(logging.CRITICAL)
+    strategy_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    locked = bar_rate(strategy_count, False)
+    free = bar_rate(strategy_count, True)
+    print 'queue traffic per bar (%d strategies)' % strategy_count
+    print '  locked   : %7.2f us/bar' % locked
+    print '  lock free: %7.2f us/bar  (saves %.2f us/bar)' % (free, locked - free)
+
+    filename = os.path.join(tempfile.mkdtemp(),'SPY.csv')
+    write_1m_file(filename, days=20)
+    locked = sim_rate(filename, False)
+    free = sim_rate(filename, True)
+    print 'Simulator.run, RetraceStrategy on 1m bars'
+    print '  locked   : %7.2f us/bar' % locked
+    print '  lock free: %7.2f us/bar  (saves %.2f us/bar)' % (free, locked - free)
+    os.remove(filename)
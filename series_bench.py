@@ -0,0 +1,87 @@
+import sys
+import time
+import random
+from collections import deque
+import Indicators
+
+'''
+benchmark of the RingSeries Metric.series storage against the deque
+of python floats/tuples it replaced, on a universe of symbols with a
+dozen indicators each. reports the bytes held by the series and the
+per bar push cost over the whole universe.
+usage: python series_bench.py [symbols] [bars]
+'''
+
+## the deque Metric.series was, plus the trim() Metric._pop() calls
+class LegacySeries(deque):
+    def trim(self,limit):
+        if len(self) > limit: self.pop()
+
+
+DEFS = [ ('SMA',10), ('SMA',50), ('SMA',150), ('MO',10), ('MO',20), ('MO',60),
+         ('BOX',20), ('HILO',20), ('Highest',20), ('Lowest',20), ('MEDIAN',15) ]
+
+def universe(symbols, legacy):
+    out = []
+    for i in range(symbols):
+        row = [ getattr(Indicators,name)(length) for name, length in DEFS ]
+        row.append(Indicators.TimeSeries(capacity=50))
+        if legacy:
+            for ind in row: ind.series = LegacySeries()
+        out.append(row)
+    return out
+
+
+def bars(count):
+    random.seed(2)
+    p = 100.0
+    out = []
+    for i in xrange(count):
+        p = max(1.0, p + random.gauss(0,0.5))
+        out.append((p, p + random.random(), p - random.random()))
+    return out
+
+
+## bytes of the series containers and every object they hold (counted once)
+def series_bytes(rows):
+    seen = set()
+    total = 0
+    def size(obj):
+        if id(obj) in seen: return 0
+        seen.add(id(obj))
+        n = sys.getsizeof(obj)
+        if isinstance(obj,(tuple,list,deque)):
+            n += sum([ size(x) for x in obj ])
+        elif isinstance(obj,Indicators.RingSeries) and obj.buffer is not None:
+            n += size(obj.buffer)
+        return n
+    for row in rows:
+        for ind in row:
+            total += size(ind.series)
+    return total
+
+
+def run(symbols, count, legacy):
+    rows = universe(symbols, legacy)
+    data = bars(count)
+    bg = time.time()
+    for close, high, low in data:
+        vector = (close, high, low, close)
+        for row in rows:
+            for ind in row:
+                ind.push(vector if isinstance(ind,Indicators.HILO) else close)
+    secs = time.time() - bg
+    return series_bytes(rows), secs * 1e6 / count
+
+
+if __name__ == '__main__':
+
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print '%d symbols x %d indicators, %d bars' % (symbols, len(DEFS) + 1, count)
+    ## best of 3, the push cost is noisy
+    old_bytes, old_rate = min([ run(symbols, count, True) for i in range(3) ])
+    new_bytes, new_rate = min([ run(symbols, count, False) for i in range(3) ])
+    print '  deque     : %8.1f MB  %9.0f us/bar' % (old_bytes/1e6, old_rate)
+    print '  RingSeries: %8.1f MB  %9.0f us/bar  (x%.1f smaller)' % (new_bytes/1e6, new_rate, old_bytes*1.0/new_bytes)
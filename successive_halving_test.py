@@ -0,0 +1,103 @@
+import os
+import shutil
+import logging
+import tempfile
+import Optimizer as O
+from Optimizer import SuccessiveHalving
+from Simulator import Simulator
+from DataFeed import DataFeed, DataFeedList
+from RetraceStrategy import RetraceStrategy
+from test_helpers import bars, ListFeed, write_daily, same, run_tests
+
+'''
+checks the SuccessiveHalving rungs: slice lengths, promotions,
+bar budgets, and that a sliced run is the run on the shorter feed
+'''
+
+O.log.setLevel(logging.CRITICAL)
+
+
+def simulate(params, data, max_bars=None, reset_on_EOD=False):
+    s = Simulator()
+    s.verbose = False
+    s.reset_on_EOD = reset_on_EOD
+    s.max_bars = max_bars
+    s.add_strategy(RetraceStrategy('R',strategy_params=params))
+    return s.run(ListFeed(data))
+
+
+def test_max_bars():
+    data = bars(900)
+    params = dict(average=20,momentum=5,duration=10)
+    assert simulate(params, data, max_bars=300) == simulate(params, data[:300])
+    assert simulate(params, data, max_bars=2000)['bars'] == 900
+
+
+def test_rungs():
+    data = bars(900)
+    o = SuccessiveHalving()
+    o.strategy_class = RetraceStrategy
+    o.data_feed = ListFeed(data)
+    o.size = 27
+    o.rungs = 3
+    o.min_trade_count = 9
+    o.display_dump = False
+    o.write = lambda: None
+    for p in [dict(name='momentum',min_val=3,max_val=30,steps=16,converter=int),
+              dict(name='average',min_val=10,max_val=60,steps=16,converter=int),
+              dict(name='duration',min_val=5,max_val=20,steps=8,converter=int)]:
+        o.add_parameter(p)
+
+    assert o.slices(900) == [100, 300, 900]
+    o.run()
+
+    df = o.optimizer_df
+    assert [ len(df[df['gen_id'] == g]) for g in (1, 2, 3) ] == [27, 9, 3]
+    assert list(df[df['gen_id'] == 1]['bars']) == [100] * 27
+    assert list(df[df['gen_id'] == 3]['budget']) == [1300] * 3
+    assert o.bars_simulated == 27 * 100 + 9 * 300 + 3 * 900
+    assert o.min_trade_count == 9 and o.max_bars is None
+
+    ## the best of each rung went on to the next
+    key = lambda row: tuple(sorted(o.run_map[row['run_id']].items()))
+    for g in (1, 2):
+        rung = df[df['gen_id'] == g]
+        promoted = set([ key(row) for i, row in df[df['gen_id'] == g + 1].iterrows() ])
+        assert len(promoted) == 27 // 3 ** g
+        scores = [ (key(row) in promoted, row['score']) for i, row in rung.iterrows() ]
+        assert min([ x for p, x in scores if p ]) >= max([ x for p, x in scores if not p ])
+
+    ## each rung's stats are those of a plain run on the rung's slice,
+    ## ended on EOD as the optimizer's runs are
+    stat_keys = ['cnt','w_pct','pr','pnl','mtm_pnl','max_equ','max_dd','avg_dd','l_avg','l_std','shrp','w_avg','w_std']
+    for g, n in zip((1, 2, 3), (100, 300, 900)):
+        for i, row in df[df['gen_id'] == g].iterrows():
+            ref = simulate(o.run_map[row['run_id']], data[:n], reset_on_EOD=True)
+            for k in stat_keys:
+                assert same(row[k], ref[k]), (g, k, row[k], ref[k])
+
+    ## finalists are scored on full runs
+    score, best = o.population[0]
+    stats = simulate(o.factory.decode(best), data)
+    assert o.results_map[best][0]['mtm_pnl'] == stats['mtm_pnl']
+
+
+def test_preload():
+    ## the pool workers get a preloaded copy of the feed, the optimizer's is untouched
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'SPY.csv')
+        write_daily(filename, bars(50))
+        feed = DataFeedList([filename], data_type='D')
+        loaded = O._preload(feed)
+        assert loaded is not feed and loaded.preload and filename in loaded.arrays
+        assert not feed.preload and feed.arrays == {}
+        played = lambda d: [ (m.timestamp, m.close) for m in d if m is not DataFeed.SENTINEL ]
+        assert played(loaded) == played(feed)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_max_bars, test_rungs, test_preload ])
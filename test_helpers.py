@@ -0,0 +1,96 @@
+import random
+from datetime import datetime, timedelta
+from DataFeed import DataFeed
+from MarketObjects import PriceData
+
+'''
+fixtures shared by the *_test.py scripts: seeded price series,
+daily bars, a feed over them and the data files they are written to,
+and the loop that runs a script's tests
+'''
+
+## the PriceData fields rows are compared on
+PRICE_FIELDS = ('timestamp','symbol','bid','ask','bid_volume','ask_volume',
+                'open','high','low','close','trade_volume')
+
+## a seeded random walk of n prices, rounded to digits (so there are ties),
+## kept at or above floor if given.
+## ranges=True: (close, high, low), a high and a low around each price
+def prices(n, seed=1, start=100.0, step=1.0, digits=2, floor=None, ranges=False):
+    random.seed(seed)
+    p = start
+    close, high, low = [], [], []
+    for i in range(n):
+        p = round(p + random.gauss(0,step), digits)
+        if floor is not None:
+            p = max(floor, p)
+        close.append(p)
+        if ranges:
+            high.append(p + round(random.random(), 1))
+            low.append(p - round(random.random(), 1))
+    if ranges:
+        return close, high, low
+    return close
+
+
+## n daily SPY bars from 2010-01-04
+def bars(n, seed=7):
+    random.seed(seed)
+    out = []
+    p = 100.0
+    t = datetime(2010,1,4)
+    for i in range(n):
+        o = p
+        p = max(1.0, round(p + random.gauss(0,1.5), 2))
+        m = PriceData()
+        m.timestamp = t + timedelta(days=i)
+        m.symbol = 'SPY'
+        m.open, m.high, m.low, m.close = o, max(o,p) + 0.5, min(o,p) - 0.5, p
+        out.append(m)
+    return out
+
+
+## a data feed over a list of bars
+class ListFeed(object):
+    def __init__(self,data):
+        self.data = data
+
+    def reset(self):
+        pass
+
+    def __iter__(self):
+        for m in self.data:
+            yield m
+        yield DataFeed.SENTINEL
+
+
+## bars written out as a yahoo style daily file (DataFeedDaily)
+def write_daily(path, data, symbol=None):
+    with open(path, 'w') as f:
+        f.write('Date,Open,High,Low,Close,Volume,Adj Close,Symbol\n')
+        for m in data:
+            f.write('%s,%s,%s,%s,%s,1000,%s,%s\n' % (m.timestamp.strftime('%Y-%m-%d'),
+                    m.open, m.high, m.low, m.close, m.close, symbol or m.symbol))
+
+
+## a PriceData as a tuple of its fields, None for the SENTINEL
+def row(m):
+    if m is DataFeed.SENTINEL:
+        return None
+    return tuple([ getattr(m, f) for f in PRICE_FIELDS ])
+
+
+## every value an indicator holds, and past the end of it
+def history(metric, beyond=1):
+    return [ metric[i] for i in range(metric.size() + beyond) ]
+
+
+## equal, both NaN, or within tol of b (relative, absolute below 1)
+def same(a, b, tol=0):
+    return a == b or (a != a and b != b) or abs(a - b) <= tol * max(1.0, abs(b))
+
+
+def run_tests(tests):
+    for test in tests:
+        test()
+        print '%s: OK' % test.__name__
@@ -0,0 +1,67 @@
+import os
+import time
+import logging
+import tempfile
+import numpy
+import Indicators
+import VectorIndicators
+from Simulator import Simulator
+from RetraceStrategy import RetraceStrategy
+from DataFeed import DataFeedList
+from date_parser_bench import write_1m_file
+
+'''
+benchmark of the preloaded numpy indicators (Simulator(vector_indicators=True))
+against the push-by-push Indicators classes, on a synthetic 1m bar file:
+the indicator work alone (SMA(200)/MO(60) over the closes), and a full
+RetraceStrategy run with each backend.
+'''
+
+logging.disable(logging.CRITICAL)
+
+
+def indicator_time(closes, vector):
+    bg = time.time()
+    if vector:
+        x = numpy.array(closes)
+        VectorIndicators._sma(x, 200)
+        VectorIndicators._mo(x, 60)
+    else:
+        sma = Indicators.SMA(200)
+        mo = Indicators.MO(60)
+        for p in closes:
+            sma.push(p)
+            mo.push(p)
+    return time.time() - bg
+
+
+def run_time(filename, vector):
+    s = Simulator(vector_indicators=vector)
+    s.verbose = False
+    s.add_strategy(RetraceStrategy('R', strategy_params=dict(average=200, momentum=60, duration=15)))
+    feed = DataFeedList([filename], data_type='Q1m', preload=True)
+    bg = time.time()
+    stats = s.run(feed)
+    return time.time() - bg, stats
+
+
+if __name__ == '__main__':
+
+    filename = os.path.join(tempfile.mkdtemp(), 'SPY.csv')
+    count = write_1m_file(filename)
+    with open(filename) as f:
+        closes = [ float(x.split(',')[5]) for x in f ]
+
+    print 'bars = %d' % count
+    push = min([ indicator_time(closes, False) for i in range(3) ])
+    vector = min([ indicator_time(closes, True) for i in range(3) ])
+    print 'SMA(200)/MO(60)   push: %6.3f s' % push
+    print 'SMA(200)/MO(60) vector: %6.3f s  (x%.0f)' % (vector, push/vector)
+
+    push, a = min([ run_time(filename, False) for i in range(3) ])
+    vector, b = min([ run_time(filename, True) for i in range(3) ])
+    assert (a['pnl'], a['cnt'], a['mtm_pnl']) == (b['pnl'], b['cnt'], b['mtm_pnl'])
+    print 'RetraceStrategy run   push: %6.3f s' % push
+    print 'RetraceStrategy run vector: %6.3f s  (%.0f%% less)' % (vector, 100 * (push - vector)/push)
+
+    os.remove(filename)
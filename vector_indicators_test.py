@@ -0,0 +1,89 @@
+import numpy
+import Indicators
+from MarketObjects import IndicatorMap
+from VectorIndicators import SymbolSeries, VectorMetric, VECTOR
+from test_helpers import prices, history, run_tests
+
+'''
+checks that the preloaded VectorIndicators serve exactly the series
+the Indicators classes build push by push
+'''
+
+## rounded to get ties and a few zero prices (MO divides by them)
+def random_series(n, seed=7):
+    return prices(n, seed, start=3.0, step=0.5, digits=1, floor=0.0, ranges=True)
+
+
+def make_series(close, high, low, ends=None):
+    columns = dict(close=numpy.array(close), high=numpy.array(high), low=numpy.array(low))
+    return SymbolSeries(columns, ends or [len(close)])
+
+
+def same(class_name, length, close, high, low, steps, hlimit=None):
+    series = make_series(close, high, low, ends=[len(close)/3, len(close)])
+    vec = VectorMetric(class_name, dict(length=length), series, {}, 'X')
+    ref = getattr(Indicators, class_name)(length)
+    if hlimit:
+        vec.sethistory(hlimit)
+        ref.sethistory(hlimit)
+    for i in range(len(close)):
+        price = (None, high[i], low[i], None) if class_name == 'HILO' else close[i]
+        vec.push(price)
+        ref.push(price)
+        assert history(vec, 2) == history(ref, 2), (class_name, length, i)
+        assert vec.size() == ref.size()
+        if i in steps:
+            vec.reset()
+            ref.reset()
+    assert vec.live is None, class_name
+
+
+def test_equivalence():
+    close, high, low = random_series(600)
+    for class_name in VECTOR:
+        for length in (1, 2, 5, 20):
+            same(class_name, length, close, high, low, steps=set([150, 151, 400]))
+        same(class_name, 7, close, high, low, steps=set(), hlimit=3)
+
+
+def test_mismatch_goes_live():
+    close, high, low = random_series(100)
+    vec = VectorMetric('SMA', dict(length=5), make_series(close, high, low), {}, 'X')
+    ref = Indicators.SMA(5)
+    for i in range(50):
+        vec.push(close[i])
+        ref.push(close[i])
+    ## pushing something the feed never played
+    vec.push(-1.0)
+    ref.push(-1.0)
+    assert vec.live is not None
+    assert history(vec, 2) == history(ref, 2)
+    ## internals are served by the live indicator
+    assert list(vec.prices) == list(ref.prices)
+
+
+def test_indicator_map():
+    close, high, low = random_series(200)
+    defs = [ dict(name='mo', class_name='MO', kwargs=dict(length=10)),
+             dict(name='avg', class_name='SMA', kwargs=dict(length=20)),
+             dict(name='dur', class_name='TimeSeries', kwargs=dict(capacity=5)) ]
+    vec_map = IndicatorMap(defs)
+    vec_map.preload(dict(X=make_series(close, high, low)))
+    ref_map = IndicatorMap(defs)
+    assert isinstance(vec_map['X']['mo'], VectorMetric)
+    assert isinstance(vec_map['X']['dur'], Indicators.TimeSeries)
+    for i, p in enumerate(close):
+        ## a reset mid series picks up at the current row
+        if i == 120:
+            vec_map.reset()
+            ref_map.reset()
+        for name in ('mo', 'avg'):
+            vec_map['X'][name].push(p)
+            ref_map['X'][name].push(p)
+            assert history(vec_map['X'][name], 2) == history(ref_map['X'][name], 2)
+    assert vec_map['X']['avg'].live is None
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_equivalence, test_mismatch_goes_live, test_indicator_map ])
@@ -0,0 +1,158 @@
+import os
+import shutil
+import logging
+import tempfile
+from datetime import timedelta
+import numpy
+import Optimizer as O
+from Optimizer import Optimizer
+from Simulator import Simulator
+from DataFeed import DataFeed, DataFeedList, BarArray
+from RetraceStrategy import RetraceStrategy
+from WalkForward import WalkForward
+from test_helpers import bars, ListFeed, write_daily, run_tests
+
+'''
+checks the BarArray windows WalkForward serves and that its out-of-sample
+curve is the replays of each window's best params, end to end
+'''
+
+O.log.setLevel(logging.CRITICAL)
+
+
+def played(data_feed):
+    data_feed.reset()
+    return [ (m.timestamp, m.symbol, m.close) for m in data_feed if m is not DataFeed.SENTINEL ]
+
+
+def rows(bar_array):
+    return played(bar_array.feed())
+
+
+def test_bar_array():
+    data = bars(300)
+    tmp = tempfile.mkdtemp()
+    try:
+        files = [ os.path.join(tmp, name) for name in ['a.csv', 'b.csv', 'c.csv'] ]
+        write_daily(files[0], data[:120], 'SPY')
+        write_daily(files[1], data[120:], 'SPY')
+        write_daily(files[2], bars(200, seed=3), 'QQQ')
+
+        ## one array, in the order the list plays the files
+        for mode, names in [ ('concat', files[:2]), ('concat', files), ('merge', files) ]:
+            feed = DataFeedList(names, data_type='D', mode=mode)
+            assert rows(feed.bar_array()) == played(feed), mode
+
+        ## same time ties ranked as the heap ranks the symbols: None first,
+        ## where as strings 'None' would fall between 'MSFT' and 'NVDA'
+        names = [ 'nvda', 'none', 'msft', 'aaa' ]
+        feed = DataFeedList(names, data_type='D', mode='merge', preload=True)
+        for name, symbol in zip(names, [ 'NVDA', None, 'MSFT', 'AAA' ]):
+            tied = bars(20)
+            for m in tied:
+                m.symbol = symbol
+            feed.arrays[name] = BarArray.from_feed(iter(ListFeed(tied)))
+        merged = played(feed)
+        assert [ s for t, s, c in merged[:4] ] == [ None, 'AAA', 'MSFT', 'NVDA' ]
+        assert rows(feed.bar_array()) == merged
+
+        ## a window of it: views into the same columns
+        bar_array = DataFeedList(files[:2], data_type='D').bar_array()
+        start, stop = bar_array.between(data[100].timestamp, data[150].timestamp)
+        assert (start, stop) == (100, 150)
+        window = bar_array.slice(start, stop)
+        assert numpy.may_share_memory(window.columns['close'], bar_array.columns['close'])
+        assert rows(window) == rows(bar_array)[100:150]
+        assert bar_array.between(data[-1].timestamp + timedelta(1)) == (300, 300)
+        assert window.feed().fingerprint() != bar_array.slice(101, 151).feed().fingerprint()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def optimizer():
+    o = Optimizer()
+    o.strategy_class = RetraceStrategy
+    o.size, o.cutoff, o.pairs_needed = 8, 4, 2
+    o.max_generations = 2
+    o.min_trade_count = 5
+    o.display_dump = False
+    o.outfile = os.path.join(tempfile.gettempdir(), 'walk_forward_test.xls')
+    for p in [dict(name='momentum',min_val=3,max_val=30,steps=16,converter=int),
+              dict(name='average',min_val=10,max_val=60,steps=16,converter=int),
+              dict(name='duration',min_val=5,max_val=20,steps=8,converter=int)]:
+        o.add_parameter(p)
+    return o
+
+
+def walk_forward(data, workers, warmup=None):
+    w = WalkForward(optimizer(), ListFeed(data))
+    w.warmup = warmup
+    w.in_sample = timedelta(300)
+    w.out_sample = timedelta(100)
+    w.workers = workers
+    w.seed = 11
+    w.run()
+    return w
+
+
+def test_walk_forward():
+    data = bars(900)
+    w = walk_forward(data, 1)
+
+    ## daily bars: 300 in, 100 out, 6 windows to the end of the data
+    results = w.results
+    assert list(results['window']) == range(6)
+    assert list(results['in_bars']) == [300] * 6 and list(results['out_bars']) == [100] * 6
+    assert len(w.curve) == 600
+    assert list(w.curve['timestamp']) == [ m.timestamp for m in data[300:] ]
+
+    ## each window's best params replayed from the start of its in-sample
+    ## bars (indicators warm), counted from the first out-of-sample bar on
+    end = 0
+    for k, row in results.iterrows():
+        params = dict(average=row['average'], momentum=row['momentum'], duration=row['duration'])
+        s = Simulator()
+        s.verbose = False
+        s.add_strategy(RetraceStrategy('R', strategy_params=params))
+        s.run(ListFeed(data[100 * k:400 + 100 * k]))
+        begin = data[300 + 100 * k].timestamp
+
+        full = s.portfolio.storage['curve']['portfolio']
+        before = full[full['timestamp'] < begin]['mtm_pnl'].values
+        mtm = full[full['timestamp'] >= begin]['mtm_pnl'].values - (before[-1] if len(before) else 0)
+        trades = s.portfolio.storage['trades']['portfolio', 'SPY']
+        closed = trades[(trades['timestamp'] >= begin) & trades['pnl'].notnull()]
+        assert row['out_mtm_pnl'] == mtm[-1] and row['out_cnt'] == len(closed)
+        assert row['out_max_equ'] == mtm.max()
+
+        ## carried on from the end of the last window
+        curve = w.curve[w.curve['window'] == k]
+        assert numpy.allclose(curve['mtm_pnl'].values, mtm + end)
+        end = curve['mtm_pnl'].iloc[-1]
+        assert w.stats_map[k][0]['mtm_pnl'] == row['in_mtm_pnl']
+
+    ## a short warm-up: the replay starts 60 bars before each window
+    short = walk_forward(data, 1, warmup=60)
+    assert short.results[['average','momentum','duration']].equals(results[['average','momentum','duration']])
+    for k, row in short.results.iterrows():
+        params = dict(average=row['average'], momentum=row['momentum'], duration=row['duration'])
+        s = Simulator()
+        s.verbose = False
+        s.add_strategy(RetraceStrategy('R', strategy_params=params))
+        s.run(ListFeed(data[240 + 100 * k:400 + 100 * k]))
+        full = s.portfolio.storage['curve']['portfolio']
+        before = full[full['timestamp'] < data[300 + 100 * k].timestamp]['mtm_pnl'].values
+        assert row['out_mtm_pnl'] == full['mtm_pnl'].values[-1] - (before[-1] if len(before) else 0)
+
+    assert w.stats['mtm_pnl'] == end and w.stats['windows'] == 6
+    assert w.stats['cnt'] == results['out_cnt'].sum()
+
+    ## windows in parallel: the same runs
+    p = walk_forward(data, 3)
+    assert p.results.to_csv() == results.to_csv()
+    assert p.curve.to_csv() == w.curve.to_csv()
+
+
+if __name__ == '__main__':
+
+    run_tests([ test_bar_array, test_walk_forward ])